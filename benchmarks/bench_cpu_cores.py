@@ -0,0 +1,47 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Renders chords of increasing size (sustained notes, so that voices pile up)
+# with FluidSynth mixing voices in 1, 2, 4, ... threads (synth.cpu-cores).
+# Needs libfluidsynth and the default soundfont. Run as
+# "python benchmarks/bench_cpu_cores.py [max cores]".
+
+import sys
+import time
+
+import doremi
+import doremi.fluidsynth
+
+# enough voices that none are stolen, even for the biggest chords
+quality = doremi.fluidsynth.Quality(44100, True, True, 4, 4096)
+
+names = ["do", "re", "mi", "fa", "so", "la", "ti"]
+octaves = [",,", ",", "", "'", "''"]
+
+
+def source(chord_size):
+    # every line strikes its note 64 times, holding it for 8 beats each time
+    notes = [name + octave for octave in octaves for name in names][:chord_size]
+    return "\n".join(f"{x}:8 * 64" for x in notes)
+
+
+def timed(events, cpu_cores):
+    with doremi.fluidsynth.pool.synth(quality=quality, cpu_cores=cpu_cores) as synth:
+        start = time.perf_counter()
+        synth.midi_synthesize(events)
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    max_cores = (
+        int(sys.argv[1]) if len(sys.argv) > 1 else doremi.fluidsynth.available_cores()
+    )
+    cores = [1]
+    while cores[-1] * 2 <= max_cores:
+        cores.append(cores[-1] * 2)
+
+    print("chord size" + "".join(f"{x:8d} core(s)" for x in cores))
+    for chord_size in [4, 8, 16, 32]:
+        events = doremi.compose(source(chord_size)).midi_event_array()
+        timed(events, 1)  # load the soundfont
+        seconds = [timed(events, x) for x in cores]
+        print(f"{chord_size:10d}" + "".join(f"{x:16.3f}" for x in seconds))
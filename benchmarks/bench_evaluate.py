@@ -0,0 +1,52 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Each level of nesting passes its parameter to the next level twice, so if
+# arguments were re-evaluated at every reference, the work would double with
+# each level. Run as "python benchmarks/bench_evaluate.py [max depth]".
+
+import sys
+import time
+
+import doremi.abstract
+
+
+def source(depth):
+    # parameter names must differ because free names are dynamically scoped
+    lines = ["f0(x0) = x0 x0>1 x0'"]
+    for i in range(1, depth + 1):
+        lines.append(f"f{i}(x{i}) = f{i - 1}(x{i}) f{i - 1}({{x{i}}}+)")
+    lines.append(f"f{depth}({{do re mi}})")
+    return "\n\n".join(lines)
+
+
+def run(depth):
+    collection = doremi.abstract.abstracttree(source(depth))
+
+    original = doremi.abstract.evaluate
+    calls = 0
+
+    def counting(*args):
+        nonlocal calls
+        calls += 1
+        return original(*args)
+
+    doremi.abstract.evaluate = counting
+    try:
+        start = time.perf_counter()
+        _, notes, _ = collection.evaluate(None, doremi.abstract.CallCache())
+        stop = time.perf_counter()
+    finally:
+        doremi.abstract.evaluate = original
+
+    return len(notes), calls, stop - start
+
+
+if __name__ == "__main__":
+    max_depth = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print("depth    notes    evaluate calls    calls/note    seconds")
+    for depth in range(1, max_depth + 1):
+        num_notes, calls, seconds = run(depth)
+        print(
+            f"{depth:5d} {num_notes:8d} {calls:17d} {calls / num_notes:13.2f}"
+            f" {seconds:10.4f}"
+        )
@@ -0,0 +1,49 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Renders dense tuplets with events at their exact samples and snapped to grids
+# of 16, 64, and 256 samples, reporting the number of writes to FluidSynth (and
+# how many are shorter than FluidSynth's 64-sample block), the time, and the
+# largest timing error that each grid introduces. Needs libfluidsynth and the
+# default soundfont. Run as "python benchmarks/bench_grid.py [repetitions]".
+
+import sys
+import time
+
+import numpy as np
+
+import doremi
+import doremi.fluidsynth
+
+
+def source(repetitions):
+    # tuplets of 5, 7, ... 16 notes per eighth note against each other: their
+    # changes are often only a few samples apart
+    return "\n".join(
+        f"{{do re mi}}:1/{n} * {n * repetitions}" for n in [5, 7, 9, 11, 13, 16]
+    )
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    events = doremi.compose(source(repetitions)).midi_event_array()
+    with doremi.fluidsynth.pool.synth() as synth:
+        sample_rate = synth.sample_rate
+        synth.midi_synthesize(events[:10])  # load the soundfont
+
+    print("grid    writes    short    seconds    speedup    max error (ms)")
+    exact_seconds = None
+    for grid in [None, 16, 64, 256]:
+        index = (sample_rate * events["time"]).astype(np.int64)
+        starts = np.unique(doremi.fluidsynth.grid_index(index, grid))
+        writes, short = len(starts), int(np.sum(np.diff(starts) < 64))
+        with doremi.fluidsynth.pool.synth() as synth:
+            start = time.perf_counter()
+            synth.midi_synthesize(events, grid)
+            seconds = time.perf_counter() - start
+        if exact_seconds is None:
+            exact_seconds = seconds
+        error = doremi.fluidsynth.timing_error(events, sample_rate, grid)
+        print(
+            f"{str(grid):>4s} {writes:9d} {short:8d} {seconds:10.3f}"
+            f" {exact_seconds / seconds:10.2f} {1000 * error:17.3f}"
+        )
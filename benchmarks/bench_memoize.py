@@ -0,0 +1,58 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Renders loop-heavy music straight through and with repeated phrases rendered
+# once (Fluidsynth.phrase_synthesize), reporting the number of phrases, the
+# number of distinct ones, the speedup, and the relative RMS difference. Needs
+# libfluidsynth and the default soundfont. Run as
+# "python benchmarks/bench_memoize.py [repetitions]".
+
+import sys
+import time
+
+import numpy as np
+
+import doremi
+import doremi.fluidsynth
+
+definitions = "riff = {do re mi so}*2 fa:2 mi:2 re:4\n\nbass = do,:8 so,,:8\n\n"
+
+
+def sources(repetitions):
+    # the same loops as a repeated group, against a held bass line, and as
+    # repeated calls of user-defined phrases
+    n = 8 * repetitions
+    yield "one line", f"{{do re mi fa so:4}} * {n}"
+    yield "melody and bass", f"{{do re mi fa so:4}} * {n}\n{{do,:8}} * {n}"
+    yield "repeated calls", definitions + f"{{riff riff>}} * {n // 4}\nbass * {n // 4}"
+
+
+def timed(function, events):
+    start = time.perf_counter()
+    array = function(events)
+    return array, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print(
+        "music              phrases  distinct  straight (s)  memoized (s)"
+        "  speedup  relative RMS difference"
+    )
+    for name, source in sources(repetitions):
+        events = doremi.compose(source).midi_event_array()
+        phrases = doremi.fluidsynth.phrases(events, 44100)
+        distinct = len({key for _, _, key in phrases})
+        with doremi.fluidsynth.pool.synth(dtype="f4") as synth:
+            synth.midi_synthesize(events[:10])  # load the soundfont
+        with doremi.fluidsynth.pool.synth(dtype="f4") as synth:
+            straight, straight_seconds = timed(synth.midi_synthesize, events)
+        with doremi.fluidsynth.pool.synth(dtype="f4") as synth:
+            memoized, memoized_seconds = timed(synth.phrase_synthesize, events)
+        rms = np.sqrt(np.mean(straight**2))
+        difference = np.sqrt(np.mean((straight - memoized) ** 2)) / rms
+        print(
+            f"{name:16s} {len(phrases):9d} {distinct:9d} {straight_seconds:13.3f}"
+            f" {memoized_seconds:13.3f} {straight_seconds / memoized_seconds:8.1f}"
+            f" {difference:24.5f}"
+        )
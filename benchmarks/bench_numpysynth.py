@@ -0,0 +1,61 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Throughput (samples of audio per second of rendering) of the NumPy synth, both
+# additive and wavetable, and of FluidSynth (if libfluidsynth and the default
+# soundfont are available) as the number of notes per second grows. Run as
+# "python benchmarks/bench_numpysynth.py".
+
+import time
+
+import doremi
+import doremi.fluidsynth
+import doremi.numpysynth
+
+names = ["do", "re", "mi", "fa", "so", "la", "ti"]
+octaves = [",,", ",", "", "'", "''"]
+seconds_of_audio = 28
+
+
+def source(num_lines):
+    # line k is a scale of eighth notes (4 per second at 120 bpm) that starts on
+    # its own degree and octave, so that no two lines play the same pitch at once
+    lines = []
+    for k in range(num_lines):
+        scale = names[k % 7 :] + names[: k % 7]
+        notes = " ".join(x + octaves[k // 7] for x in scale)
+        lines.append(f"{{{notes}}}*{seconds_of_audio * 4 // 7}")
+    return "\n".join(lines)
+
+
+def throughput(render):
+    start = time.perf_counter()
+    array = render()
+    return len(array) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    has_fluidsynth = doremi.fluidsynth.has_library()
+    additive = doremi.numpysynth.NumpySynth(method="additive")
+    wavetable = doremi.numpysynth.NumpySynth(method="wavetable")
+
+    print("notes/second    additive   wavetable  fluidsynth  (samples/second)")
+    for num_lines in [1, 2, 4, 8, 16, 32]:
+        composition = doremi.compose(source(num_lines))
+        notes = composition.note_array()
+        events = composition.midi_event_array()
+        density = len(notes) / notes["stop"].max()
+
+        row = [
+            throughput(lambda: additive.synthesize(notes)),
+            throughput(lambda: wavetable.synthesize(notes)),
+        ]
+        if has_fluidsynth:
+            with doremi.fluidsynth.pool.synth() as synth:
+                synth.midi_synthesize(events)  # load the soundfont
+                row.append(throughput(lambda: synth.midi_synthesize(events)))
+
+        print(
+            f"{density:12.1f}"
+            + "".join(f"{x:12.3g}" for x in row)
+            + ("" if has_fluidsynth else "         n/a")
+        )
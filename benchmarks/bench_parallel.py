@@ -0,0 +1,52 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Renders the same few minutes of music serially and with 2, 4, ... processes
+# (time segments crossfaded together). Needs libfluidsynth and the default
+# soundfont. Run as "python benchmarks/bench_parallel.py [max processes]".
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import doremi
+import doremi.fluidsynth
+
+source = """
+{do re mi fa so la ti do'}*40 _:4 {do' ti la so fa mi re do}*40
+{do,. so,,. mi,. so,,.}*40 _:4 {do,:4 fa,:4}*20
+{_ mi _ so _ do' _}*40 _:4 {mi:3 so:3 do':2}*20
+"""
+
+
+def run(composition, events, processes):
+    start = time.perf_counter()
+    if processes == 1:
+        array = composition.fluidsynth(dtype="f4")
+    else:
+        array = doremi.fluidsynth.parallel_synthesize(events, processes, dtype="f4")
+    return array, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    max_processes = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    composition = doremi.compose(source)
+    events = composition.midi_event_array()
+
+    # the first render loads the soundfont into the pool
+    serial, seconds = run(composition, events, 1)
+    serial, seconds = run(composition, events, 1)
+    audio_seconds = len(serial) / 44100
+    rms = np.sqrt(np.mean(serial**2))
+
+    print("processes    seconds    speedup    x real time    relative RMS difference")
+    processes = 1
+    while processes <= max_processes:
+        array, this_seconds = run(composition, events, processes)
+        difference = np.sqrt(np.mean((array - serial) ** 2)) / rms
+        print(
+            f"{processes:9d} {this_seconds:10.3f} {seconds / this_seconds:10.2f}"
+            f" {audio_seconds / this_seconds:14.1f} {difference:26.5f}"
+        )
+        processes *= 2
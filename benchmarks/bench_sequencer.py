@@ -0,0 +1,44 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# Compares Fluidsynth.midi_synthesize (a ctypes call for every change and
+# every gap between changes) with Fluidsynth.sequence_synthesize (all events
+# queued in a FluidSynth sequencer, then a few large writes) on dense trills
+# and cluster chords. Needs libfluidsynth and the default soundfont. Run as
+# "python benchmarks/bench_sequencer.py [repetitions]".
+
+import sys
+import time
+
+import doremi
+import doremi.fluidsynth
+
+
+def sources(repetitions):
+    yield "trills", f"{{do re}}:1/8 * {64 * repetitions}"
+    yield "tuplet trills", f"{{do re mi}}:1/12 * {64 * repetitions}"
+    names = ["do", "re", "mi", "fa", "so", "la", "ti", "do'"]
+    cluster = "\n".join(f"{{{x}:1/4 _:1/4}} * {16 * repetitions}" for x in names)
+    yield "cluster chords", cluster
+
+
+def timed(function, events):
+    start = time.perf_counter()
+    function(events)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    print("music                events    loop (s)    sequencer (s)    speedup")
+    for name, source in sources(repetitions):
+        composition = doremi.compose(source)
+        events = composition.midi_event_array()
+        with doremi.fluidsynth.pool.synth() as synth:
+            loop = timed(synth.midi_synthesize, events)
+        with doremi.fluidsynth.pool.synth() as synth:
+            sequencer = timed(synth.sequence_synthesize, events)
+        print(
+            f"{name:16s} {len(events):10d} {loop:11.3f} {sequencer:16.3f}"
+            f" {loop / sequencer:10.2f}"
+        )
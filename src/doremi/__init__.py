@@ -2,26 +2,50 @@
 
 from ._version import version as __version__
 
-from typing import Optional
+import importlib
+from typing import TYPE_CHECKING, Optional
 
-import doremi.parsing
-import doremi.abstract
-import doremi.concrete
+if TYPE_CHECKING:
+    import doremi.abstract
+    import doremi.concrete
+
+
+# submodules are imported on first use, so that "import doremi" doesn't pay for
+# lark, NumPy, and the parser tables until they're needed
+submodules = (
+    "parsing",
+    "abstract",
+    "concrete",
+    "fluidsynth",
+    "numpysynth",
+    "cache",
+    "lilypond",
+)
+
+
+def __getattr__(name: str) -> object:
+    if name in submodules:
+        return importlib.import_module(f"doremi.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def compose(
     source: str,
-    scale: doremi.concrete.AnyScale = "C major",
+    scale: "doremi.concrete.AnyScale" = "C major",
     bpm: float = 120.0,
-    scope: Optional[doremi.abstract.Scope] = None,
-) -> doremi.concrete.Composition:
+    scope: Optional["doremi.abstract.Scope"] = None,
+) -> "doremi.concrete.Composition":
+    import doremi.abstract
+    import doremi.concrete
 
     scale = doremi.concrete.get_scale(scale)
     abstract_collection = doremi.abstract.abstracttree(source)
-    num_beats, abstract_notes, scope = abstract_collection.evaluate(scope)
+    call_cache = doremi.abstract.CallCache()
+    num_beats, abstract_notes, scope = abstract_collection.evaluate(scope, call_cache)
+    call_cache.results.clear()  # only its hits and misses are kept
 
     return doremi.concrete.Composition(
-        scale, bpm, num_beats, scope, abstract_collection, abstract_notes
+        scale, bpm, num_beats, scope, abstract_collection, abstract_notes, call_cache
     )
 
 
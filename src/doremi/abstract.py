@@ -1,10 +1,26 @@
 # BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
 
+import bisect
+import collections.abc
+import heapq
+import itertools
 from fractions import Fraction
-from dataclasses import dataclass, field
-from typing import List, Tuple, Dict, Optional, Union, Generator
+from dataclasses import dataclass, field, fields
+from typing import (
+    FrozenSet,
+    List,
+    Tuple,
+    Dict,
+    Optional,
+    Union,
+    Generator,
+    Hashable,
+    Iterator,
+    Callable,
+)
 
 import lark
+import numpy as np
 
 import doremi.parsing
 
@@ -41,6 +57,416 @@ class AbstractNote:
         self.stop *= scale
 
 
+class LazyNotes(collections.abc.Sequence):
+    # A sequence of AbstractNotes that isn't materialized: repetitions are kept
+    # as one block and copies are made on the fly, while iterating. Notes are
+    # never modified after evaluate makes them, so blocks can be shared.
+
+    def __iter__(self) -> Iterator[AbstractNote]:
+        return iterate_notes(self)
+
+    def __getitem__(
+        self, where: Union[int, slice]
+    ) -> Union[AbstractNote, List[AbstractNote]]:
+        if isinstance(where, slice):
+            return [self[i] for i in range(*where.indices(len(self)))]
+        if where < 0:
+            where += len(self)
+        if not 0 <= where < len(self):
+            raise IndexError(where)
+        return self.get(where)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, collections.abc.Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+        else:
+            return False
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} of {len(self)} notes>"
+
+
+class TiledNotes(LazyNotes):
+    # Tile i is the block shifted by i * period, and then each (factor, shift)
+    # in steps is applied to every time, in order, the same operations that
+    # enclosing nodes would apply to the expanded copies.
+
+    def __init__(
+        self,
+        block: "Notes",
+        period: float,
+        repetition: int,
+        steps: Tuple[Tuple[float, float], ...] = (),
+    ):
+        self.block = block
+        self.period = period
+        self.repetition = repetition
+        self.steps = steps
+        self.length = len(block) * repetition
+
+    def __len__(self) -> int:
+        return self.length
+
+    def get(self, index: int) -> AbstractNote:
+        tile, index = divmod(index, len(self.block))
+        return moved(shifted(self.block[index], tile * self.period), self.steps)
+
+
+class JoinedNotes(LazyNotes):
+    def __init__(self, parts: List["Notes"], simultaneous: bool):
+        # parts of a sequence follow one another in time; simultaneous parts
+        # (lines of a passage) overlap and have to be merged to be time-ordered
+        self.parts = parts
+        self.simultaneous = simultaneous
+        self.starts = [0]
+        for part in parts:
+            self.starts.append(self.starts[-1] + len(part))
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def get(self, index: int) -> AbstractNote:
+        i = bisect.bisect_right(self.starts, index) - 1
+        return self.parts[i][index - self.starts[i]]
+
+
+class Interned:
+    # words and augmentation chains, numbered in order of first appearance; a
+    # word is identified by its text, a chain by its structure
+    def __init__(self):
+        self.words: List["Word"] = []
+        self.chains: List[Tuple["Augmentation"]] = []
+        self.word_ids: Dict[str, int] = {}
+        self.chain_ids: Dict[Hashable, int] = {}
+        self.chain_objects: Dict[Tuple[int, ...], tuple] = {}
+
+    def word_id(self, word: "Word") -> int:
+        out = self.word_ids.get(word.val)
+        if out is None:
+            out = self.word_ids[str(word.val)] = len(self.words)
+            self.words.append(word)
+        return out
+
+    def chain_id(self, chain: Tuple["Augmentation"]) -> int:
+        # chains are built from shared Augmentation objects, so this avoids
+        # computing the structure of each one
+        known = self.chain_objects.get(tuple(id(x) for x in chain))
+        if known is not None:
+            return known[0]
+        key = structure(chain)
+        out = self.chain_ids.get(key)
+        if out is None:
+            out = self.chain_ids[key] = len(self.chains)
+            self.chains.append(chain)
+        # chain is kept so that the ids of its items can't be reused
+        self.chain_objects[tuple(id(x) for x in chain)] = (out, chain)
+        return out
+
+
+class NoteTable(LazyNotes):
+    # Notes as columns: one NumPy array per field, with the word and augmentation
+    # chain of each note replaced by an index into Interned. Iterating over it
+    # or indexing it makes AbstractNotes. The line column is the number of each
+    # note's line within its passage, which AbstractNotes don't have (see lined).
+
+    def __init__(
+        self,
+        start: np.ndarray,
+        stop: np.ndarray,
+        symbol: np.ndarray,
+        emphasis: np.ndarray,
+        octave: np.ndarray,
+        chain: np.ndarray,
+        line: np.ndarray,
+        interned: Interned,
+    ):
+        self.start = start
+        self.stop = stop
+        self.symbol = symbol
+        self.emphasis = emphasis
+        self.octave = octave
+        self.chain = chain
+        self.line = line
+        self.interned = interned
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def get(self, index: int) -> AbstractNote:
+        return AbstractNote(
+            float(self.start[index]),
+            float(self.stop[index]),
+            self.interned.words[self.symbol[index]],
+            int(self.emphasis[index]),
+            int(self.octave[index]),
+            self.interned.chains[self.chain[index]],
+        )
+
+    def __iter__(self) -> Iterator[AbstractNote]:
+        words = self.interned.words
+        chains = self.interned.chains
+        for start, stop, symbol, emphasis, octave, chain in zip(
+            self.start.tolist(),
+            self.stop.tolist(),
+            self.symbol.tolist(),
+            self.emphasis.tolist(),
+            self.octave.tolist(),
+            self.chain.tolist(),
+        ):
+            yield AbstractNote(
+                start, stop, words[symbol], emphasis, octave, chains[chain]
+            )
+
+    def columns(self) -> Tuple[np.ndarray, ...]:
+        return (
+            self.start,
+            self.stop,
+            self.symbol,
+            self.emphasis,
+            self.octave,
+            self.chain,
+            self.line,
+        )
+
+    def take(self, indexes: np.ndarray) -> "NoteTable":
+        return NoteTable(*[x[indexes] for x in self.columns()], self.interned)
+
+    @classmethod
+    def from_notes(
+        cls, notes: "Notes", interned: Optional[Interned] = None
+    ) -> "NoteTable":
+        # expands repetitions, but with array operations, not note by note
+        if interned is None:
+            interned = Interned()
+        return NoteTable(*table_columns(notes, interned), interned)
+
+
+Notes = Union[List[AbstractNote], LazyNotes]
+
+
+def first_appearances(ids: np.ndarray) -> List[int]:
+    distinct, first = np.unique(ids, return_index=True)
+    return distinct[np.argsort(first)].tolist()
+
+
+def table_columns(notes: Notes, interned: Interned) -> Tuple[np.ndarray, ...]:
+    if isinstance(notes, NoteTable):
+        if notes.interned is interned:
+            return notes.columns()
+        start, stop, symbol, emphasis, octave, chain, line = notes.columns()
+        # only the words and chains that these notes use, in order of appearance
+        word_ids = np.zeros(len(notes.interned.words), np.int32)
+        for i in first_appearances(symbol):
+            word_ids[i] = interned.word_id(notes.interned.words[i])
+        chain_ids = np.zeros(len(notes.interned.chains), np.int32)
+        for i in first_appearances(chain):
+            chain_ids[i] = interned.chain_id(notes.interned.chains[i])
+        return (
+            start,
+            stop,
+            word_ids[symbol],
+            emphasis,
+            octave,
+            chain_ids[chain],
+            line,
+        )
+
+    elif isinstance(notes, TiledNotes):
+        start, stop, symbol, emphasis, octave, chain, line = table_columns(
+            notes.block, interned
+        )
+        shifts = np.arange(notes.repetition) * notes.period
+        start = start[np.newaxis, :] + shifts[:, np.newaxis]
+        stop = stop[np.newaxis, :] + shifts[:, np.newaxis]
+        for factor, shift in notes.steps:
+            start = start * factor + shift
+            stop = stop * factor + shift
+        return (
+            start.ravel(),
+            stop.ravel(),
+            np.tile(symbol, notes.repetition),
+            np.tile(emphasis, notes.repetition),
+            np.tile(octave, notes.repetition),
+            np.tile(chain, notes.repetition),
+            np.tile(line, notes.repetition),
+        )
+
+    elif isinstance(notes, JoinedNotes) and len(notes.parts) != 0:
+        parts = [table_columns(x, interned) for x in notes.parts]
+        return tuple(np.concatenate(x) for x in zip(*parts))
+
+    else:
+        return (
+            np.array([x.start for x in notes], np.float64),
+            np.array([x.stop for x in notes], np.float64),
+            np.array([interned.word_id(x.word) for x in notes], np.int32),
+            np.array([x.emphasis for x in notes], np.int32),
+            np.array([x.octave for x in notes], np.int32),
+            np.array([interned.chain_id(x.augmentations) for x in notes], np.int32),
+            np.zeros(len(notes), np.int32),
+        )
+
+
+def tabulated(notes: Notes, interned: Interned) -> Notes:
+    # a list of AbstractNotes as a NoteTable; other Notes are unchanged
+    if isinstance(notes, LazyNotes):
+        return notes
+    else:
+        return NoteTable(*table_columns(notes, interned), interned)
+
+
+def lined(notes: Notes, line: int) -> Notes:
+    # tabulated notes, all on the given line of their passage
+    if isinstance(notes, TiledNotes):
+        return TiledNotes(
+            lined(notes.block, line), notes.period, notes.repetition, notes.steps
+        )
+    elif isinstance(notes, JoinedNotes):
+        return JoinedNotes([lined(x, line) for x in notes.parts], notes.simultaneous)
+    else:
+        return NoteTable(
+            *notes.columns()[:-1],
+            np.full(len(notes), line, np.int32),
+            notes.interned,
+        )
+
+
+def shifted(note: AbstractNote, shift: float) -> AbstractNote:
+    if shift == 0.0:
+        return note
+    return AbstractNote(
+        note.start + shift,
+        note.stop + shift,
+        note.word,
+        note.emphasis,
+        note.octave,
+        note.augmentations,
+    )
+
+
+def moved(note: AbstractNote, steps: Tuple[Tuple[float, float], ...]) -> AbstractNote:
+    for factor, shift in steps:
+        note = AbstractNote(
+            note.start * factor + shift,
+            note.stop * factor + shift,
+            note.word,
+            note.emphasis,
+            note.octave,
+            note.augmentations,
+        )
+    return note
+
+
+def iterate_notes(notes: Notes) -> Iterator[AbstractNote]:
+    # shifts are applied from the innermost repetition outward, the same order
+    # of operations as NoteTable.from_notes
+    if isinstance(notes, TiledNotes):
+        for i in range(notes.repetition):
+            shift = i * notes.period
+            for note in iterate_notes(notes.block):
+                yield moved(shifted(note, shift), notes.steps)
+    elif isinstance(notes, JoinedNotes):
+        for part in notes.parts:
+            yield from iterate_notes(part)
+    else:
+        yield from notes
+
+
+def time_ordered(notes: Notes) -> Iterator[AbstractNote]:
+    # same as sorting by start (stably), but only one block at a time is sorted;
+    # every note in a tile starts before the next tile does
+    if isinstance(notes, TiledNotes):
+        block = notes.block
+        if isinstance(block, NoteTable):
+            block = block.take(np.argsort(block.start, kind="stable"))
+        elif not isinstance(block, LazyNotes):
+            block = sorted(block, key=lambda x: x.start)
+        for i in range(notes.repetition):
+            shift = i * notes.period
+            for note in time_ordered(block):
+                yield moved(shifted(note, shift), notes.steps)
+    elif isinstance(notes, JoinedNotes):
+        parts = [time_ordered(part) for part in notes.parts]
+        if notes.simultaneous:
+            yield from heapq.merge(*parts, key=lambda x: x.start)
+        else:
+            yield from itertools.chain.from_iterable(parts)
+    elif isinstance(notes, NoteTable):
+        if np.any(notes.start[1:] < notes.start[:-1]):
+            notes = notes.take(np.argsort(notes.start, kind="stable"))
+        yield from notes
+    else:
+        yield from sorted(notes, key=lambda x: x.start)
+
+
+def distinct_chains(notes: Notes) -> Iterator[Tuple["Augmentation"]]:
+    # the augmentations of every note, but not necessarily only once each
+    if isinstance(notes, NoteTable):
+        for chain in np.unique(notes.chain).tolist():
+            yield notes.interned.chains[chain]
+    elif isinstance(notes, TiledNotes):
+        yield from distinct_chains(notes.block)
+    elif isinstance(notes, JoinedNotes):
+        for part in notes.parts:
+            yield from distinct_chains(part)
+    else:
+        for note in notes:
+            yield note.augmentations
+
+
+def distinct_notes(notes: Notes) -> Iterator[AbstractNote]:
+    # each note object once, regardless of how many times it's repeated; the
+    # copies differ only in start and stop
+    if isinstance(notes, TiledNotes):
+        yield from distinct_notes(notes.block)
+    elif isinstance(notes, JoinedNotes):
+        for part in notes.parts:
+            yield from distinct_notes(part)
+    else:
+        yield from notes
+
+
+def joined(parts: List[Notes], simultaneous: bool, interned: Interned) -> Notes:
+    # Consecutive parts that aren't repetitions are merged into one NoteTable,
+    # which is how notes get into tables as they're evaluated: a sequence of
+    # single notes becomes a table, and then a part of its parent's table.
+    # Parts of a passage (lines) are merged the same way, because time_ordered
+    # sorts a NoteTable stably, the same order as merging its lines.
+    out: List[Notes] = []
+    run: List[Notes] = []
+    for part in parts + [None]:
+        if part is None or isinstance(part, (TiledNotes, JoinedNotes)):
+            columns, notes = [], []
+            for x in run:
+                if isinstance(x, NoteTable):
+                    if len(notes) != 0:
+                        columns.append(table_columns(notes, interned))
+                        notes = []
+                    columns.append(table_columns(x, interned))
+                else:
+                    notes.extend(x)
+            if len(notes) != 0:
+                columns.append(table_columns(notes, interned))
+            if len(columns) == 1:
+                out.append(NoteTable(*columns[0], interned))
+            elif len(columns) != 0:
+                out.append(
+                    NoteTable(*[np.concatenate(x) for x in zip(*columns)], interned)
+                )
+            run = []
+            if part is not None:
+                out.append(part)
+        elif len(part) != 0:
+            run.append(part)
+
+    if len(out) == 0:
+        return []
+    elif len(out) == 1:
+        return out[0]
+    else:
+        return JoinedNotes(out, simultaneous)
+
+
 @dataclass
 class Scope:
     symbols: Dict[lark.lexer.Token, "NamedPassage"]
@@ -58,6 +484,9 @@ class Scope:
 @dataclass
 class SubScope(Scope):
     parent: Scope
+    fingerprint: Optional[Hashable] = field(
+        default=None, repr=False, compare=False, hash=False
+    )
 
     def has(self, symbol: lark.lexer.Token) -> bool:
         if symbol in self.symbols:
@@ -72,6 +501,22 @@ class SubScope(Scope):
         else:
             return self.parent.get(symbol)
 
+    def structure(self) -> Hashable:
+        # everything that the bindings in this scope chain could contribute to
+        # an evaluation; the root Scope is fixed for the whole evaluation
+        if self.fingerprint is None:
+            parent = None
+            if isinstance(self.parent, SubScope):
+                parent = self.parent.structure()
+            self.fingerprint = (
+                tuple(
+                    (str(symbol), structure(passage))
+                    for symbol, passage in self.symbols.items()
+                ),
+                parent,
+            )
+        return self.fingerprint
+
 
 class AST:
     pass
@@ -123,6 +568,12 @@ class AugmentRatio(Augmentation):
     )
 
 
+@dataclass(frozen=True)
+class Placeholder(Augmentation):
+    # stands in for one of the augmentations at a reference to a Parameter
+    index: int
+
+
 @dataclass
 class Duration(AST):
     amount: Fraction
@@ -174,6 +625,30 @@ class NamedPassage(Passage):
     parsingtree: Optional[lark.tree.Tree] = field(
         default=None, repr=False, compare=False, hash=False
     )
+    symbols: Optional[FrozenSet[str]] = field(
+        default=None, repr=False, compare=False, hash=False
+    )
+
+    def referenced(self) -> FrozenSet[str]:
+        if self.symbols is None:
+            self.symbols = frozenset(referenced_symbols(self.lines))
+        return self.symbols
+
+
+def referenced_symbols(node: Union[list, AST]) -> Iterator[str]:
+    # every symbol that evaluating node looks up itself, not through other symbols
+    if isinstance(node, list):
+        for x in node:
+            yield from referenced_symbols(x)
+    elif isinstance(node, Word):
+        yield str(node.val)
+    elif isinstance(node, Call):
+        yield str(node.function.val)
+        yield from referenced_symbols(node.args)
+    elif isinstance(node, Modified):
+        yield from referenced_symbols(node.expression)
+    elif isinstance(node, Line):
+        yield from referenced_symbols(node.modified)
 
 
 @dataclass
@@ -184,6 +659,437 @@ class UnnamedPassage(Passage):
     )
 
 
+@dataclass
+class Parameter(NamedPassage):
+    # An argument bound to a function parameter. Like any symbol, it's evaluated
+    # in the scope where it's referenced, with Placeholders instead of the
+    # augmentations at the point of reference, and then copied into each
+    # reference. A note that lost k Placeholders to "@" drops the last k of the
+    # reference's augmentations. The result is reused by every reference that
+    # would evaluate it the same way (see dependencies).
+    scope: Optional["SubScope"] = field(
+        default=None, repr=False, compare=False, hash=False
+    )
+    results: Dict[Hashable, Tuple[int, float, Notes]] = field(
+        default_factory=dict, repr=False, compare=False, hash=False
+    )
+
+    def dependencies(self, scope: "SubScope") -> Hashable:
+        # References are in this Parameter's own SubScope or the ones below it,
+        # which bind the parameters of calls in between. Those bindings matter
+        # only if the argument could look up their names, directly or through
+        # the symbols that it refers to.
+        between = {}
+        subscope = scope
+        while subscope is not self.scope:
+            for symbol, passage in subscope.symbols.items():
+                between.setdefault(str(symbol), passage)
+            subscope = subscope.parent
+        if len(between) == 0:
+            return ()
+
+        seen = set()
+        stack = list(self.referenced())
+        while len(stack) != 0:
+            symbol = stack.pop()
+            if symbol not in seen:
+                seen.add(symbol)
+                passage = scope.get(symbol)
+                if passage is not None:
+                    stack.extend(passage.referenced())
+
+        return tuple(
+            (symbol, structure(between[symbol]))
+            for symbol in sorted(seen)
+            if symbol in between
+        )
+
+    def evaluate(
+        self,
+        scope: "SubScope",
+        breadcrumbs: Tuple[str],
+        emphasis: int,
+        octave: int,
+        augmentations: Tuple[Augmentation],
+        call_cache: Optional["CallCache"],
+        interned: Optional[Interned] = None,
+    ) -> Tuple[float, Notes]:
+        key = (breadcrumbs, self.dependencies(scope))
+        result = self.results.get(key)
+        if result is not None:
+            num_placeholders, duration, notes = result
+
+        if result is None or (
+            num_placeholders < len(augmentations)
+            and any(
+                len(x) == 0 or not isinstance(x[0], Placeholder)
+                for x in distinct_chains(notes)
+            )
+        ):
+            # "@" removed all of the Placeholders from some note, so the result
+            # doesn't say how many of these augmentations it would have removed
+            num_placeholders = max(len(augmentations), 1)
+            duration, notes = evaluate(
+                self,
+                scope,
+                0,
+                0,
+                tuple(Placeholder(i) for i in range(num_placeholders)),
+                breadcrumbs,
+                call_cache,
+                interned,
+            )
+            self.results[key] = (num_placeholders, duration, notes)
+
+        augmented = {}
+
+        def augment(inner: Tuple[Augmentation]) -> Tuple[Augmentation]:
+            # notes from the same part of the argument share the inner tuple
+            out = augmented.get(id(inner))
+            if out is not None:
+                return out
+            kept = 0
+            for augmentation in inner:
+                if not isinstance(augmentation, Placeholder):
+                    break
+                kept += 1
+            outer = augmentations[
+                : max(len(augmentations) - num_placeholders + kept, 0)
+            ]
+            out = augmented[id(inner)] = outer + inner[kept:]
+            return out
+
+        return duration, decorated(notes, emphasis, octave, augment)
+
+
+def structure(node: object) -> Hashable:
+    # hashable stand-in for an AST that ignores parsingtrees and token positions
+    if isinstance(node, (list, tuple)):
+        return tuple(structure(x) for x in node)
+    elif isinstance(node, AST):
+        return (type(node).__name__,) + tuple(
+            structure(getattr(node, x.name)) for x in fields(node) if x.compare
+        )
+    elif isinstance(node, lark.lexer.Token):
+        return str(node)
+    else:
+        return node
+
+
+@dataclass
+class CallCache:
+    results: Dict[Hashable, Tuple[NamedPassage, float, Notes]] = field(
+        default_factory=dict, repr=False
+    )
+    hits: int = 0
+    misses: int = 0
+
+
+def transformed(notes: Notes, factor: float, shift: float) -> Notes:
+    # Every time becomes time * factor + shift. Each caller passes a factor of
+    # 1 or a shift of 0, so this is exactly one multiplication or addition,
+    # the same rounding as shifting or scaling the notes in place.
+    if isinstance(notes, TiledNotes):
+        return TiledNotes(
+            notes.block,
+            notes.period,
+            notes.repetition,
+            notes.steps + ((factor, shift),),
+        )
+    elif isinstance(notes, JoinedNotes):
+        return JoinedNotes(
+            [transformed(x, factor, shift) for x in notes.parts], notes.simultaneous
+        )
+    elif isinstance(notes, NoteTable):
+        return NoteTable(
+            notes.start * factor + shift,
+            notes.stop * factor + shift,
+            notes.symbol,
+            notes.emphasis,
+            notes.octave,
+            notes.chain,
+            notes.line,
+            notes.interned,
+        )
+    else:
+        return [moved(x, ((factor, shift),)) for x in notes]
+
+
+def decorated(
+    notes: Notes,
+    emphasis: int,
+    octave: int,
+    augment: Callable[[Tuple["Augmentation"]], Tuple["Augmentation"]],
+) -> Notes:
+    if isinstance(notes, TiledNotes):
+        return TiledNotes(
+            decorated(notes.block, emphasis, octave, augment),
+            notes.period,
+            notes.repetition,
+            notes.steps,
+        )
+    elif isinstance(notes, JoinedNotes):
+        return JoinedNotes(
+            [decorated(x, emphasis, octave, augment) for x in notes.parts],
+            notes.simultaneous,
+        )
+    elif isinstance(notes, NoteTable):
+        # each distinct chain is augmented once
+        interned = notes.interned
+        chains, which = np.unique(notes.chain, return_inverse=True)
+        chain_ids = np.array(
+            [interned.chain_id(augment(interned.chains[x])) for x in chains.tolist()],
+            np.int32,
+        )
+        return NoteTable(
+            notes.start,
+            notes.stop,
+            notes.symbol,
+            notes.emphasis + emphasis,
+            notes.octave + octave,
+            chain_ids[which.reshape(-1)],
+            notes.line,
+            interned,
+        )
+    else:
+        return [
+            AbstractNote(
+                x.start,
+                x.stop,
+                x.word,
+                emphasis + x.emphasis,
+                octave + x.octave,
+                augment(x.augmentations),
+            )
+            for x in notes
+        ]
+
+
+def evaluate(
+        self,
+        scope: "SubScope",
+        breadcrumbs: Tuple[str],
+        emphasis: int,
+        octave: int,
+        augmentations: Tuple[Augmentation],
+        call_cache: Optional["CallCache"],
+        interned: Optional[Interned] = None,
+    ) -> Tuple[float, Notes]:
+        key = (breadcrumbs, self.dependencies(scope))
+        result = self.results.get(key)
+        if result is not None:
+            num_placeholders, duration, notes = result
+
+        if result is None or (
+            num_placeholders < len(augmentations)
+            and any(
+                len(x) == 0 or not isinstance(x[0], Placeholder)
+                for x in distinct_chains(notes)
+            )
+        ):
+            # "@" removed all of the Placeholders from some note, so the result
+            # doesn't say how many of these augmentations it would have removed
+            num_placeholders = max(len(augmentations), 1)
+            duration, notes = evaluate(
+                self,
+                scope,
+                0,
+                0,
+                tuple(Placeholder(i) for i in range(num_placeholders)),
+                breadcrumbs,
+                call_cache,
+                interned,
+            )
+            self.results[key] = (num_placeholders, duration, notes)
+
+        augmented = {}
+
+        def augment(inner: Tuple[Augmentation]) -> Tuple[Augmentation]:
+            # notes from the same part of the argument share the inner tuple
+            out = augmented.get(id(inner))
+            if out is not None:
+                return out
+            kept = 0
+            for augmentation in inner:
+                if not isinstance(augmentation, Placeholder):
+                    break
+                kept += 1
+            outer = augmentations[
+                : max(len(augmentations) - num_placeholders + kept, 0)
+            ]
+            out = augmented[id(inner)] = outer + inner[kept:]
+            return out
+
+        return duration, decorated(notes, emphasis, octave, augment)
+
+
+def structure(node: object) -> Hashable:
+    # hashable stand-in for an AST that ignores parsingtrees and token positions
+    if isinstance(node, (list, tuple)):
+        return tuple(structure(x) for x in node)
+    elif isinstance(node, AST):
+        return (type(node).__name__,) + tuple(
+            structure(getattr(node, x.name)) for x in fields(node) if x.compare
+        )
+    elif isinstance(node, lark.lexer.Token):
+        return str(node)
+    else:
+        return node
+
+
+@dataclass
+class CallCache:
+    results: Dict[Hashable, Tuple[NamedPassage, float, Notes]] = field(
+        default_factory=dict, repr=False
+    )
+    hits: int = 0
+    misses: int = 0
+
+
+def transformed(notes: Notes, factor: float, shift: float) -> Notes:
+    # Every time becomes time * factor + shift. Each caller passes a factor of
+    # 1 or a shift of 0, so this is exactly one multiplication or addition,
+    # the same rounding as shifting or scaling the notes in place.
+    if isinstance(notes, TiledNotes):
+        return TiledNotes(
+            notes.block,
+            notes.period,
+            notes.repetition,
+            notes.steps + ((factor, shift),),
+        )
+    elif isinstance(notes, JoinedNotes):
+        return JoinedNotes(
+            [transformed(x, factor, shift) for x in notes.parts], notes.simultaneous
+        )
+    elif isinstance(notes, NoteTable):
+        return NoteTable(
+            notes.start * factor + shift,
+            notes.stop * factor + shift,
+            notes.symbol,
+            notes.emphasis,
+            notes.octave,
+            notes.chain,
+            notes.line,
+            notes.interned,
+        )
+    else:
+        return [moved(x, ((factor, shift),)) for x in notes]
+
+
+def decorated(
+    notes: Notes,
+    emphasis: int,
+    octave: int,
+    augment: Callable[[Tuple["Augmentation"]], Tuple["Augmentation"]],
+) -> Notes:
+    if isinstance(notes, TiledNotes):
+        return TiledNotes(
+            decorated(notes.block, emphasis, octave, augment),
+            notes.period,
+            notes.repetition,
+            notes.steps,
+        )
+    elif isinstance(notes, JoinedNotes):
+        return JoinedNotes(
+            [decorated(x, emphasis, octave, augment) for x in notes.parts],
+            notes.simultaneous,
+        )
+    elif isinstance(notes, NoteTable):
+        # each distinct chain is augmented once
+        interned = notes.interned
+        chains, which = np.unique(notes.chain, return_inverse=True)
+        chain_ids = np.array(
+            [interned.chain_id(augment(interned.chains[x])) for x in chains.tolist()],
+            np.int32,
+        )
+        return NoteTable(
+            notes.start,
+            notes.stop,
+            notes.symbol,
+            notes.emphasis + emphasis,
+            notes.octave + octave,
+            chain_ids[which.reshape(-1)],
+            notes.line,
+            interned,
+        )
+    else:
+        return [
+            AbstractNote(
+                x.start,
+                x.stop,
+                x.word,
+                emphasis + x.emphasis,
+                octave + x.octave,
+                augment(x.augmentations),
+            )
+            for x in notes
+        ]
+
+
+def natural_duration(
+    node: Union[list, Word, Call, Modified, Line, Passage],
+    scope: Scope,
+    breadcrumbs: Tuple[str],
+    call_cache: Optional[CallCache] = None,
+) -> float:
+    # the duration that evaluate would return, without making any notes; it stops
+    # at Modified nodes with a fixed duration, so nesting them doesn't cost more
+    if isinstance(node, list):
+        return sum(natural_duration(x, scope, breadcrumbs, call_cache) for x in node)
+
+    elif isinstance(node, Word):
+        if scope.has(node.val):
+            return natural_duration(Call(node, []), scope, breadcrumbs, call_cache)
+        elif is_rest(node.val):
+            return float(len(node.val))
+        else:
+            return 1.0
+
+    elif isinstance(node, Call):
+        if node.function.val in breadcrumbs:
+            raise RecursiveFunction(node.function.val)
+
+        namedpassage = scope.get(node.function.val)
+        if namedpassage is None:
+            raise UndefinedSymbol(node.function.val)
+
+        parameters = namedpassage.assignment.args
+        arguments = node.args
+        if len(parameters) != len(arguments):
+            raise MismatchingArguments(node.function.val)
+
+        breadcrumbs = breadcrumbs + (node.function.val,)
+        if isinstance(namedpassage, Parameter):
+            return namedpassage.evaluate(scope, breadcrumbs, 0, 0, (), call_cache)[0]
+
+        subscope = SubScope({}, scope)
+        for param, arg in zip(parameters, arguments):
+            subscope.symbols[param.val] = Parameter(
+                Assignment(param, []), [arg], scope=subscope
+            )
+        return natural_duration(namedpassage, subscope, breadcrumbs, call_cache)
+
+    elif isinstance(node, Modified):
+        if node.duration is not None and not node.duration.is_scaling:
+            duration = float(node.duration.amount)
+        else:
+            duration = natural_duration(node.expression, scope, breadcrumbs, call_cache)
+            if node.duration is not None:
+                duration = duration * float(node.duration.amount)
+        return node.repetition * duration
+
+    elif isinstance(node, Line):
+        return natural_duration(node.modified, scope, breadcrumbs, call_cache)
+
+    elif isinstance(node, Passage):
+        return max(
+            natural_duration(x, scope, breadcrumbs, call_cache) for x in node.lines
+        )
+
+    else:
+        raise AssertionError(repr(node))
+
+
 def evaluate(
     node: Union[list, Word, Call, Modified, Line, Passage],
     scope: Scope,
@@ -191,27 +1097,49 @@ def evaluate(
     octave: int,
     augmentations: Tuple[Augmentation],
     breadcrumbs: Tuple[str],
-) -> Tuple[float, List[AbstractNote]]:
+    call_cache: Optional[CallCache] = None,
+    interned: Optional[Interned] = None,
+) -> Tuple[float, Notes]:
+    # Notes are timed within the node (starting at 0) and shifted or scaled by
+    # each enclosing node, one operation per level, so that every time is
+    # rounded the same way, however the notes are represented. The returned
+    # notes may be shared (by the CallCache or a Parameter), so they're never
+    # modified in place. Notes are tabulated as they're evaluated (see joined),
+    # all in the same Interned.
+
+    if interned is None:
+        interned = Interned()
 
     if isinstance(node, list):
         last_stop = 0.0
-        all_notes = []
+        parts = []
         for subnode in node:
             duration, notes = evaluate(
-                subnode, scope, emphasis, octave, augmentations, breadcrumbs
+                subnode,
+                scope,
+                emphasis,
+                octave,
+                augmentations,
+                breadcrumbs,
+                call_cache,
+                interned,
             )
-            for note in notes:
-                note.inplace_shift(last_stop)
-
-            all_notes.extend(notes)
+            parts.append(transformed(notes, 1.0, last_stop))
             last_stop += duration
 
-        return last_stop, all_notes
+        return last_stop, joined(parts, False, interned)
 
     elif isinstance(node, Word):
         if scope.has(node.val):
             return evaluate(
-                Call(node, []), scope, emphasis, octave, augmentations, breadcrumbs
+                Call(node, []),
+                scope,
+                emphasis,
+                octave,
+                augmentations,
+                breadcrumbs,
+                call_cache,
+                interned,
             )
         elif is_rest(node.val):
             return float(len(node.val)), []
@@ -239,88 +1167,123 @@ def evaluate(
         if len(parameters) != len(arguments):
             raise MismatchingArguments(node.function.val)
 
-        subscope = SubScope(
-            {
-                param.val: NamedPassage(Assignment(param, []), [arg])
-                for param, arg in zip(parameters, arguments)
-            },
-            scope,
-        )
+        if isinstance(namedpassage, Parameter):
+            return namedpassage.evaluate(
+                scope,
+                breadcrumbs + (node.function.val,),
+                emphasis,
+                octave,
+                augmentations,
+                call_cache,
+                interned,
+            )
+
+        if call_cache is not None:
+            key = (
+                id(namedpassage),
+                structure(arguments),
+                scope.structure() if isinstance(scope, SubScope) else None,
+                emphasis,
+                octave,
+                structure(augmentations),
+            )
+            cached = call_cache.results.get(key)
+            if cached is not None:
+                call_cache.hits += 1
+                _, duration, notes = cached
+                return duration, notes
+            call_cache.misses += 1
+
         breadcrumbs = breadcrumbs + (node.function.val,)
-        return evaluate(
-            namedpassage, subscope, emphasis, octave, augmentations, breadcrumbs
+        subscope = SubScope({}, scope)
+        for param, arg in zip(parameters, arguments):
+            subscope.symbols[param.val] = Parameter(
+                Assignment(param, []), [arg], scope=subscope
+            )
+        duration, notes = evaluate(
+            namedpassage,
+            subscope,
+            emphasis,
+            octave,
+            augmentations,
+            breadcrumbs,
+            call_cache,
+            interned,
         )
 
+        if call_cache is not None:
+            # namedpassage is kept in the value so that its id can't be reused
+            call_cache.results[key] = (namedpassage, duration, notes)
+
+        return duration, notes
+
     elif isinstance(node, Modified):
         if node.absolute > 0:
             augmentations = augmentations[: -node.absolute]
         if node.augmentation is not None:
             augmentations = augmentations + (node.augmentation,)
 
-        if isinstance(node.expression, Expression):
-            natural_duration, notes = evaluate(
-                node.expression,
-                scope,
-                emphasis + node.emphasis,
-                octave + node.octave,
-                augmentations,
-                breadcrumbs,
-            )
-
-        else:
-            natural_duration, notes = evaluate(
-                node.expression,
-                scope,
-                emphasis + node.emphasis,
-                octave + node.octave,
-                augmentations,
-                breadcrumbs,
-            )
+        duration, notes = evaluate(
+            node.expression,
+            scope,
+            emphasis + node.emphasis,
+            octave + node.octave,
+            augmentations,
+            breadcrumbs,
+            call_cache,
+            interned,
+        )
 
         if node.duration is not None:
             if node.duration.is_scaling:
                 factor = float(node.duration.amount)
-                natural_duration = natural_duration * factor
+                duration = duration * factor
             else:
-                factor = float(node.duration.amount) / natural_duration
-                natural_duration = float(node.duration.amount)
-            for note in notes:
-                note.inplace_scale(factor)
-
-        if node.repetition == 1:
-            duration = natural_duration
-
-        else:
-            all_notes = list(notes)
-            for i in range(1, node.repetition):
-                new_notes = [x.copy() for x in notes]
-                for note in new_notes:
-                    note.inplace_shift(i * natural_duration)
-                all_notes.extend(new_notes)
+                factor = float(node.duration.amount) / duration
+                duration = float(node.duration.amount)
+            notes = transformed(notes, factor, 0.0)
 
-            duration = node.repetition * natural_duration
-            notes = all_notes
+        if node.repetition != 1:
+            notes = TiledNotes(tabulated(notes, interned), duration, node.repetition)
+            duration = node.repetition * duration
 
         return duration, notes
 
     elif isinstance(node, Line):
         return evaluate(
-            node.modified, scope, emphasis, octave, augmentations, breadcrumbs
+            node.modified,
+            scope,
+            emphasis,
+            octave,
+            augmentations,
+            breadcrumbs,
+            call_cache,
+            interned,
         )
 
     elif isinstance(node, Passage):
         max_duration = 0.0
-        all_notes = []
-        for line in node.lines:
+        parts = []
+        for number, line in enumerate(node.lines):
             duration, notes = evaluate(
-                line, scope, emphasis, octave, augmentations, breadcrumbs
+                line,
+                scope,
+                emphasis,
+                octave,
+                augmentations,
+                breadcrumbs,
+                call_cache,
+                interned,
             )
 
-            all_notes.extend(notes)
+            if isinstance(node, UnnamedPassage):
+                # notes of called functions belong to the line that calls them
+                notes = lined(tabulated(notes, interned), number)
+            parts.append(notes)
             if max_duration < duration:
                 max_duration = duration
 
-        return max_duration, all_notes
+        return max_duration, joined(parts, True, interned)
 
     else:
         raise AssertionError(repr(node))
@@ -338,8 +1301,8 @@ class Collection(AST):
     source: Optional[str] = field(default=None, repr=False, compare=False, hash=False)
 
     def evaluate(
-        self, scope: Optional[Scope]
-    ) -> Tuple[float, List[AbstractNote], Scope]:
+        self, scope: Optional[Scope], call_cache: Optional[CallCache] = None
+    ) -> Tuple[float, Notes, Scope]:
         if scope is None:
             scope = Scope({})
         unnamed_passages: List[UnnamedPassage] = []
@@ -350,7 +1313,9 @@ class Collection(AST):
                 unnamed_passages.append(passage)
 
         try:
-            duration, notes = evaluate(unnamed_passages, scope, 0, 0, (), ())
+            duration, notes = evaluate(
+                unnamed_passages, scope, 0, 0, (), (), call_cache
+            )
         except DoremiError as err:
             err.source = self.source
             raise
@@ -379,7 +1344,7 @@ def get_comments(
             raise AssertionError(repr(node))
 
     else:
-        if node.type == "BLANK" or node.type == "BLANK_END":
+        if node.type in ("BLANK", "NEWLINE", "BREAK", "BLANK_END"):
             yield node
         else:
             raise AssertionError(repr(node))
@@ -408,11 +1373,16 @@ def to_ast(node: Union[lark.tree.Tree, lark.lexer.Token]) -> AST:
             assert 1 <= len(node.children) <= 2
 
             subnode1 = node.children[0]
-            assert isinstance(subnode1, lark.lexer.Token) and subnode1.type == "WORD"
+            assert (
+                isinstance(subnode1, lark.lexer.Token) and subnode1.type == "FUNCTION"
+            )
             if is_rest(subnode1):
                 raise SymbolAllUnderscores(subnode1)
 
-            function = Word(subnode1)
+            # FUNCTION differs from WORD only by lookahead; symbols are WORDs
+            function = Word(
+                lark.lexer.Token.new_borrow_pos("WORD", str(subnode1), subnode1)
+            )
 
             if len(node.children) == 2:
                 subnode2 = node.children[1]
@@ -646,9 +1616,9 @@ def to_ast(node: Union[lark.tree.Tree, lark.lexer.Token]) -> AST:
             raise AssertionError(repr(node))
 
 
-def abstracttree(source: str) -> AST:
+def abstracttree(source: str, parser: str = "lalr") -> AST:
     try:
-        parsingtree = doremi.parsing.parsingtree(source)
+        parsingtree = doremi.parsing.parsingtree(source, parser)
     except lark.exceptions.LarkError as err:
         raise ParsingError(err, source)
 
@@ -0,0 +1,149 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+
+def file_digest(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(2**20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def soundfont_digest(path: str) -> str:
+    # SoundFonts are big, so each one is only read again if it changes
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = soundfont_digest.cache.get(key)
+    if digest is None:
+        digest = soundfont_digest.cache[key] = file_digest(path)
+    return digest
+
+
+soundfont_digest.cache = {}
+
+
+class RenderCache:
+    # Rendered audio in a directory, as one .npy file per render (read back as
+    # a numpy.memmap) and a .json file with the digest of its contents. Entries
+    # are named by a hash of everything that determines the audio: the events,
+    # the SoundFont's contents, and the synth settings. When the total size is
+    # over max_bytes, the least recently used entries are removed.
+
+    def __init__(self, directory: str, max_bytes: int = 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(
+        self,
+        events: np.ndarray,
+        soundfont: Optional[str],
+        settings: Dict[str, object],
+    ) -> str:
+        # settings must have a stable repr, such as strings, numbers, and the
+        # doremi.fluidsynth.Quality dataclass; soundfont is None for renders
+        # that don't use one
+        hasher = hashlib.sha256()
+        hasher.update(repr(events.dtype.descr).encode())
+        hasher.update(np.ascontiguousarray(events).tobytes())
+        if soundfont is not None:
+            hasher.update(soundfont_digest(soundfont).encode())
+        hasher.update(repr(sorted(settings.items())).encode())
+        return hasher.hexdigest()
+
+    def path(self, key: str, extension: str = ".npy") -> str:
+        return os.path.join(self.directory, key + extension)
+
+    def keys(self) -> List[str]:
+        return sorted(
+            x[: -len(".npy")] for x in os.listdir(self.directory) if x.endswith(".npy")
+        )
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self.path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            self.remove(key)  # truncated or not an array
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            pass  # evicted by another process, but still mapped
+        return array
+
+    def put(self, key: str, array: np.ndarray):
+        # written to temporary files and then renamed, so a concurrent get never
+        # sees half of an entry
+        descriptor, data = tempfile.mkstemp(".tmp", key + ".", self.directory)
+        with os.fdopen(descriptor, "wb") as file:
+            np.save(file, array)
+
+        descriptor, metadata = tempfile.mkstemp(".tmp", key + ".", self.directory)
+        with os.fdopen(descriptor, "w") as file:
+            json.dump({"sha256": file_digest(data)}, file)
+
+        os.replace(metadata, self.path(key, ".json"))
+        os.replace(data, self.path(key))
+        self.evict(keep=key)
+
+    def remove(self, key: str):
+        for extension in (".npy", ".json"):
+            try:
+                os.remove(self.path(key, extension))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, keep: Optional[str] = None):
+        entries = []
+        for key in self.keys():
+            try:
+                stat = os.stat(self.path(key))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, key))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                self.remove(key)
+                total -= size
+
+    def verify(self, remove: bool = True) -> List[str]:
+        # keys of the entries whose contents don't match their digest
+        bad = []
+        for key in self.keys():
+            try:
+                with open(self.path(key, ".json")) as file:
+                    expected = json.load(file)["sha256"]
+                good = file_digest(self.path(key)) == expected
+            except (OSError, ValueError, KeyError):
+                good = False
+            if not good:
+                bad.append(key)
+                if remove:
+                    self.remove(key)
+        return bad
+
+    def clear(self):
+        for key in self.keys():
+            self.remove(key)
+
+
+def get_cache(cache: Union[str, RenderCache]) -> RenderCache:
+    if isinstance(cache, RenderCache):
+        return cache
+    return RenderCache(cache)
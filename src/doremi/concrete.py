@@ -1,17 +1,38 @@
 # BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
 
 import csv
+import heapq
+import itertools
 import math
 import numbers
-import pkg_resources
+import os
 import re
 import sys
 
+if sys.version_info >= (3, 9):
+    import importlib.resources as importlib_resources
+else:
+    import importlib_resources
+
 from fractions import Fraction
 from dataclasses import dataclass, field
-from typing import List, Set, Tuple, Dict, Mapping, Optional, Union, TextIO, Callable
+from typing import (
+    List,
+    Set,
+    Tuple,
+    Dict,
+    Mapping,
+    Optional,
+    Union,
+    TextIO,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
+)
 
 import lark
+import numpy as np
 
 import doremi.abstract
 
@@ -47,15 +68,13 @@ class RealNote(Note):
             return RealNote(self.frequency * 2 ** (augmentation.amount / 12.0))
 
         elif isinstance(augmentation, doremi.abstract.AugmentDegree):
-            scale_notes = list(scale.notes.values())
-            for i, note in enumerate(scale_notes):
-                if self.same_pitch_class(note):
-                    octaves = note.octaves_difference(self)
-                    more_octaves = (i + augmentation.amount) // len(scale_notes)
-                    out = scale_notes[(i + augmentation.amount) % len(scale_notes)]
-                    return out.with_octave(octaves + more_octaves)
-            else:
+            i = scale.degree(self)
+            if i is None:
                 raise doremi.abstract.NoteNotInScale(augmentation.parsingtree)
+            octaves = scale.degrees[i].octaves_difference(self)
+            more_octaves = (i + augmentation.amount) // len(scale.degrees)
+            out = scale.degrees[(i + augmentation.amount) % len(scale.degrees)]
+            return out.with_octave(octaves + more_octaves)
 
         elif isinstance(augmentation, doremi.abstract.AugmentRatio):
             return RealNote(self.frequency * float(augmentation.amount))
@@ -108,15 +127,13 @@ class MIDINote(Note):
             return MIDINote(self.pitch + augmentation.amount)
 
         elif isinstance(augmentation, doremi.abstract.AugmentDegree):
-            scale_notes = list(scale.notes.values())
-            for i, note in enumerate(scale_notes):
-                if self.same_pitch_class(note):
-                    octaves = note.octaves_difference(self)
-                    more_octaves = (i + augmentation.amount) // len(scale_notes)
-                    out = scale_notes[(i + augmentation.amount) % len(scale_notes)]
-                    return out.with_octave(octaves + more_octaves)
-            else:
+            i = scale.degree(self)
+            if i is None:
                 raise doremi.abstract.NoteNotInScale(augmentation.parsingtree)
+            octaves = scale.degrees[i].octaves_difference(self)
+            more_octaves = (i + augmentation.amount) // len(scale.degrees)
+            out = scale.degrees[(i + augmentation.amount) % len(scale.degrees)]
+            return out.with_octave(octaves + more_octaves)
 
         elif isinstance(augmentation, doremi.abstract.AugmentRatio):
             return RealNote(self.frequency * float(augmentation.amount))
@@ -137,9 +154,48 @@ class TimedNote:
         return self.stop - self.start
 
 
+note_array_dtype = np.dtype(
+    [
+        ("pitch", np.int16),
+        ("frequency", np.float64),
+        ("start", np.float64),
+        ("stop", np.float64),
+        ("emphasis", np.float64),
+        ("velocity", np.uint8),
+    ]
+)
+
+midi_event_dtype = np.dtype(
+    [("time", np.float64), ("pitch", np.uint8), ("velocity", np.uint8)]
+)
+
+midi_channel_event_dtype = np.dtype(
+    [
+        ("time", np.float64),
+        ("pitch", np.uint8),
+        ("velocity", np.uint8),
+        ("channel", np.uint8),
+    ]
+)
+
+
 cardinal = re.compile("^([1-9][0-9]*)th$")
 
 
+def degree_name(symbol: str) -> Optional[int]:
+    # "1st", "2nd", "3rd", "4th", ... refer to scale degrees 0, 1, 2, 3, ...
+    if symbol == "1st":
+        return 0
+    elif symbol == "2nd":
+        return 1
+    elif symbol == "3rd":
+        return 2
+    m = cardinal.match(symbol)
+    if m is not None:
+        return int(m.group(1)) - 1
+    return None
+
+
 @dataclass
 class Scale:
     notes: Dict[str, Note]
@@ -147,30 +203,46 @@ class Scale:
     name: Optional[str] = field(default=None, repr=False, compare=False, hash=False)
     tonic: Optional[str] = field(default=None, repr=False, compare=False, hash=False)
 
-    def __getitem__(self, symbol: str) -> Note:
-        degree = None
-        if symbol == "1st":
-            degree = 0
-        elif symbol == "2nd":
-            degree = 1
-        elif symbol == "3rd":
-            degree = 2
-        m = cardinal.match(symbol)
-        if m is not None:
-            degree = int(m.group(1)) - 1
+    # derived from notes and accidentals when the Scale is made
+    degrees: List[Note] = field(init=False, repr=False, compare=False, hash=False)
+    pitch_classes: Optional[Dict[int, int]] = field(
+        init=False, repr=False, compare=False, hash=False
+    )
+    symbols: Dict[str, Note] = field(init=False, repr=False, compare=False, hash=False)
 
-        if degree is not None:
-            if degree >= len(self.notes):
-                if isinstance(symbol, lark.lexer.Token):
-                    raise doremi.abstract.UndefinedSymbol(symbol)
-                else:
-                    raise KeyError(f"symbol not found in scale: {symbol!r}")
-            else:
-                return list(self.notes.values())[degree]
+    def __post_init__(self):
+        # relies on dict-ordering (Python 3.6+)
+        self.degrees = list(self.notes.values())
 
-        out = self.notes.get(symbol)
-        if out is None:
-            out = self.accidentals.get(symbol)
+        # pitch class -> first degree with that pitch class, if it can be exact
+        if all(isinstance(note, MIDINote) for note in self.degrees):
+            self.pitch_classes = {}
+            for i, note in enumerate(self.degrees):
+                self.pitch_classes.setdefault(note.pitch % 12, i)
+        else:
+            self.pitch_classes = None
+
+        # degree names take precedence over any notes or accidentals named that way
+        self.symbols = {}
+        for symbol, note in list(self.accidentals.items()) + list(self.notes.items()):
+            if degree_name(symbol) is None:
+                self.symbols[symbol] = note
+        for i, note in enumerate(self.degrees):
+            self.symbols[f"{i + 1}th"] = note
+        for i, symbol in enumerate(["1st", "2nd", "3rd"][: len(self.degrees)]):
+            self.symbols[symbol] = self.degrees[i]
+
+    def degree(self, note: Note) -> Optional[int]:
+        # the first degree of the scale in the same pitch class as note
+        if self.pitch_classes is not None and isinstance(note, MIDINote):
+            return self.pitch_classes.get(note.pitch % 12)
+        for i, x in enumerate(self.degrees):
+            if note.same_pitch_class(x):
+                return i
+        return None
+
+    def __getitem__(self, symbol: str) -> Note:
+        out = self.symbols.get(symbol)
         if out is None:
             if isinstance(symbol, lark.lexer.Token):
                 raise doremi.abstract.UndefinedSymbol(symbol)
@@ -230,7 +302,13 @@ class Composition:
     num_beats: float
     scope: doremi.abstract.Scope
     abstract_collection: doremi.abstract.Collection
-    abstract_notes: List[doremi.abstract.AbstractNote]
+    abstract_notes: "doremi.abstract.Notes"
+    call_cache: Optional[doremi.abstract.CallCache] = field(
+        default=None, repr=False, compare=False
+    )
+    table: Optional[doremi.abstract.NoteTable] = field(
+        default=None, repr=False, compare=False
+    )
 
     def __repr__(self):
         scale = ""
@@ -238,6 +316,12 @@ class Composition:
             scale = f" in {self.scale.name!r}"
         return f"<Composition{scale} {self.bpm} bpm ({len(self.abstract_notes)} notes)>"
 
+    def note_table(self) -> doremi.abstract.NoteTable:
+        # abstract_notes with all repetitions expanded, as one columnar table
+        if self.table is None:
+            self.table = doremi.abstract.NoteTable.from_notes(self.abstract_notes)
+        return self.table
+
     @property
     def beat_in_seconds(self) -> float:
         return 60.0 / self.bpm
@@ -254,47 +338,194 @@ class Composition:
             lambda single, maximum: (single + 1) / (maximum + 1)
         ),
     ) -> List[TimedNote]:
-
-        if len(self.abstract_notes) == 0:
+        table = self.note_table()
+        if len(table) == 0:
             return []
 
+        scale = self.get_scale(scale)
+        beat_in_seconds = self.get_beat_in_seconds(bpm)
+
+        distinct, which = self.distinct_notes(table, scale)
+        emphasis = self.scaled_emphasis(table, emphasis_scaling)
+
+        return [
+            TimedNote(distinct[index], start, stop, emph)
+            for index, start, stop, emph in zip(
+                which.tolist(),
+                (0.5 * table.start * beat_in_seconds).tolist(),
+                (0.5 * table.stop * beat_in_seconds).tolist(),
+                emphasis.tolist(),
+            )
+        ]
+
+    def note_array(
+        self,
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+    ) -> np.ndarray:
+        # the same as notes(), but as a structured array; pitch is -1 for notes
+        # that aren't MIDINotes and velocity is what midi_events would use
+        table = self.note_table()
+        out = np.empty(len(table), note_array_dtype)
+        if len(table) == 0:
+            return out
+
+        scale = self.get_scale(scale)
+        beat_in_seconds = self.get_beat_in_seconds(bpm)
+
+        distinct, which = self.distinct_notes(table, scale)
+        pitch = np.array(
+            [x.pitch if isinstance(x, MIDINote) else -1 for x in distinct], np.int16
+        )
+        frequency = np.array([x.frequency for x in distinct], np.float64)
+
+        out["pitch"] = pitch[which]
+        out["frequency"] = frequency[which]
+        out["start"] = 0.5 * table.start * beat_in_seconds
+        out["stop"] = 0.5 * table.stop * beat_in_seconds
+        out["emphasis"] = self.scaled_emphasis(table, emphasis_scaling)
+        out["velocity"] = np.ceil(out["emphasis"] * 127)
+        return out
+
+    def num_lines(self) -> int:
+        # the most lines in any passage (paragraph) other than definitions
+        return max(
+            [
+                len(x.lines)
+                for x in self.abstract_collection.passages
+                if isinstance(x, doremi.abstract.UnnamedPassage)
+            ],
+            default=0,
+        )
+
+    def note_lines(self) -> np.ndarray:
+        # For each note in note_table, the number of its line within its passage
+        # (0 for the first line of every passage, 1 for the second, ...), which
+        # includes the notes of any functions that it calls
+        return self.note_table().line
+
+    def get_scale(self, scale: Optional[AnyScale]) -> "Scale":
         if scale is None:
-            scale = self.scale
+            return self.scale
         else:
-            scale = doremi.concrete.get_scale(scale)
+            return doremi.concrete.get_scale(scale)
 
+    def get_beat_in_seconds(self, bpm: Optional[float]) -> float:
         if bpm is None:
             bpm = self.bpm
+        return 60.0 / bpm
 
-        beat_in_seconds = 60.0 / bpm
+    def concrete_note(
+        self,
+        word: doremi.abstract.Word,
+        octave: int,
+        augmentations: Tuple[doremi.abstract.Augmentation],
+        scale: "Scale",
+    ) -> Note:
+        try:
+            note = scale[word.val]
+        except doremi.abstract.DoremiError as err:
+            err.source = self.abstract_collection.source
+            raise
+
+        if octave != 0:
+            note = note.with_octave(octave)
+
+        if len(augmentations) != 0:
+            for augmentation in augmentations[::-1]:
+                note = note.with_augmentation(augmentation, scale)
+
+        return note
+
+    def distinct_notes(
+        self, table: doremi.abstract.NoteTable, scale: "Scale"
+    ) -> Tuple[List[Note], np.ndarray]:
+        # each distinct (word, octave, augmentations) is resolved once, in order
+        # of first appearance so that an error is about the earliest bad note
+        keys = np.stack([table.symbol, table.octave, table.chain], axis=1)
+        unique, first, which = np.unique(
+            keys, axis=0, return_index=True, return_inverse=True
+        )
+        distinct = [None] * len(unique)
+        for i in np.argsort(first).tolist():
+            symbol, octave, chain = unique[i].tolist()
+            distinct[i] = self.concrete_note(
+                table.interned.words[symbol],
+                octave,
+                table.interned.chains[chain],
+                scale,
+            )
+        return distinct, which.reshape(-1)
 
-        max_emphasis = max(x.emphasis for x in self.abstract_notes)
+    def scaled_emphasis(
+        self,
+        table: doremi.abstract.NoteTable,
+        emphasis_scaling: Callable[[int, int], float],
+    ) -> np.ndarray:
+        # emphasis_scaling is called once per level, not once per note
+        levels, which = np.unique(table.emphasis, return_inverse=True)
+        max_emphasis = int(levels[-1])
+        scaled = np.array(
+            [emphasis_scaling(x, max_emphasis) for x in levels.tolist()], np.float64
+        )
+        return scaled[which.reshape(-1)]
 
-        notes = []
-        for abstract_note in self.abstract_notes:
-            try:
-                note = scale[abstract_note.word.val]
-            except doremi.abstract.DoremiError as err:
-                err.source = self.abstract_collection.source
-                raise
-
-            if abstract_note.octave != 0:
-                note = note.with_octave(abstract_note.octave)
-
-            if len(abstract_note.augmentations) != 0:
-                for augmentation in abstract_note.augmentations[::-1]:
-                    note = note.with_augmentation(augmentation, scale)
-
-            notes.append(
-                TimedNote(
-                    note,
-                    0.5 * abstract_note.start * beat_in_seconds,
-                    0.5 * abstract_note.stop * beat_in_seconds,
-                    emphasis_scaling(abstract_note.emphasis, max_emphasis),
-                )
+    def timed_notes(
+        self,
+        abstract_notes: Iterable[doremi.abstract.AbstractNote],
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+    ) -> Iterator[TimedNote]:
+        # abstract_notes can be any iteration over this Composition's notes, so
+        # that repetitions can be streamed without making all of the copies
+
+        if len(self.abstract_notes) == 0:
+            return
+
+        scale = self.get_scale(scale)
+        beat_in_seconds = self.get_beat_in_seconds(bpm)
+
+        max_emphasis = max(
+            x.emphasis for x in doremi.abstract.distinct_notes(self.abstract_notes)
+        )
+
+        # augmentation chains are shared by the notes that have them in common
+        resolved: Dict[Tuple[str, int, int], Note] = {}
+        scaled: Dict[int, float] = {}
+
+        for abstract_note in abstract_notes:
+            key = (
+                abstract_note.word.val,
+                abstract_note.octave,
+                id(abstract_note.augmentations),
             )
+            note = resolved.get(key)
+            if note is None:
+                note = resolved[key] = self.concrete_note(
+                    abstract_note.word,
+                    abstract_note.octave,
+                    abstract_note.augmentations,
+                    scale,
+                )
+
+            emphasis = scaled.get(abstract_note.emphasis)
+            if emphasis is None:
+                emphasis = scaled[abstract_note.emphasis] = emphasis_scaling(
+                    abstract_note.emphasis, max_emphasis
+                )
 
-        return notes
+            yield TimedNote(
+                note,
+                0.5 * abstract_note.start * beat_in_seconds,
+                0.5 * abstract_note.stop * beat_in_seconds,
+                emphasis,
+            )
 
     def midi_events(
         self,
@@ -304,68 +535,150 @@ class Composition:
             lambda single, maximum: (single + 1) / (maximum + 1)
         ),
     ) -> List[Tuple[float, List[Tuple[int, int]]]]:
+        return list(self.iter_midi_events(scale, bpm, emphasis_scaling))
 
-        notes = self.notes(scale, bpm, emphasis_scaling)
-        if not all(isinstance(note.note, MIDINote) for note in notes):
-            raise ValueError(
-                "midi_events can only be called if all notes are MIDINotes"
-            )
-        notes.sort(key=lambda note: note.start)
+    def iter_midi_events(
+        self,
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+    ) -> Iterator[Tuple[float, List[Tuple[int, int]]]]:
+        # Events are yielded in time order as soon as they're complete. Pending
+        # note-offs are in a heap of (stop, pitch); state[pitch] is the stop of
+        # the sounding note, and heap entries that don't match it are stale.
+
+        notes = self.timed_notes(
+            doremi.abstract.time_ordered(self.abstract_notes),
+            scale,
+            bpm,
+            emphasis_scaling,
+        )
 
-        events = []
         state = [0.0] * 128
-        i = 0
-        while i < len(notes):
-            start = notes[i].start
-            same_start = []
-            while i < len(notes) and notes[i].start == start:
-                same_start.append(notes[i])
-                i += 1
-
-            to_stop = [
-                (stop, pitch)
-                for pitch, stop in enumerate(state)
-                if stop != 0.0 and stop <= start
-            ]
-            to_stop.sort()
-            last_stop = None
-            for stop, pitch in to_stop:
-                if last_stop != stop:
-                    events.append((stop, []))
-                events[-1][1].append((pitch, 0))  # turn note off
+        pending: List[Tuple[float, int]] = []
+
+        def stops_until(time: Optional[float]) -> Iterator[Tuple[float, list]]:
+            changes = []
+            while len(pending) != 0 and (time is None or pending[0][0] <= time):
+                stop, pitch = heapq.heappop(pending)
+                if state[pitch] != stop:
+                    continue
+                if len(changes) != 0 and changes[0] != stop:
+                    yield changes[0], changes[1]
+                    changes = []
+                if len(changes) == 0:
+                    changes = [stop, []]
+                changes[1].append((pitch, 0))  # turn note off
                 state[pitch] = 0.0
-                last_stop = stop
+            if len(changes) != 0:
+                yield changes[0], changes[1]
+
+        for start, same_start in itertools.groupby(notes, lambda note: note.start):
+            same_start = list(same_start)
+            if not all(isinstance(note.note, MIDINote) for note in same_start):
+                raise ValueError(
+                    "midi_events can only be called if all notes are MIDINotes"
+                )
 
             changes = []
+            for stop, offs in stops_until(start):
+                if stop == start:
+                    changes = offs
+                else:
+                    yield stop, offs
+
             for note in same_start:
                 pitch = note.note.pitch
                 emphasis = int(math.ceil(note.emphasis * 127))
                 if state[pitch] == 0.0:
                     changes.append((pitch, emphasis))  # turn note on
                     state[pitch] = note.stop
+                    heapq.heappush(pending, (note.stop, pitch))
                 else:
                     changes.append((pitch, 0))  # turn it off just before
                     changes.append((pitch, emphasis))  # turning it on again
                     if state[pitch] < note.stop:
                         state[pitch] = note.stop  # longest note wins
+                        heapq.heappush(pending, (note.stop, pitch))
 
-            if len(events) != 0 and events[-1][0] == start:
-                events[-1][1].extend(changes)
-            else:
-                events.append((start, changes))
+            yield start, changes
 
-        to_stop = [(stop, pitch) for pitch, stop in enumerate(state) if stop != 0.0]
-        to_stop.sort()
+        yield from stops_until(None)
 
-        last_stop = None
-        for stop, pitch in to_stop:
-            if last_stop != stop:
-                events.append((stop, []))
-            events[-1][1].append((pitch, 0))  # turn note off
-            state[pitch] = 0.0
-            last_stop = stop
+    def midi_event_array(
+        self,
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+        channels: bool = False,
+    ) -> np.ndarray:
+        # The same as midi_events, flattened into one change per row (velocity
+        # 0 is note-off), and computed with sorts instead of a loop over notes.
+        # With channels, each note is on the MIDI channel of its line number
+        # (note_lines), in a "channel" field, and only retriggers notes of the
+        # same line.
+        notes = self.note_array(scale, bpm, emphasis_scaling)
+        if np.any(notes["pitch"] < 0):
+            raise ValueError(
+                "midi_events can only be called if all notes are MIDINotes"
+            )
 
-        return events
+        # in the order that midi_events sees them: stably sorted by start
+        in_order = np.argsort(self.note_table().start, kind="stable")
+        notes = notes[in_order]
+        pitch, start, velocity = notes["pitch"], notes["start"], notes["velocity"]
+
+        # pitch on its own, or as 128 * channel + pitch
+        key = pitch.astype(np.int64)
+        if channels:
+            channel = self.note_lines()[in_order]
+            if len(channel) != 0 and channel.max() >= 256:
+                raise ValueError("there are only 256 MIDI channels for the lines")
+            key += 128 * channel
+
+        # within each key, a note retriggers if an earlier one hasn't stopped,
+        # and a run of retriggered notes ends at the latest stop in the run; the
+        # running maximum restarts at each key because ranks are offset by it
+        by_key = np.lexsort((np.arange(len(notes)), key))
+        stops, rank = np.unique(notes["stop"][by_key], return_inverse=True)
+        rank = rank.reshape(-1) + key[by_key] * len(stops)
+        latest = stops[np.maximum.accumulate(rank) % len(stops)]
+
+        same_key = key[by_key][1:] == key[by_key][:-1]
+        retrigger = np.zeros(len(notes), np.bool_)
+        retrigger[1:] = same_key & (latest[:-1] > start[by_key][1:])
+        run_end = np.ones(len(notes), np.bool_)
+        run_end[:-1] = ~retrigger[1:]
+
+        retriggered = np.empty(len(notes), np.bool_)
+        retriggered[by_key] = retrigger
+        (again,) = np.nonzero(retriggered)
+        ends = by_key[run_end]
+
+        # at any time, the note-offs that end runs come first (by key), then
+        # the changes in start order, each retrigger's note-off before its note-on
+        time = np.concatenate([latest[run_end], start[again], start])
+        out_key = np.concatenate([key[ends], key[again], key])
+        out_velocity = np.zeros(len(time), np.uint8)
+        out_velocity[len(time) - len(notes) :] = velocity
+        order = np.concatenate(
+            [key[ends] - 256 * 128, 2 * again, 2 * np.arange(len(notes)) + 1]
+        )
+        rows = np.lexsort((order, time))
+
+        out = np.empty(
+            len(time), midi_channel_event_dtype if channels else midi_event_dtype
+        )
+        out["time"] = time[rows]
+        out["pitch"] = out_key[rows] % 128
+        out["velocity"] = out_velocity[rows]
+        if channels:
+            out["channel"] = out_key[rows] // 128
+        return out
 
     def fluidsynth(
         self,
@@ -375,22 +688,285 @@ class Composition:
             lambda single, maximum: (single + 1) / (maximum + 1)
         ),
         soundfont: Optional[str] = None,
-        sample_rate: int = 44100,
+        sample_rate: Optional[int] = None,
         dtype: object = "i2",
+        processes: Optional[int] = 1,
+        sequencer: bool = False,
+        quality: "doremi.fluidsynth.AnyQuality" = "standard",
+        cpu_cores: Optional[int] = None,
+        cache: Union[None, str, "doremi.cache.RenderCache"] = None,
+        backend: Optional[str] = None,
+        grid: Optional[int] = None,
+        memoize: bool = False,
     ):
+        # processes other than 1 renders time segments in parallel (None is one
+        # per CPU; Python 3.8 or later), crossfading where they meet, so it's
+        # not sample-exact; sequencer queues the events in FluidSynth, which is
+        # faster for dense music but only places them to within 64 samples;
+        # quality is a name in doremi.fluidsynth.quality_profiles, which also
+        # sets the sample_rate unless it's given; cpu_cores is the number of
+        # threads FluidSynth mixes voices in (None is all available cores,
+        # shared among the processes, or 1 in a worker process); cache is a
+        # RenderCache or its directory, and a render that's already in it is
+        # returned as a memmap; backend is "fluidsynth", "numpy"
+        # (numpy_synthesize), or None for FluidSynth if libfluidsynth can be
+        # loaded and all notes are MIDINotes, and NumPy otherwise, unless a
+        # FluidSynth-only argument is given; grid moves FluidSynth events to
+        # multiples of that many samples, which is faster for dense music (see
+        # doremi.fluidsynth.timing_error); memoize renders each repeated phrase
+        # once (Fluidsynth.phrase_synthesize)
         import doremi.fluidsynth
 
-        events = self.midi_events(scale, bpm, emphasis_scaling)
+        if backend is None:
+            backend = "fluidsynth"
+            reason = None
+            if not doremi.fluidsynth.has_library():
+                reason = "libfluidsynth can't be loaded"
+            elif np.any(self.note_array(scale, bpm, emphasis_scaling)["pitch"] < 0):
+                reason = "some notes aren't MIDI notes"
+
+            if reason is not None:
+                # only fall back if none of these would be ignored
+                requested = [
+                    name
+                    for name, value, default in [
+                        ("soundfont", soundfont, None),
+                        ("processes", processes, 1),
+                        ("sequencer", sequencer, False),
+                        ("cpu_cores", cpu_cores, None),
+                        ("grid", grid, None),
+                        ("memoize", memoize, False),
+                    ]
+                    if value != default
+                ]
+                if len(requested) != 0:
+                    raise ValueError(
+                        f"{', '.join(requested)} can only be used with FluidSynth, "
+                        f'but {reason}; use backend="numpy" to render without them'
+                    )
+                backend = "numpy"
+
+        if backend == "numpy":
+            return self.numpy_synthesize(
+                scale, bpm, emphasis_scaling, sample_rate, dtype, quality, cache=cache
+            )
+        elif backend != "fluidsynth":
+            raise ValueError(
+                f'backend must be "fluidsynth", "numpy", or None, not {backend!r}'
+            )
+        if grid is not None and (processes != 1 or sequencer):
+            raise ValueError("grid can't be used with processes or the sequencer")
+        if memoize and (processes != 1 or sequencer or grid is not None):
+            raise ValueError(
+                "memoize can't be used with processes, the sequencer, or a grid"
+            )
 
-        fluidsynth = doremi.fluidsynth.Fluidsynth(soundfont, sample_rate, dtype)
+        events = self.midi_event_array(scale, bpm, emphasis_scaling)
+
+        if cache is not None:
+            import doremi.cache
+
+            cache = doremi.cache.get_cache(cache)
+            quality = doremi.fluidsynth.get_quality(quality)
+            available = doremi.fluidsynth.available_cores()
+            key = cache.key(
+                events,
+                soundfont or doremi.fluidsynth.default_soundfont(),
+                {
+                    "fluidsynth": doremi.fluidsynth.library_version(),
+                    "sample_rate": sample_rate or quality.sample_rate,
+                    "dtype": np.dtype(dtype).str,
+                    "quality": quality,
+                    "cpu_cores": cpu_cores or available,
+                    "processes": processes or available,
+                    "sequencer": sequencer,
+                    "grid": grid,
+                    "memoize": memoize,
+                },
+            )
+            array = cache.get(key)
+            if array is not None:
+                return array
+
+        if processes != 1:
+            array = doremi.fluidsynth.parallel_synthesize(
+                events,
+                processes,
+                soundfont,
+                sample_rate,
+                dtype,
+                quality,
+                cpu_cores=cpu_cores,
+            )
 
-        try:
-            array = fluidsynth.midi_synthesize(events)
-        finally:
-            fluidsynth.delete()
+        else:
+            with doremi.fluidsynth.pool.synth(
+                soundfont, sample_rate, dtype, quality, cpu_cores
+            ) as synth:
+                if sequencer:
+                    array = synth.sequence_synthesize(events)
+                elif memoize:
+                    array = synth.phrase_synthesize(events)
+                else:
+                    array = synth.midi_synthesize(events, grid)
 
+        if cache is not None:
+            cache.put(key, array)
         return array
 
+    def stems(
+        self,
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+        soundfont: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        quality: "doremi.fluidsynth.AnyQuality" = "standard",
+        cpu_cores: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # The audio of each line number (note_lines) separately, as an array of
+        # (num_lines, num_samples, 2), and their mix, from one FluidSynth pass
+        # with each line on its own MIDI channel. Since the lines don't share
+        # notes, the mix can differ from fluidsynth() where two lines play the
+        # same pitch at once.
+        import doremi.fluidsynth
+
+        events = self.midi_event_array(scale, bpm, emphasis_scaling, channels=True)
+        with doremi.fluidsynth.pool.synth(
+            soundfont, sample_rate, dtype, quality, cpu_cores, max(self.num_lines(), 1)
+        ) as synth:
+            return synth.stem_synthesize(events)
+
+    def numpy_synthesize(
+        self,
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        quality: "doremi.fluidsynth.AnyQuality" = "standard",
+        voice: "doremi.numpysynth.AnyVoice" = "piano",
+        method: str = "additive",
+        cache: Union[None, str, "doremi.cache.RenderCache"] = None,
+    ) -> np.ndarray:
+        # the same as fluidsynth(), but with doremi.numpysynth instead of a
+        # SoundFont, so it works without libfluidsynth and for any frequency,
+        # such as RealNotes; quality only sets the sample_rate
+        import doremi.fluidsynth
+        import doremi.numpysynth
+
+        if sample_rate is None:
+            sample_rate = doremi.fluidsynth.get_quality(quality).sample_rate
+        synth = doremi.numpysynth.NumpySynth(sample_rate, dtype, voice, method)
+        notes = self.note_array(scale, bpm, emphasis_scaling)
+
+        if cache is not None:
+            import doremi.cache
+
+            cache = doremi.cache.get_cache(cache)
+            key = cache.key(
+                notes[["frequency", "start", "stop", "velocity"]],
+                None,
+                {
+                    "backend": "numpy",
+                    "sample_rate": sample_rate,
+                    "dtype": synth.dtype.str,
+                    "voice": synth.voice,
+                    "method": method,
+                },
+            )
+            array = cache.get(key)
+            if array is not None:
+                return array
+
+        array = synth.synthesize(notes)
+
+        if cache is not None:
+            cache.put(key, array)
+        return array
+
+    def render_blocks(
+        self,
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+        soundfont: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        block_size: int = 4096,
+        quality: "doremi.fluidsynth.AnyQuality" = "standard",
+        cpu_cores: Optional[int] = None,
+    ) -> Iterator[np.ndarray]:
+        # the audio of fluidsynth(), one reused block at a time, so that memory
+        # doesn't grow with the length of the composition
+        import doremi.fluidsynth
+
+        events = self.iter_midi_events(scale, bpm, emphasis_scaling)
+
+        with doremi.fluidsynth.pool.synth(
+            soundfont, sample_rate, dtype, quality, cpu_cores
+        ) as synth:
+            yield from synth.render_blocks(events, block_size)
+
+    def render_to_wav(
+        self,
+        file: Union[str, os.PathLike, BinaryIO],
+        scale: Optional[AnyScale] = None,
+        bpm: Optional[float] = None,
+        emphasis_scaling: Callable[[int, int], float] = (
+            lambda single, maximum: (single + 1) / (maximum + 1)
+        ),
+        soundfont: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        block_size: int = 4096,
+        quality: "doremi.fluidsynth.AnyQuality" = "standard",
+        cpu_cores: Optional[int] = None,
+    ):
+        # A path is sized up front and memory-mapped, so that the synth writes
+        # directly into the file. Anything else is a binary file object that
+        # might not be seekable (a pipe or sys.stdout.buffer): it gets the header
+        # and then the audio block by block.
+        import doremi.fluidsynth
+
+        if sample_rate is None:
+            sample_rate = doremi.fluidsynth.get_quality(quality).sample_rate
+
+        events = self.midi_event_array(scale, bpm, emphasis_scaling)
+        num_samples = 0
+        if len(events) != 0:
+            num_samples = int(sample_rate * events["time"][-1])
+        header = doremi.fluidsynth.wav_header(num_samples, sample_rate, dtype)
+
+        with doremi.fluidsynth.pool.synth(
+            soundfont, sample_rate, dtype, quality, cpu_cores
+        ) as synth:
+            if isinstance(file, (str, os.PathLike)):
+                data_size = num_samples * 2 * synth.dtype.itemsize
+                with open(file, "wb") as output:
+                    output.write(header)
+                    output.truncate(len(header) + data_size)
+                if num_samples != 0:
+                    array = np.memmap(
+                        file, synth.dtype, "r+", len(header), (num_samples, 2)
+                    )
+                    # the file was just extended, so it reads as zeros
+                    synth.synthesize_into(events, array, zeroed=True)
+                    array.flush()
+                    del array
+
+            else:
+                file.write(header)
+                for block in synth.render_blocks(events, block_size):
+                    file.write(block.data)
+
     def play(
         self,
         scale: Optional[AnyScale] = None,
@@ -399,11 +975,29 @@ class Composition:
             lambda single, maximum: (single + 1) / (maximum + 1)
         ),
         soundfont: Optional[str] = None,
-        sample_rate: int = 44100,
+        sample_rate: Optional[int] = None,
+        processes: Optional[int] = 1,
+        quality: "doremi.fluidsynth.AnyQuality" = "standard",
+        cache: Union[None, str, "doremi.cache.RenderCache"] = None,
+        backend: Optional[str] = None,
     ) -> "IPython.lib.display.Audio":
         import IPython.display
+        import doremi.fluidsynth
 
-        array = self.fluidsynth(scale, bpm, emphasis_scaling, soundfont, sample_rate)
+        if sample_rate is None:
+            sample_rate = doremi.fluidsynth.get_quality(quality).sample_rate
+
+        array = self.fluidsynth(
+            scale,
+            bpm,
+            emphasis_scaling,
+            soundfont,
+            sample_rate,
+            processes=processes,
+            quality=quality,
+            cache=cache,
+            backend=backend,
+        )
 
         if len(array) == 0:
             raise ValueError(
@@ -445,19 +1039,21 @@ class Composition:
             num_timesteps = int(math.ceil(self.num_beats * lines_per_beat))
             scale_factor = 60.0 / bpm
 
+            starts = np.array([note.start for note in notes])
+            stops = np.array([note.stop for note in notes])
+            pitches = np.array([note.note.pitch for note in notes]) - min_pitch
+
             for timestep in range(num_timesteps):
                 chars = ["   " for i in range(max_pitch - min_pitch)]
 
                 tlo, thi = timestep * scale_factor, (timestep + 1) * scale_factor
-                start = [note for note in notes if tlo <= note.start < thi]
-                going = [
-                    note for note in notes if note.start < tlo and note.stop >= thi
-                ]
+                start = pitches[(tlo <= starts) & (starts < thi)]
+                going = pitches[(starts < tlo) & (stops >= thi)]
 
-                for note in going:
-                    chars[note.note.pitch - min_pitch] = " | "
-                for note in start:
-                    chars[note.note.pitch - min_pitch] = " x "
+                for pitch in going.tolist():
+                    chars[pitch] = " | "
+                for pitch in start.tolist():
+                    chars[pitch] = " x "
                 print("".join(chars), file=stream)
 
         else:
@@ -612,8 +1208,8 @@ def make_scale(source: MakeScale, name: Optional[str] = None) -> Scale:
 
         if isinstance(v, numbers.Real):
             if v <= 0:
-                raise ValueError("note frequencies (in Hz) must be positive: {v!r}")
-            included_notes.append((k, RealNote(value)))
+                raise ValueError(f"note frequencies (in Hz) must be positive: {v!r}")
+            included_notes.append((k, RealNote(v)))
 
         elif v in notes:
             included_notes.append((k, notes[v]))
@@ -669,7 +1265,7 @@ def named_scale(name: str, accidentals: bool = True) -> Scale:
                     f"unrecognized note name: {tonic[0].capitalize() + accidental}"
                 )
 
-            pitches = named_scale.data.get(mode)
+            pitches = scale_data().get(mode)
             if pitches is not None:
                 for i, x in enumerate(solfedge):
                     if i in pitches:
@@ -702,17 +1298,26 @@ def named_scale(name: str, accidentals: bool = True) -> Scale:
 named_scale.cache: Dict[str, Tuple[Dict[str, Note], Dict[str, Note], str]] = {}
 named_scale.base_name = re.compile(r"^\s*([a-g](\#|b)?\s+)?([a-z]+)\s*$")
 
-# https://allthescales.org/downloads.php
-allthescales = pkg_resources.resource_filename("doremi", "data/scale-list.csv")
-named_scale.data: Dict[str, Set[int]] = {}
-with open(allthescales) as file:
-    reader = csv.reader(file)
-    next(reader)  # skip header
-    for row in reader:
-        full = [0]
-        for x in row[3].strip()[:-1]:
-            full.append(full[-1] + int(x))
-        named_scale.data[row[2].lower()] = set(full)
+
+def scale_data() -> Dict[str, Set[int]]:
+    # https://allthescales.org/downloads.php
+    if scale_data.cache is None:
+        data: Dict[str, Set[int]] = {}
+        allthescales = importlib_resources.files("doremi") / "data" / "scale-list.csv"
+        with allthescales.open() as file:
+            reader = csv.reader(file)
+            next(reader)  # skip header
+            for row in reader:
+                full = [0]
+                for x in row[3].strip()[:-1]:
+                    full.append(full[-1] + int(x))
+                data[row[2].lower()] = set(full)
+        scale_data.cache = data
+
+    return scale_data.cache
+
+
+scale_data.cache: Optional[Dict[str, Set[int]]] = None
 
 
 def get_scale(source: AnyScale) -> Scale:
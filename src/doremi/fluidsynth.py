@@ -1,185 +1,1217 @@
 # BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
 
+import contextlib
 import ctypes
 import ctypes.util
-import pkg_resources
-from typing import List, Tuple, Optional
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple, Optional, Union
 
 import numpy as np
 
+if sys.version_info >= (3, 9):
+    import importlib.resources as importlib_resources
+else:
+    import importlib_resources
 
-fluidsynth_name = (
-    ctypes.util.find_library("fluidsynth")
-    or ctypes.util.find_library("libfluidsynth")
-    or ctypes.util.find_library("libfluidsynth-2")
-    or ctypes.util.find_library("libfluidsynth-1")
-)
-if fluidsynth_name is None:
-    raise ImportError("could not find the fluidsynth library")
-
-fluidsynth = ctypes.CDLL(fluidsynth_name)
-
-new_fluid_settings = fluidsynth.new_fluid_settings
-new_fluid_settings.argtypes = []
-new_fluid_settings.restype = ctypes.c_void_p
-
-fluid_settings_setnum = fluidsynth.fluid_settings_setnum
-fluid_settings_setnum.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_double]
-fluid_settings_setnum.restype = ctypes.c_int
-
-fluid_settings_setint = fluidsynth.fluid_settings_setint
-fluid_settings_setint.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
-fluid_settings_setint.restype = ctypes.c_int
-
-new_fluid_synth = fluidsynth.new_fluid_synth
-new_fluid_synth.argtypes = [ctypes.c_void_p]
-new_fluid_synth.restype = ctypes.c_void_p
-
-# https://www.fluidsynth.org/api/group__soundfont__management.html#ga0ba0bc9d4a19c789f9969cd22d22bf66
-fluid_synth_sfload = fluidsynth.fluid_synth_sfload
-fluid_synth_sfload.argtypes = [
-    ctypes.c_void_p,  # synth
-    ctypes.c_char_p,  # filename: File to load
-    ctypes.c_int,  # update_midi_presets: TRUE to re-assign presets for all MIDI channels
-    # (equivalent to calling fluid_synth_program_reset())
-]
-fluid_synth_sfload.restype = ctypes.c_int
-
-# https://www.fluidsynth.org/api/group__midi__messages.html#ga0c2f5db7b19f80f25c1e4263cf78b0d0
-fluid_synth_program_select = fluidsynth.fluid_synth_program_select
-fluid_synth_program_select.argtypes = [
-    ctypes.c_void_p,  # synth
-    ctypes.c_int,  # chan: MIDI channel number (0 to MIDI channel count - 1)
-    ctypes.c_int,  # sfid: ID of a loaded SoundFont
-    ctypes.c_int,  # bank: MIDI bank number
-    ctypes.c_int,  # preset: MIDI program number
-]
-fluid_synth_program_select.restype = ctypes.c_int
-
-# https://www.fluidsynth.org/api/group__midi__messages.html#ga038a0f309e8004f39cb5491514bfac54
-fluid_synth_noteon = fluidsynth.fluid_synth_noteon
-fluid_synth_noteon.argtypes = [
-    ctypes.c_void_p,  # synth
-    ctypes.c_int,  # chan: MIDI channel number (0 to MIDI channel count - 1)
-    ctypes.c_int,  # key: MIDI note number (0-127)
-    ctypes.c_int,  # vel: MIDI velocity (0-127, 0=noteoff)
-]
-fluid_synth_noteon.restype = ctypes.c_int
-
-fluid_synth_noteoff = fluidsynth.fluid_synth_noteoff
-fluid_synth_noteoff.argtypes = [
-    ctypes.c_void_p,  # synth
-    ctypes.c_int,  # chan
-    ctypes.c_int,  # key
-]
-fluid_synth_noteoff.restype = ctypes.c_int
-
-# https://www.fluidsynth.org/api/group__audio__rendering.html#ga6b88528d1ea6322582314197488afab7
-fluid_synth_write_s16 = fluidsynth.fluid_synth_write_s16
-fluid_synth_write_s16.argtypes = [
-    ctypes.c_void_p,  # synth
-    ctypes.c_int,  # length: Count of audio frames to synthesize
-    ctypes.c_void_p,  # lbuf: Array of 16 bit words to store left channel of audio
-    ctypes.c_int,  # loff: Offset index in 'lout' for first sample
-    ctypes.c_int,  # lincr: Increment between samples stored to 'lout'
-    ctypes.c_void_p,  # rbuf: Array of 16 bit words to store right channel of audio
-    ctypes.c_int,  # roff: Offset index in 'rout' for first sample
-    ctypes.c_int,  # rincr: Increment between samples stored to 'rout'
-]
-fluid_synth_write_s16.restype = ctypes.c_void_p
-
-# https://www.fluidsynth.org/api/group__audio__rendering.html#ga7db368da2d74a73d05feaff4a6bb1da4
-fluid_synth_write_float = fluidsynth.fluid_synth_write_float
-fluid_synth_write_float.argtypes = [
-    ctypes.c_void_p,  # synth
-    ctypes.c_int,  # length: Count of audio frames to synthesize
-    ctypes.c_void_p,  # lbuf: Array of floats to store left channel of audio
-    ctypes.c_int,  # loff: Offset index in 'lout' for first sample
-    ctypes.c_int,  # lincr: Increment between samples stored to 'lout'
-    ctypes.c_void_p,  # rbuf: Array of floats to store right channel of audio
-    ctypes.c_int,  # roff: Offset index in 'rout' for first sample
-    ctypes.c_int,  # rincr: Increment between samples stored to 'rout'
-]
-fluid_synth_write_float.restype = ctypes.c_void_p
-
-delete_fluid_settings = fluidsynth.delete_fluid_settings
-delete_fluid_settings.argtypes = [ctypes.c_void_p]
-delete_fluid_settings.restype = None
-
-delete_fluid_synth = fluidsynth.delete_fluid_synth
-delete_fluid_synth.argtypes = [ctypes.c_void_p]
-delete_fluid_synth.restype = None
+
+def get_library() -> ctypes.CDLL:
+    # deferred until the first synthesizer is made, so that importing this
+    # module is cheap and doesn't fail if libfluidsynth is missing
+    if get_library.library is not None:
+        return get_library.library
+
+    fluidsynth_name = (
+        ctypes.util.find_library("fluidsynth")
+        or ctypes.util.find_library("libfluidsynth")
+        or ctypes.util.find_library("libfluidsynth-2")
+        or ctypes.util.find_library("libfluidsynth-1")
+    )
+    if fluidsynth_name is None:
+        raise ImportError("could not find the fluidsynth library")
+
+    library = ctypes.CDLL(fluidsynth_name)
+
+    library.new_fluid_settings.argtypes = []
+    library.new_fluid_settings.restype = ctypes.c_void_p
+
+    library.fluid_settings_setnum.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_char_p,
+        ctypes.c_double,
+    ]
+    library.fluid_settings_setnum.restype = ctypes.c_int
+
+    library.fluid_settings_setint.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_char_p,
+        ctypes.c_int,
+    ]
+    library.fluid_settings_setint.restype = ctypes.c_int
+
+    library.new_fluid_synth.argtypes = [ctypes.c_void_p]
+    library.new_fluid_synth.restype = ctypes.c_void_p
+
+    # https://www.fluidsynth.org/api/group__soundfont__management.html#ga0ba0bc9d4a19c789f9969cd22d22bf66
+    library.fluid_synth_sfload.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_char_p,  # filename: File to load
+        ctypes.c_int,  # update_midi_presets: TRUE to re-assign presets for all MIDI channels
+        # (equivalent to calling fluid_synth_program_reset())
+    ]
+    library.fluid_synth_sfload.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__midi__messages.html#ga0c2f5db7b19f80f25c1e4263cf78b0d0
+    library.fluid_synth_program_select.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # chan: MIDI channel number (0 to MIDI channel count - 1)
+        ctypes.c_int,  # sfid: ID of a loaded SoundFont
+        ctypes.c_int,  # bank: MIDI bank number
+        ctypes.c_int,  # preset: MIDI program number
+    ]
+    library.fluid_synth_program_select.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__midi__messages.html#ga038a0f309e8004f39cb5491514bfac54
+    library.fluid_synth_noteon.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # chan: MIDI channel number (0 to MIDI channel count - 1)
+        ctypes.c_int,  # key: MIDI note number (0-127)
+        ctypes.c_int,  # vel: MIDI velocity (0-127, 0=noteoff)
+    ]
+    library.fluid_synth_noteon.restype = ctypes.c_int
+
+    library.fluid_synth_noteoff.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # chan
+        ctypes.c_int,  # key
+    ]
+    library.fluid_synth_noteoff.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__audio__rendering.html#ga6b88528d1ea6322582314197488afab7
+    library.fluid_synth_write_s16.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # length: Count of audio frames to synthesize
+        ctypes.c_void_p,  # lbuf: Array of 16 bit words to store left channel of audio
+        ctypes.c_int,  # loff: Offset index in 'lout' for first sample
+        ctypes.c_int,  # lincr: Increment between samples stored to 'lout'
+        ctypes.c_void_p,  # rbuf: Array of 16 bit words to store right channel of audio
+        ctypes.c_int,  # roff: Offset index in 'rout' for first sample
+        ctypes.c_int,  # rincr: Increment between samples stored to 'rout'
+    ]
+    library.fluid_synth_write_s16.restype = ctypes.c_void_p
+
+    # https://www.fluidsynth.org/api/group__audio__rendering.html#ga7db368da2d74a73d05feaff4a6bb1da4
+    library.fluid_synth_write_float.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # length: Count of audio frames to synthesize
+        ctypes.c_void_p,  # lbuf: Array of floats to store left channel of audio
+        ctypes.c_int,  # loff: Offset index in 'lout' for first sample
+        ctypes.c_int,  # lincr: Increment between samples stored to 'lout'
+        ctypes.c_void_p,  # rbuf: Array of floats to store right channel of audio
+        ctypes.c_int,  # roff: Offset index in 'rout' for first sample
+        ctypes.c_int,  # rincr: Increment between samples stored to 'rout'
+    ]
+    library.fluid_synth_write_float.restype = ctypes.c_void_p
+
+    # https://www.fluidsynth.org/api/group__midi__messages.html
+    library.fluid_synth_all_sounds_off.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # chan: MIDI channel number (0 to MIDI channel count - 1), (chan=-1 selects all channels)
+    ]
+    library.fluid_synth_all_sounds_off.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__midi__messages.html
+    library.fluid_synth_system_reset.argtypes = [ctypes.c_void_p]  # synth
+    library.fluid_synth_system_reset.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__sequencer.html
+    library.new_fluid_sequencer2.argtypes = [
+        ctypes.c_int,  # use_system_timer: If TRUE, sequencer will advance at the rate of the system clock
+    ]
+    library.new_fluid_sequencer2.restype = ctypes.c_void_p
+
+    library.fluid_sequencer_register_fluidsynth.argtypes = [
+        ctypes.c_void_p,  # seq
+        ctypes.c_void_p,  # synth
+    ]
+    library.fluid_sequencer_register_fluidsynth.restype = ctypes.c_short
+
+    library.fluid_sequencer_set_time_scale.argtypes = [
+        ctypes.c_void_p,  # seq
+        ctypes.c_double,  # scale: Sequencer scale value in ticks per second
+    ]
+    library.fluid_sequencer_set_time_scale.restype = None
+
+    library.fluid_sequencer_get_tick.argtypes = [ctypes.c_void_p]  # seq
+    library.fluid_sequencer_get_tick.restype = ctypes.c_uint
+
+    library.fluid_sequencer_send_at.argtypes = [
+        ctypes.c_void_p,  # seq
+        ctypes.c_void_p,  # evt: Event to send (copied)
+        ctypes.c_uint,  # time: Time value in ticks
+        ctypes.c_int,  # absolute: TRUE if time is absolute sequencer time
+    ]
+    library.fluid_sequencer_send_at.restype = ctypes.c_int
+
+    library.delete_fluid_sequencer.argtypes = [ctypes.c_void_p]
+    library.delete_fluid_sequencer.restype = None
+
+    # https://www.fluidsynth.org/api/group__sequencer__events.html
+    library.new_fluid_event.argtypes = []
+    library.new_fluid_event.restype = ctypes.c_void_p
+
+    library.fluid_event_set_source.argtypes = [ctypes.c_void_p, ctypes.c_short]
+    library.fluid_event_set_source.restype = None
+
+    library.fluid_event_set_dest.argtypes = [ctypes.c_void_p, ctypes.c_short]
+    library.fluid_event_set_dest.restype = None
+
+    library.fluid_event_noteon.argtypes = [
+        ctypes.c_void_p,  # evt
+        ctypes.c_int,  # channel
+        ctypes.c_short,  # key
+        ctypes.c_short,  # vel
+    ]
+    library.fluid_event_noteon.restype = None
+
+    library.fluid_event_noteoff.argtypes = [
+        ctypes.c_void_p,  # evt
+        ctypes.c_int,  # channel
+        ctypes.c_short,  # key
+    ]
+    library.fluid_event_noteoff.restype = None
+
+    library.delete_fluid_event.argtypes = [ctypes.c_void_p]
+    library.delete_fluid_event.restype = None
+
+    # https://www.fluidsynth.org/api/group__synthesis__params.html
+    library.fluid_synth_set_interp_method.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # chan: MIDI channel to set interpolation method on or -1 for all channels
+        ctypes.c_int,  # interp_method: Interpolation method (fluid_interp)
+    ]
+    library.fluid_synth_set_interp_method.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__audio__rendering.html
+    buffers = ctypes.POINTER(ctypes.c_void_p)
+    library.fluid_synth_process.argtypes = [
+        ctypes.c_void_p,  # synth
+        ctypes.c_int,  # len: Count of audio frames to synthesize and store in every single buffer provided by out and fx
+        ctypes.c_int,  # nfx: Count of arrays in fx
+        buffers,  # fx: Array of buffers to store effects audio to
+        ctypes.c_int,  # nout: Count of arrays in out
+        buffers,  # out: Array of buffers to store (dry) audio to
+    ]
+    library.fluid_synth_process.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__synth.html
+    library.fluid_synth_get_active_voice_count.argtypes = [ctypes.c_void_p]  # synth
+    library.fluid_synth_get_active_voice_count.restype = ctypes.c_int
+
+    # https://www.fluidsynth.org/api/group__misc.html
+    library.fluid_version_str.argtypes = []
+    library.fluid_version_str.restype = ctypes.c_char_p
+
+    library.delete_fluid_settings.argtypes = [ctypes.c_void_p]
+    library.delete_fluid_settings.restype = None
+
+    library.delete_fluid_synth.argtypes = [ctypes.c_void_p]
+    library.delete_fluid_synth.restype = None
+
+    get_library.library = library
+    return library
+
+
+get_library.library = None
+
+
+def __getattr__(name: str) -> object:
+    if name.startswith(("new_fluid_", "delete_fluid_", "fluid_")):
+        return getattr(get_library(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def library_version() -> str:
+    return get_library().fluid_version_str().decode()
+
+
+def has_library() -> bool:
+    try:
+        get_library()
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+def default_soundfont() -> str:
+    return str(
+        importlib_resources.files("doremi") / "data" / "Nice-Steinway-Lite-v3.0.sf2"
+    )
+
+
+def wav_header(num_samples: int, sample_rate: int, dtype: object) -> bytes:
+    # RIFF header for interleaved stereo; float samples are WAVE_FORMAT_IEEE_FLOAT,
+    # which also needs a "fact" chunk with the number of samples
+    dtype = np.dtype(dtype)
+    if dtype == np.dtype(np.int16):
+        fmt = struct.pack("<HHIIHH", 1, 2, sample_rate, sample_rate * 4, 4, 16)
+        fact = b""
+    elif dtype == np.dtype(np.float32):
+        fmt = struct.pack("<HHIIHHH", 3, 2, sample_rate, sample_rate * 8, 8, 32, 0)
+        fact = b"fact" + struct.pack("<II", 4, num_samples)
+    else:
+        raise TypeError('only dtype = np.int16 ("i2") or np.float32 ("f4") are allowed')
+
+    data_size = num_samples * 2 * dtype.itemsize
+    chunks = (
+        b"fmt "
+        + struct.pack("<I", len(fmt))
+        + fmt
+        + fact
+        + b"data"
+        + struct.pack("<I", data_size)
+    )
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks) + data_size) + b"WAVE" + chunks
+
+
+def grouped_events(
+    events: np.ndarray,
+) -> Iterator[Tuple[float, List[Tuple[int, int]]]]:
+    # a structured array from Composition.midi_event_array, with one row per
+    # change, as the (time, changes) pairs of Composition.midi_events
+    if len(events) == 0:
+        return
+    time = events["time"]
+    fields = [events["pitch"].tolist(), events["velocity"].tolist()]
+    if "channel" in events.dtype.names:
+        # from midi_event_array(channels=True): (pitch, velocity, channel)
+        fields.append(events["channel"].tolist())
+    changes = list(zip(*fields))
+    (starts,) = np.nonzero(np.concatenate([[True], time[1:] != time[:-1]]))
+    stops = starts[1:].tolist() + [len(events)]
+    for start, stop in zip(starts.tolist(), stops):
+        yield float(time[start]), changes[start:stop]
+
+
+def grid_index(
+    index: Union[int, np.ndarray], grid: Optional[int]
+) -> Union[int, np.ndarray]:
+    # sample numbers moved to the nearest multiple of grid (None leaves them)
+    if grid is None:
+        return index
+    return grid * ((index + grid // 2) // grid)
+
+
+def timing_error(events: np.ndarray, sample_rate: int, grid: Optional[int]) -> float:
+    # the furthest that any event in a Composition.midi_event_array is moved from
+    # its exact time by rendering on a grid, in seconds: at most about half of a
+    # grid step, plus the sample that truncation to a sample number can cost
+    time = events["time"]
+    if len(time) == 0:
+        return 0.0
+    index = grid_index((sample_rate * time).astype(np.int64), grid)
+    return float(np.max(np.abs(index / sample_rate - time)))
+
+
+def phrases(events: np.ndarray, sample_rate: int) -> List[Tuple[int, int, tuple]]:
+    # (first row, stop row, key) of each phrase for Fluidsynth.phrase_synthesize:
+    # a phrase starts with a note-on while no notes are held, and its key is its
+    # changes with their sample offsets from the start
+    index = (sample_rate * events["time"]).astype(np.int64)
+    pitch, velocity = events["pitch"], events["velocity"]
+    change = np.where(velocity != 0, 1, -1)
+    held = np.cumsum(change) - change
+    (starts,) = np.nonzero((velocity != 0) & (held == 0))
+    stops = starts[1:].tolist() + [len(events)]
+
+    out = []
+    for start, stop in zip(starts.tolist(), stops):
+        key = (
+            (index[start:stop] - index[start]).tobytes(),
+            pitch[start:stop].tobytes(),
+            velocity[start:stop].tobytes(),
+        )
+        out.append((start, stop, key))
+    return out
+
+
+@dataclass(frozen=True)
+class Quality:
+    sample_rate: int
+    reverb: bool
+    chorus: bool
+    interpolation: int  # fluid_interp: 0 none, 1 linear, 4 4th order, 7 7th order
+    polyphony: int
+
+
+# "standard" is FluidSynth's own defaults; "draft" is for auditioning edits
+quality_profiles = {
+    "draft": Quality(22050, False, False, 0, 32),
+    "standard": Quality(44100, True, True, 4, 256),
+    "final": Quality(48000, True, True, 7, 1024),
+}
+
+AnyQuality = Union[str, Quality]
+
+
+def get_quality(quality: AnyQuality) -> Quality:
+    if isinstance(quality, Quality):
+        return quality
+    try:
+        return quality_profiles[quality]
+    except KeyError:
+        raise ValueError(
+            f"unrecognized quality profile {quality!r}; "
+            f"choose from {', '.join(map(repr, quality_profiles))}"
+        ) from None
+
+
+def available_cores() -> int:
+    # sched_getaffinity respects limits on this process (taskset, containers),
+    # but it isn't available on every OS
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_cpu_cores() -> int:
+    # for a synth that isn't given cpu_cores: all available cores, except in a
+    # worker process, which shares them with its siblings
+    if multiprocessing.current_process().name != "MainProcess":
+        return 1
+    return available_cores()
 
 
 class Fluidsynth:
+    # samples written between checks for silence in write_gap
+    check_size = 4096
+
     def __init__(
         self,
         soundfont: Optional[str] = None,
-        sample_rate: int = 44100,
+        sample_rate: Optional[int] = None,
         dtype: object = "i2",
+        quality: AnyQuality = "standard",
+        cpu_cores: Optional[int] = None,
+        stems: int = 1,
     ):
+        # with cpu_cores > 1, FluidSynth renders voices in that many threads;
+        # None is default_cpu_cores(); with stems > 1, MIDI channels 0 through
+        # stems - 1 each have their own audio output and effects, for
+        # stem_synthesize
+        self.quality = get_quality(quality)
+        if sample_rate is None:
+            sample_rate = self.quality.sample_rate
         self.sample_rate = sample_rate
+        if cpu_cores is None:
+            cpu_cores = default_cpu_cores()
+        self.cpu_cores = cpu_cores
+        self.stems = stems
         self.dtype = np.dtype(dtype)
         if self.dtype != np.dtype(np.int16) and self.dtype != np.dtype(np.float32):
             raise TypeError(
                 'only dtype = np.int16 ("i2") or np.float32 ("f4") are allowed'
             )
 
-        self.settings = new_fluid_settings()
-        fluid_settings_setnum(self.settings, b"synth.gain", 0.2)
-        fluid_settings_setnum(self.settings, b"synth.sample-rate", self.sample_rate)
-        fluid_settings_setint(self.settings, b"synth.midi-channels", 256)
-        fluid_settings_setint(self.settings, b"synth.lock-memory", 0)
+        library = get_library()
+
+        self.settings = library.new_fluid_settings()
+        library.fluid_settings_setnum(self.settings, b"synth.gain", 0.2)
+        library.fluid_settings_setnum(
+            self.settings, b"synth.sample-rate", self.sample_rate
+        )
+        library.fluid_settings_setint(self.settings, b"synth.midi-channels", 256)
+        library.fluid_settings_setint(self.settings, b"synth.lock-memory", 0)
+        library.fluid_settings_setint(
+            self.settings, b"synth.reverb.active", int(self.quality.reverb)
+        )
+        library.fluid_settings_setint(
+            self.settings, b"synth.chorus.active", int(self.quality.chorus)
+        )
+        library.fluid_settings_setint(
+            self.settings, b"synth.polyphony", self.quality.polyphony
+        )
+        library.fluid_settings_setint(self.settings, b"synth.cpu-cores", cpu_cores)
+        if stems != 1:
+            # FluidSynth rejects (FLUID_FAILED) values outside of its limits
+            for name in (
+                b"synth.audio-channels",
+                b"synth.audio-groups",
+                b"synth.effects-groups",
+            ):
+                if library.fluid_settings_setint(self.settings, name, stems) == -1:
+                    library.delete_fluid_settings(self.settings)
+                    raise ValueError(
+                        f"FluidSynth can't render {stems} stems: "
+                        f"{name.decode()} is out of range"
+                    )
 
-        self.synthesizer = new_fluid_synth(self.settings)
+        self.synthesizer = library.new_fluid_synth(self.settings)
+        library.fluid_synth_set_interp_method(
+            self.synthesizer, -1, self.quality.interpolation
+        )
 
         if soundfont is None:
-            soundfont = pkg_resources.resource_filename(
-                "doremi", "data/Nice-Steinway-Lite-v3.0.sf2"
-            )
-        self.soundfont = fluid_synth_sfload(self.synthesizer, soundfont.encode(), 0)
+            soundfont = default_soundfont()
+        self.soundfont_path = soundfont
+        self.soundfont = library.fluid_synth_sfload(
+            self.synthesizer, soundfont.encode(), 0
+        )
         if self.soundfont == -1:
             raise FileNotFoundError(f"could not open file named {repr(soundfont)}")
 
-        fluid_synth_program_select(self.synthesizer, 0, self.soundfont, 0, 0)
-
-    def delete(self):
-        delete_fluid_synth(self.synthesizer)
-        delete_fluid_settings(self.settings)
+        for channel in range(stems):
+            library.fluid_synth_program_select(
+                self.synthesizer, channel, self.soundfont, 0, 0
+            )
 
-    def midi_synthesize(
-        self, events: List[Tuple[float, List[Tuple[int, int]]]]
-    ) -> np.ndarray:
-        if len(events) == 0:
-            return np.zeros((0, 2), self.dtype)
+    def reset(self):
+        # silence everything immediately (no release tails carry over) and put
+        # the controllers and programs back, so that the next use starts fresh
+        library = get_library()
+        library.fluid_synth_all_sounds_off(self.synthesizer, -1)
+        library.fluid_synth_system_reset(self.synthesizer)
+        for channel in range(self.stems):
+            library.fluid_synth_program_select(
+                self.synthesizer, channel, self.soundfont, 0, 0
+            )
+        library.fluid_synth_set_interp_method(
+            self.synthesizer, -1, self.quality.interpolation
+        )
 
-        num_seconds = events[-1][0]
-        num_samples = int(self.sample_rate * num_seconds)
-        array = np.zeros((num_samples, 2), self.dtype)
+    def delete(self):
+        library = get_library()
+        library.delete_fluid_synth(self.synthesizer)
+        library.delete_fluid_settings(self.settings)
 
+    def write(self, section: np.ndarray):
+        # fills a C-contiguous (num_samples, 2) array with interleaved stereo
+        library = get_library()
         if self.dtype == np.dtype(np.int16):
-            function = fluid_synth_write_s16
+            function = library.fluid_synth_write_s16
         elif self.dtype == np.dtype(np.float32):
-            function = fluid_synth_write_float
+            function = library.fluid_synth_write_float
         else:
             raise AssertionError(repr(self.dtype))
 
-        last_time = 0.0
-        for this_time, changes in events:
-            last_index = int(self.sample_rate * last_time)
+        buf = section.ctypes.data_as(ctypes.c_void_p)
+        function(self.synthesizer, len(section), buf, 0, 2, buf, 1, 2)
+
+    def active_voices(self) -> int:
+        # voices that are still sounding, including ones in their release
+        return get_library().fluid_synth_get_active_voice_count(self.synthesizer)
+
+    def silent_after(self, part: np.ndarray) -> bool:
+        # True if nothing sounds after this part until the next event: it's all
+        # zeros, no voices are left, and reverb and chorus are off. Their state
+        # can't be read from FluidSynth, and it holds sound below the output's
+        # resolution, which skipping would carry past the gap into later notes.
+        if self.quality.reverb or self.quality.chorus:
+            return False
+        return not np.any(part) and self.active_voices() == 0
+
+    def write_gap(self, section: np.ndarray, zeroed: bool = False):
+        # Writes the section between two events check_size samples at a time,
+        # until silent_after a part: the rest is zeros (left alone if the
+        # section is already zeroed), exactly as FluidSynth would have written.
+        for i in range(0, len(section), self.check_size):
+            part = section[i : i + self.check_size]
+            self.write(part)
+            if self.silent_after(part):
+                if not zeroed:
+                    section[i + len(part) :] = 0
+                return
+
+    def send(self, changes: List[Tuple[int, int]]):
+        library = get_library()
+        for p, v in changes:
+            if v == 0:
+                library.fluid_synth_noteoff(self.synthesizer, 0, p)
+            else:
+                library.fluid_synth_noteon(self.synthesizer, 0, p, v)
+
+    def send_channels(self, changes: List[Tuple[int, int, int]]):
+        library = get_library()
+        for p, v, channel in changes:
+            if v == 0:
+                library.fluid_synth_noteoff(self.synthesizer, channel, p)
+            else:
+                library.fluid_synth_noteon(self.synthesizer, channel, p, v)
+
+    def process(self, section: np.ndarray):
+        # Adds to a float32 (stems, 2, num_samples) section, which may be a slice
+        # of a longer array, the audio of each stem: its dry output in out and
+        # its reverb and chorus in fx, aliased to the same buffers. FluidSynth
+        # mixes audio group g into out[2g] and out[2g + 1], and its effects into
+        # fx[4g] through fx[4g + 3] (reverb left, right, chorus left, right).
+        out = [section[k, c].ctypes.data for k in range(self.stems) for c in (0, 1)]
+        fx = [x for k in range(self.stems) for x in out[2 * k : 2 * k + 2] * 2]
+        get_library().fluid_synth_process(
+            self.synthesizer,
+            section.shape[2],
+            len(fx),
+            (ctypes.c_void_p * len(fx))(*fx),
+            len(out),
+            (ctypes.c_void_p * len(out))(*out),
+        )
+
+    def stem_synthesize(self, events: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Events from Composition.midi_event_array(channels=True), rendered in
+        # one pass with every channel in its own stem: returns the stems as an
+        # array of (stems, num_samples, 2) and their mix as (num_samples, 2).
+        num_samples = 0
+        if len(events) != 0:
+            num_samples = int(self.sample_rate * events["time"][-1])
+        planar = np.zeros((self.stems, 2, num_samples), np.float32)
+
+        last_index = 0
+        for this_time, changes in grouped_events(events):
             this_index = int(self.sample_rate * this_time)
+            if last_index != this_index:
+                self.process(planar[:, :, last_index:this_index])
+            self.send_channels(changes)
+            last_index = this_index
+
+        stems = planar.transpose(0, 2, 1)
+        mix = stems.sum(axis=0)
+        if self.dtype == np.dtype(np.int16):
+            stems = np.clip(np.round(stems * 32768), -32768, 32767).astype(np.int16)
+            mix = np.clip(np.round(mix * 32768), -32768, 32767).astype(np.int16)
+        return np.ascontiguousarray(stems), mix
+
+    def midi_synthesize(
+        self,
+        events: Union[Iterable[Tuple[float, List[Tuple[int, int]]]], np.ndarray],
+        grid: Optional[int] = None,
+    ) -> np.ndarray:
+        # A Composition.midi_event_array gives the length in advance, so the
+        # audio is written into one array. Other events are consumed one at a
+        # time (they may come from a generator), into an array that's resized
+        # in place, at least doubling each time, and then trimmed to the length.
+        # With a grid (such as 64 samples), each event is moved to the nearest
+        # multiple of it, so that dense music is written in whole grid steps,
+        # rather than a few samples at a time; see timing_error.
+        if isinstance(events, np.ndarray):
+            num_samples = 0
+            if len(events) != 0:
+                num_samples = grid_index(
+                    int(self.sample_rate * events["time"][-1]), grid
+                )
+            array = np.zeros((num_samples, 2), self.dtype)
+            self.synthesize_into(events, array, grid=grid, zeroed=True)
+            return array
+
+        array = np.zeros((0, 2), self.dtype)
+        last_index = 0
+        for this_time, changes in events:
+            this_index = grid_index(int(self.sample_rate * this_time), grid)
 
             if last_index != this_index:
-                section = array[last_index:this_index]
-                buf = section.ctypes.data_as(ctypes.c_void_p)
-                function(self.synthesizer, len(section), buf, 0, 2, buf, 1, 2)
+                if this_index > len(array):
+                    # no views of the array are kept, and new rows are zeros
+                    length = max(this_index, 2 * len(array))
+                    array.resize((length, 2), refcheck=False)
+                self.write_gap(array[last_index:this_index], zeroed=True)
+
+            self.send(changes)
+            last_index = this_index
+
+        array.resize((last_index, 2), refcheck=False)
+        return array
 
-            for p, v in changes:
+    def synthesize_into(
+        self,
+        events: Union[Iterable[Tuple[float, List[Tuple[int, int]]]], np.ndarray],
+        array: np.ndarray,
+        start: int = 0,
+        grid: Optional[int] = None,
+        zeroed: bool = False,
+    ):
+        # like midi_synthesize, but into an array that's already allocated, such
+        # as a numpy.memmap; array[0] is sample number start, no event may come
+        # before it, and anything after the last event is rendered without one;
+        # zeroed says that the array is already all zeros (such as a new file),
+        # so silence isn't written into it
+        if isinstance(events, np.ndarray):
+            events = grouped_events(events)
+
+        last_index = 0
+        for this_time, changes in events:
+            this_index = grid_index(int(self.sample_rate * this_time), grid) - start
+
+            if last_index != this_index:
+                self.write_gap(array[last_index:this_index], zeroed)
+
+            self.send(changes)
+            last_index = this_index
+
+        if last_index < len(array):
+            self.write_gap(array[last_index:], zeroed)
+
+    def phrase_synthesize(
+        self, events: np.ndarray, max_tail_in_seconds: float = 10.0
+    ) -> np.ndarray:
+        # Like midi_synthesize, but repeated phrases are only rendered once. The
+        # events are cut into phrases wherever a note-on comes while no notes
+        # are held, so only release tails cross from one phrase into the next.
+        # Phrases with the same changes at the same sample offsets are the same,
+        # and each distinct one is rendered from a reset synth until it's silent
+        # again, then added into the output wherever it's played. This matches a
+        # straight render as far as voices add linearly: effects with their own
+        # time-varying state (chorus) and voice stealing can differ.
+        if not isinstance(events, np.ndarray):
+            raise TypeError("phrase_synthesize needs Composition.midi_event_array")
+
+        num_samples = 0
+        if len(events) != 0:
+            num_samples = int(self.sample_rate * events["time"][-1])
+        integer = self.dtype == np.dtype(np.int16)
+        out = np.zeros((num_samples, 2), np.int32 if integer else np.float32)
+
+        index = (self.sample_rate * events["time"]).astype(np.int64)
+        pitch, velocity = events["pitch"], events["velocity"]
+        max_tail = int(self.sample_rate * max_tail_in_seconds)
+        rendered = {}
+        for start, stop, key in phrases(events, self.sample_rate):
+            audio = rendered.get(key)
+            if audio is None:
+                audio = rendered[key] = self.render_phrase(
+                    index[start:stop] - index[start],
+                    pitch[start:stop],
+                    velocity[start:stop],
+                    max_tail,
+                )
+            first = int(index[start])
+            audio = audio[: num_samples - first]
+            out[first : first + len(audio)] += audio
+
+        if integer:
+            return np.clip(out, -32768, 32767).astype(np.int16)
+        return out
+
+    def render_phrase(
+        self,
+        offsets: np.ndarray,
+        pitch: np.ndarray,
+        velocity: np.ndarray,
+        max_tail: int,
+    ) -> np.ndarray:
+        # the changes at offsets (in samples) from a silent synth, followed by
+        # their tail, until a check_size part is silent with no voices left
+        # (below half of the int16 step for float32) or max_tail samples
+        self.reset()
+        changes = list(zip(pitch.tolist(), velocity.tolist()))
+        (boundaries,) = np.nonzero(np.diff(offsets))
+        boundaries = [0] + (boundaries + 1).tolist() + [len(offsets)]
+
+        sections = []
+        last_offset = 0
+        for begin, end in zip(boundaries[:-1], boundaries[1:]):
+            this_offset = int(offsets[begin])
+            if last_offset != this_offset:
+                section = np.zeros((this_offset - last_offset, 2), self.dtype)
+                self.write(section)
+                sections.append(section)
+            self.send(changes[begin:end])
+            last_offset = this_offset
+
+        threshold = 0 if self.dtype == np.dtype(np.int16) else 0.5 / 32768
+        for _ in range(0, max_tail, self.check_size):
+            section = np.zeros((self.check_size, 2), self.dtype)
+            self.write(section)
+            sections.append(section)
+            if np.max(np.abs(section)) <= threshold and self.active_voices() == 0:
+                break
+
+        return np.concatenate(sections)
+
+    def sequence_synthesize(
+        self, events: np.ndarray, write_size: int = 65536
+    ) -> np.ndarray:
+        # Like midi_synthesize, but all of the events are queued in a FluidSynth
+        # sequencer up front and the audio is written write_size samples at a
+        # time, rather than making a ctypes call for every change and every gap.
+        # The sequencer counts in samples, but FluidSynth only dispatches its
+        # events between 64-sample blocks, so changes can be up to 63 samples
+        # late.
+        if not isinstance(events, np.ndarray):
+            raise TypeError("sequence_synthesize needs Composition.midi_event_array")
+
+        num_samples = 0
+        if len(events) != 0:
+            num_samples = int(self.sample_rate * events["time"][-1])
+        array = np.zeros((num_samples, 2), self.dtype)
+
+        library = get_library()
+        sequencer = library.new_fluid_sequencer2(0)
+        event = library.new_fluid_event()
+        try:
+            library.fluid_sequencer_set_time_scale(sequencer, self.sample_rate)
+            destination = library.fluid_sequencer_register_fluidsynth(
+                sequencer, self.synthesizer
+            )
+            library.fluid_event_set_source(event, -1)
+            library.fluid_event_set_dest(event, destination)
+
+            start = library.fluid_sequencer_get_tick(sequencer)
+            ticks = (self.sample_rate * events["time"]).astype(np.int64) + start
+            for tick, p, v in zip(
+                ticks.tolist(), events["pitch"].tolist(), events["velocity"].tolist()
+            ):
                 if v == 0:
-                    fluid_synth_noteoff(self.synthesizer, 0, p)
+                    library.fluid_event_noteoff(event, 0, p)
                 else:
-                    fluid_synth_noteon(self.synthesizer, 0, p, v)
+                    library.fluid_event_noteon(event, 0, p, v)
+                library.fluid_sequencer_send_at(sequencer, event, tick, 1)
+
+            for i in range(0, num_samples, write_size):
+                self.write(array[i : i + write_size])
 
-            last_time = this_time
+        finally:
+            library.delete_fluid_event(event)
+            library.delete_fluid_sequencer(sequencer)
 
         return array
+
+    def render_blocks(
+        self,
+        events: Union[Iterable[Tuple[float, List[Tuple[int, int]]]], np.ndarray],
+        block_size: int = 4096,
+    ) -> Iterator[np.ndarray]:
+        # the same samples as midi_synthesize, block_size at a time (the last
+        # block may be shorter); every block is the same buffer, overwritten by
+        # the next one, so copy it to keep it
+        if isinstance(events, np.ndarray):
+            events = grouped_events(events)
+
+        buffer = np.zeros((block_size, 2), self.dtype)
+        filled = 0
+        last_index = 0
+        for this_time, changes in events:
+            this_index = int(self.sample_rate * this_time)
+
+            silent = False
+            while last_index != this_index:
+                # as in write_gap, with a check after every block or part of one
+                size = min(this_index - last_index, block_size - filled)
+                part = buffer[filled : filled + size]
+                if silent:
+                    part[:] = 0
+                else:
+                    self.write(part)
+                    silent = self.silent_after(part)
+                filled += size
+                last_index += size
+                if filled == block_size:
+                    yield buffer
+                    filled = 0
+
+            self.send(changes)
+
+        if filled != 0:
+            yield buffer[:filled]
+
+
+@dataclass
+class Segment:
+    # events[first:last] are rendered into samples [start, stop + tail), after
+    # turning on the notes that are sounding at start
+    start: int
+    stop: int
+    tail: int
+    first: int
+    last: int
+    sounding: List[Tuple[int, int]]
+
+
+def segments(
+    events: np.ndarray, sample_rate: int, num_segments: int, overlap: int
+) -> List[Segment]:
+    # Each boundary is the event time with the fewest notes sounding within
+    # half a segment of its ideal place, so that little has to be replayed.
+    # Segments end at the last event, like midi_synthesize.
+    time = events["time"]
+    if len(time) == 0:
+        return []
+    index = (sample_rate * time).astype(np.int64)
+    num_samples = int(index[-1])
+
+    # sounding[i] is the number of notes on just before events[i]
+    change = np.where(events["velocity"] != 0, 1, -1)
+    sounding = np.concatenate([[0], np.cumsum(change)[:-1]])
+    (groups,) = np.nonzero(np.concatenate([[True], time[1:] != time[:-1]]))
+
+    boundaries = [0]
+    for k in range(1, num_segments):
+        target = time[-1] * k / num_segments
+        width = time[-1] / num_segments / 2
+        candidates = groups[
+            (np.abs(time[groups] - target) < width)
+            & (index[groups] > index[boundaries[-1]])
+            & (index[groups] < num_samples)
+        ]
+        if len(candidates) != 0:
+            best = np.lexsort((np.abs(time[candidates] - target), sounding[candidates]))
+            boundaries.append(int(candidates[best[0]]))
+
+    starts = [0] + [int(index[x]) for x in boundaries[1:]]
+    stops = starts[1:] + [num_samples]
+    overlap = min([overlap] + [stop - start for start, stop in zip(starts, stops)])
+
+    out = []
+    for k, first in enumerate(boundaries):
+        tail = overlap if k + 1 < len(boundaries) else 0
+        last = int(np.searchsorted(index, stops[k] + tail))
+        if k + 1 == len(boundaries):
+            last = len(events)
+
+        out.append(
+            Segment(starts[k], stops[k], tail, first, last, sounding_at(events, first))
+        )
+
+    return out
+
+
+def sounding_at(events: np.ndarray, row: int) -> List[Tuple[int, int]]:
+    # notes (pitch, velocity) that are on just before events[row]: the ones
+    # whose last change before it turned them on
+    reverse = events[:row][::-1]
+    pitches, latest = np.unique(reverse["pitch"], return_index=True)
+    velocities = reverse["velocity"][latest]
+    return [(p, v) for p, v in zip(pitches.tolist(), velocities.tolist()) if v != 0]
+
+
+def crossfade(fading_out: np.ndarray, fading_in: np.ndarray) -> np.ndarray:
+    fade = ((np.arange(len(fading_out)) + 0.5) / len(fading_out))[:, None]
+    mixed = fading_out * (1 - fade) + fading_in * fade
+    if fading_out.dtype == np.dtype(np.int16):
+        mixed = np.clip(np.round(mixed), -32768, 32767)
+    return mixed
+
+
+def render_segment(
+    shared_name: str,
+    num_samples: int,
+    offset: int,
+    segment: Segment,
+    events: np.ndarray,
+    soundfont: Optional[str],
+    sample_rate: int,
+    dtype: object,
+    quality: AnyQuality,
+    cpu_cores: int,
+):
+    # runs in a worker process; the segment goes in its own part of the shared
+    # buffer, starting at offset
+    from multiprocessing.shared_memory import SharedMemory
+
+    shared = SharedMemory(shared_name)
+    synth = Fluidsynth(soundfont, sample_rate, dtype, quality, cpu_cores)
+    try:
+        array = np.ndarray((num_samples, 2), dtype, shared.buf)
+        length = segment.stop + segment.tail - segment.start
+        synth.send(segment.sounding)
+        synth.synthesize_into(events, array[offset : offset + length], segment.start)
+        del array
+    finally:
+        synth.delete()
+        shared.close()
+
+
+def stitch(rendered: np.ndarray, parts: List[Segment], offsets: List[int]):
+    # each part's tail fades out while the beginning of the next fades in
+    out = np.empty((parts[-1].stop, 2), rendered.dtype)
+    for k, (offset, part) in enumerate(zip(offsets, parts)):
+        out[part.start : part.stop] = rendered[offset : offset + part.stop - part.start]
+        if k != 0 and parts[k - 1].tail != 0:
+            overlap = parts[k - 1].tail
+            head = out[part.start : part.start + overlap]
+            head[:] = crossfade(rendered[offset - overlap : offset], head)
+    return out
+
+
+def parallel_synthesize(
+    events: np.ndarray,
+    processes: Optional[int] = None,
+    soundfont: Optional[str] = None,
+    sample_rate: Optional[int] = None,
+    dtype: object = "i2",
+    quality: AnyQuality = "standard",
+    overlap_in_seconds: float = 0.1,
+    cpu_cores: Optional[int] = None,
+) -> np.ndarray:
+    # Approximately midi_synthesize(events), rendered in time segments by a pool
+    # of processes (Python 3.8 or later, for shared memory). Each segment keeps
+    # rendering for overlap_in_seconds after its end, and that tail is
+    # crossfaded into the next segment's beginning, which hides the re-attack
+    # of the notes that the next segment had to turn on. Each process's synth
+    # has cpu_cores threads; None divides the available cores among them.
+    if sys.version_info < (3, 8):
+        raise NotImplementedError(
+            "rendering in parallel processes needs Python 3.8 or later "
+            "(multiprocessing.shared_memory)"
+        )
+
+    import concurrent.futures
+    from multiprocessing.shared_memory import SharedMemory
+
+    dtype = np.dtype(dtype)
+    if processes is None:
+        processes = available_cores()
+    if sample_rate is None:
+        sample_rate = get_quality(quality).sample_rate
+
+    parts = segments(
+        events, sample_rate, processes, int(round(sample_rate * overlap_in_seconds))
+    )
+    if len(parts) == 0:
+        return np.zeros((0, 2), dtype)
+    if cpu_cores is None:
+        cpu_cores = max(available_cores() // len(parts), 1)
+
+    # each segment's samples and tail are contiguous in the shared buffer
+    offsets = np.cumsum([0] + [x.stop + x.tail - x.start for x in parts]).tolist()
+    shared = SharedMemory(create=True, size=max(offsets[-1] * 2 * dtype.itemsize, 1))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(len(parts)) as executor:
+            futures = [
+                executor.submit(
+                    render_segment,
+                    shared.name,
+                    offsets[-1],
+                    offset,
+                    part,
+                    events[part.first : part.last],
+                    soundfont,
+                    sample_rate,
+                    dtype,
+                    quality,
+                    cpu_cores,
+                )
+                for offset, part in zip(offsets, parts)
+            ]
+            for future in futures:
+                future.result()
+
+        rendered = np.ndarray((offsets[-1], 2), dtype, shared.buf)
+        out = stitch(rendered, parts, offsets)
+        del rendered
+    finally:
+        shared.close()
+        shared.unlink()
+
+    return out
+
+
+class SynthPool:
+    # Loading a SoundFont is much slower than rendering a short composition, so
+    # synths are kept loaded between uses. Idle synths are keyed by (soundfont,
+    # sample_rate, dtype, quality, cpu_cores, stems) and at most max_idle are kept,
+    # evicting the least recently used. Synths loading the same file share its
+    # sample data through FluidSynth's sample cache, as long as one of them
+    # stays loaded.
+
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle: List[Tuple[tuple, Fluidsynth]] = []
+
+    @staticmethod
+    def key(
+        soundfont: Optional[str],
+        sample_rate: Optional[int],
+        dtype: object,
+        quality: AnyQuality,
+        cpu_cores: Optional[int],
+        stems: int = 1,
+    ) -> Tuple[str, int, np.dtype, Quality, int, int]:
+        if soundfont is None:
+            soundfont = default_soundfont()
+        quality = get_quality(quality)
+        if sample_rate is None:
+            sample_rate = quality.sample_rate
+        if cpu_cores is None:
+            cpu_cores = default_cpu_cores()
+        return (
+            os.path.abspath(soundfont),
+            sample_rate,
+            np.dtype(dtype),
+            quality,
+            cpu_cores,
+            stems,
+        )
+
+    def checkout(
+        self,
+        soundfont: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        quality: AnyQuality = "standard",
+        cpu_cores: Optional[int] = None,
+        stems: int = 1,
+    ) -> Fluidsynth:
+        key = self.key(soundfont, sample_rate, dtype, quality, cpu_cores, stems)
+        with self.lock:
+            for i in range(len(self.idle) - 1, -1, -1):
+                if self.idle[i][0] == key:
+                    return self.idle.pop(i)[1]
+        return Fluidsynth(*key)
+
+    def checkin(self, synth: Fluidsynth):
+        try:
+            synth.reset()
+        except Exception:
+            synth.delete()
+            raise
+
+        key = self.key(
+            synth.soundfont_path,
+            synth.sample_rate,
+            synth.dtype,
+            synth.quality,
+            synth.cpu_cores,
+            synth.stems,
+        )
+        with self.lock:
+            self.idle.append((key, synth))
+            evicted = self.idle[: max(len(self.idle) - self.max_idle, 0)]
+            del self.idle[: len(evicted)]
+
+        for _, old in evicted:
+            old.delete()
+
+    @contextlib.contextmanager
+    def synth(
+        self,
+        soundfont: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        quality: AnyQuality = "standard",
+        cpu_cores: Optional[int] = None,
+        stems: int = 1,
+    ) -> Iterator[Fluidsynth]:
+        synth = self.checkout(soundfont, sample_rate, dtype, quality, cpu_cores, stems)
+        try:
+            yield synth
+        finally:
+            self.checkin(synth)
+
+    def clear(self):
+        with self.lock:
+            evicted = self.idle
+            self.idle = []
+        for _, old in evicted:
+            old.delete()
+
+
+pool = SynthPool()
+
+
+class RenderSession:
+    # Keeps the last events and audio, so that after an edit only the part of
+    # the timeline whose events changed is rendered again: from the first event
+    # that differs to the last one (before an unchanged ending), plus
+    # release_in_seconds for the changed notes to die away. The window starts
+    # with the notes that are sounding at that point turned on, so its edges
+    # are crossfaded over overlap_in_seconds with the audio from before.
+
+    def __init__(
+        self,
+        soundfont: Optional[str] = None,
+        sample_rate: Optional[int] = None,
+        dtype: object = "i2",
+        quality: AnyQuality = "standard",
+        release_in_seconds: float = 2.0,
+        overlap_in_seconds: float = 0.05,
+    ):
+        self.soundfont = soundfont
+        self.quality = get_quality(quality)
+        if sample_rate is None:
+            sample_rate = self.quality.sample_rate
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.release = int(round(sample_rate * release_in_seconds))
+        self.overlap = int(round(sample_rate * overlap_in_seconds))
+        self.events: Optional[np.ndarray] = None
+        self.audio = np.zeros((0, 2), self.dtype)
+        self.window: Optional[Tuple[int, int]] = None
+
+    def changed(self, events: np.ndarray) -> Optional[Tuple[float, float]]:
+        # the times of the first and last events that differ, or None if none do;
+        # the last is inf if the ending differs (in particular, if it moved)
+        if self.events is None:
+            return (0.0, np.inf)
+        old = self.events
+        size = min(len(old), len(events))
+
+        same = old[:size] == events[:size]
+        first = size if np.all(same) else int(np.argmin(same))
+        if first == len(old) == len(events):
+            return None
+
+        same = old[len(old) - size :][::-1] == events[len(events) - size :][::-1]
+        last = size if np.all(same) else int(np.argmin(same))
+        last = min(last, size - first)
+
+        # rows are in time order, so the differing rows of each side, x[first:
+        # len(x) - last], start with the earliest time and end with the latest
+        times = [x["time"] for x in (old, events) if len(x) - last > first]
+        earliest = min(float(x[first]) for x in times)
+        if last == 0:
+            return (earliest, np.inf)
+        return (earliest, max(float(x[len(x) - last - 1]) for x in times))
+
+    def update(self, events: np.ndarray) -> np.ndarray:
+        # events from Composition.midi_event_array; returns the whole audio,
+        # which is the same as midi_synthesize(events) outside of the window
+        changed = self.changed(events)
+        if changed is None:
+            self.window = None
+            return self.audio
+
+        index = (self.sample_rate * events["time"]).astype(np.int64)
+        num_samples = int(index[-1]) if len(events) != 0 else 0
+
+        # the old audio is right until the first change, but it ends at its last
+        # event, without the release of the notes that were still sounding
+        start = int(self.sample_rate * changed[0]) - self.overlap
+        start = max(min(start, len(self.audio) - self.overlap), 0)
+        stop = num_samples
+        if changed[1] != np.inf:
+            # an unchanged ending means that the audio is the same length
+            stop = int(self.sample_rate * changed[1]) + self.release
+            if stop + self.overlap >= num_samples:
+                stop = num_samples
+        end = stop if stop == num_samples else stop + self.overlap
+        start = min(start, stop)
+
+        rendered = np.zeros((end - start, 2), self.dtype)
+        first = int(np.searchsorted(index, start))
+        last = int(np.searchsorted(index, end))
+        with pool.synth(
+            self.soundfont, self.sample_rate, self.dtype, self.quality
+        ) as synth:
+            synth.send(sounding_at(events, first))
+            synth.synthesize_into(events[first:last], rendered, start)
+
+        audio = np.empty((num_samples, 2), self.dtype)
+        audio[:start] = self.audio[:start]
+        audio[start:end] = rendered
+        if end != num_samples:
+            audio[end:] = self.audio[end:]
+        if start != 0:
+            head = audio[start : start + self.overlap]
+            head[:] = crossfade(self.audio[start : start + len(head)], head)
+        if end != stop:
+            tail = audio[stop:end]
+            tail[:] = crossfade(tail, self.audio[stop:end])
+
+        self.events = events
+        self.audio = audio
+        self.window = (start, end)
+        return audio
@@ -0,0 +1,208 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import math
+from dataclasses import dataclass
+from typing import Iterable, List, Tuple, Union
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Voice:
+    harmonics: Tuple[float, ...]  # amplitude of the fundamental, 2nd harmonic, ...
+    attack: float  # seconds to reach full level
+    decay: float  # seconds for the level to fall by 1/e toward sustain
+    sustain: float  # level (0 to 1) that a held note settles to
+    release: float  # seconds to fade to silence after the note stops
+
+
+voices = {
+    "sine": Voice((1.0,), 0.005, 0.1, 1.0, 0.02),
+    "organ": Voice((1.0, 0.5, 0.0, 0.25, 0.0, 0.0, 0.0, 0.125), 0.01, 0.1, 0.9, 0.05),
+    "piano": Voice((1.0, 0.5, 0.3, 0.2, 0.12, 0.08, 0.05, 0.03), 0.002, 0.8, 0.1, 0.2),
+}
+
+AnyVoice = Union[str, Voice]
+
+
+def get_voice(voice: AnyVoice) -> Voice:
+    if isinstance(voice, Voice):
+        return voice
+    try:
+        return voices[voice]
+    except KeyError:
+        raise ValueError(
+            f"unrecognized voice {voice!r}; choose from {', '.join(map(repr, voices))}"
+        ) from None
+
+
+def midi_frequency(pitch: np.ndarray) -> np.ndarray:
+    return 440.0 * 2.0 ** ((np.asarray(pitch, np.float64) - 69) / 12.0)
+
+
+def event_notes(
+    events: Union[Iterable[Tuple[float, List[Tuple[int, int]]]], np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (frequency, start, stop, velocity) of the notes in MIDI events, either a
+    # Composition.midi_event_array or (time, changes) pairs. Within each pitch,
+    # the changes alternate between note-on and note-off (a retrigger is an off
+    # and then an on), so a stable sort by pitch pairs them up.
+    if not isinstance(events, np.ndarray):
+        rows = [(t, p, v) for t, changes in events for p, v in changes]
+        events = np.array(rows, [("time", "f8"), ("pitch", "u1"), ("velocity", "u1")])
+
+    by_pitch = np.argsort(events["pitch"], kind="stable")
+    on, off = events[by_pitch[0::2]], events[by_pitch[1::2]]
+    if (
+        len(on) != len(off)
+        or np.any(on["pitch"] != off["pitch"])
+        or np.any(on["velocity"] == 0)
+        or np.any(off["velocity"] != 0)
+    ):
+        raise ValueError("every note-on must be followed by a note-off of its pitch")
+
+    return midi_frequency(on["pitch"]), on["time"], off["time"], on["velocity"]
+
+
+class NumpySynth:
+    # A fallback for when libfluidsynth isn't available: each note is a sum of
+    # harmonics with an attack-decay-sustain-release envelope. The audio is
+    # made block_size samples at a time, by evaluating every note that sounds
+    # in the block as one (notes × samples) array and summing it into the
+    # preallocated output. "additive" computes each harmonic with np.sin, and
+    # leaves out the ones above the Nyquist frequency; "wavetable" looks up one
+    # period of the summed waveform, which costs the same for any number of
+    # harmonics, but aliases the ones that are too high for a note.
+
+    def __init__(
+        self,
+        sample_rate: int = 44100,
+        dtype: object = "i2",
+        voice: AnyVoice = "piano",
+        method: str = "additive",
+        gain: float = 0.2,
+        block_size: int = 4096,
+        table_size: int = 4096,
+    ):
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        if self.dtype != np.dtype(np.int16) and self.dtype != np.dtype(np.float32):
+            raise TypeError(
+                'only dtype = np.int16 ("i2") or np.float32 ("f4") are allowed'
+            )
+        self.voice = get_voice(voice)
+        if method not in ("additive", "wavetable"):
+            raise ValueError(
+                f'method must be "additive" or "wavetable", not {method!r}'
+            )
+        self.method = method
+        self.gain = gain
+        self.block_size = block_size
+
+        # the waveform peaks at 1 for any set of harmonics
+        harmonics = np.array(self.voice.harmonics, np.float64)
+        self.harmonics = harmonics / np.sum(np.abs(harmonics))
+        phase = 2 * np.pi * np.arange(table_size + 1) / table_size
+        self.table = np.zeros(table_size + 1)
+        for k, amplitude in enumerate(self.harmonics.tolist()):
+            self.table += amplitude * np.sin((k + 1) * phase)
+
+        self.attack = max(self.voice.attack * sample_rate, 1.0)
+        self.decay = max(self.voice.decay * sample_rate, 1.0)
+        self.release = int(math.ceil(self.voice.release * sample_rate))
+
+    def envelope(self, t: np.ndarray, held: np.ndarray) -> np.ndarray:
+        # t and held (the number of samples before the note stops) in samples
+        x = np.minimum(t, held)
+        sustain = self.voice.sustain
+        level = np.where(
+            x < self.attack,
+            x / self.attack,
+            sustain + (1 - sustain) * np.exp(-(x - self.attack) / self.decay),
+        )
+        released = np.maximum(t - held, 0) / max(self.release, 1)
+        return level * np.maximum(1 - released, 0)
+
+    def waveform(self, t: np.ndarray, frequency: np.ndarray) -> np.ndarray:
+        cycles = t * (frequency / self.sample_rate)[:, None]
+        if self.method == "additive":
+            # one sin and one cos, and the rest by the Chebyshev recurrence:
+            # sin((k + 1) x) = 2 cos(x) sin(k x) - sin((k - 1) x)
+            phase = 2 * np.pi * cycles
+            harmonic = np.sin(phase)
+            previous = np.zeros(t.shape)
+            twice_cos = 2 * np.cos(phase)
+            out = np.zeros(t.shape)
+            for k, amplitude in enumerate(self.harmonics.tolist()):
+                if k != 0:
+                    harmonic, previous = twice_cos * harmonic - previous, harmonic
+                audible = (k + 1) * frequency < self.sample_rate / 2
+                if amplitude != 0 and np.any(audible):
+                    out += (amplitude * audible)[:, None] * harmonic
+            return out
+        else:
+            table_size = len(self.table) - 1
+            position = (cycles % 1.0) * table_size
+            index = position.astype(np.int64)
+            fraction = position - index
+            return self.table[index] * (1 - fraction) + self.table[index + 1] * fraction
+
+    def render(
+        self,
+        frequency: np.ndarray,
+        start: np.ndarray,
+        stop: np.ndarray,
+        velocity: np.ndarray,
+    ) -> np.ndarray:
+        # like FluidSynth, sample numbers are int(sample_rate * time) and the
+        # audio ends at the last note-off, without the release after it
+        first = (self.sample_rate * np.asarray(start, np.float64)).astype(np.int64)
+        last = (self.sample_rate * np.asarray(stop, np.float64)).astype(np.int64)
+        num_samples = int(last.max()) if len(last) != 0 else 0
+        out = np.empty((num_samples, 2), self.dtype)
+
+        order = np.argsort(first, kind="stable")
+        first, last = first[order], last[order]
+        frequency = np.asarray(frequency, np.float64)[order]
+        amplitude = self.gain * np.asarray(velocity, np.float64)[order] / 127
+
+        # ended is nondecreasing, and every note before the first ended[i] that
+        # is after a block's start has faded out before the block
+        end = last + self.release
+        ended = np.maximum.accumulate(end)
+
+        for block_start in range(0, num_samples, self.block_size):
+            block_stop = min(block_start + self.block_size, num_samples)
+            lo = int(np.searchsorted(ended, block_start, side="right"))
+            hi = int(np.searchsorted(first, block_stop, side="left"))
+            (sounding,) = np.nonzero(end[lo:hi] > block_start)
+            sounding += lo
+
+            block = out[block_start:block_stop]
+            if len(sounding) == 0:
+                block[:] = 0
+                continue
+
+            t = np.arange(block_start, block_stop)[None, :] - first[sounding, None]
+            held = (last - first)[sounding, None]
+            notes = self.envelope(t, held) * self.waveform(t, frequency[sounding])
+            notes *= amplitude[sounding, None] * (t >= 0)
+            mono = notes.sum(axis=0)
+
+            if self.dtype == np.dtype(np.int16):
+                mono = np.clip(np.round(mono * 32767), -32768, 32767)
+            block[:] = mono[:, None]
+
+        return out
+
+    def synthesize(self, notes: np.ndarray) -> np.ndarray:
+        # notes from Composition.note_array, which can have any frequencies
+        return self.render(
+            notes["frequency"], notes["start"], notes["stop"], notes["velocity"]
+        )
+
+    def midi_synthesize(
+        self, events: Union[Iterable[Tuple[float, List[Tuple[int, int]]]], np.ndarray]
+    ) -> np.ndarray:
+        # the same events as Fluidsynth.midi_synthesize
+        return self.render(*event_notes(events))
@@ -4,12 +4,12 @@ import lark
 
 
 grammar = r"""
-start: BLANK* assign_passage (BLANK BLANK+ assign_passage)* BLANK_END*
+start: BLANK* assign_passage (BREAK BLANK+ assign_passage)* (BREAK BLANK*)? BLANK_END?
 
-assign_passage: assign "=" BLANK? passage | passage
-assign: WORD | WORD "(" defargs? ")"
+assign_passage: assign "=" NEWLINE? passage | passage
+assign: FUNCTION | FUNCTION "(" defargs? ")"
 defargs: WORD+
-passage: line (BLANK line)*
+passage: line (NEWLINE line)*
 
 line: modified+
 modified: emphasis? absolute? expression octave? augmentation? duration? repetition?
@@ -40,37 +40,65 @@ args: modified+
 
 EMPHASIS: "!"
 ABSOLUTE: "@"
-OCTAVE_UP: "'"
-OCTAVE_UPS: /\'+/
-OCTAVE_DOWN: ","
-OCTAVE_DOWNS: /,+/
-STEP_UP: "+"
-STEP_UPS: /\++/
-STEP_DOWN: "-"
-STEP_DOWNS: /-+/
-DEGREE_UP: ">"
-DEGREE_UPS: />+/
-DEGREE_DOWN: "<"
-DEGREE_DOWNS: /<+/
+OCTAVE_UP: /'(?=[ \t]*(0(?![0-9])|[1-9]))/
+OCTAVE_UPS: /'{2,}|'(?![ \t]*(0(?![0-9])|[1-9]))/
+OCTAVE_DOWN: /,(?=[ \t]*(0(?![0-9])|[1-9]))/
+OCTAVE_DOWNS: /,{2,}|,(?![ \t]*(0(?![0-9])|[1-9]))/
+STEP_UP: /\+(?=[ \t]*(0(?![0-9])|[1-9]))/
+STEP_UPS: /\+{2,}|\+(?![ \t]*(0(?![0-9])|[1-9]))/
+STEP_DOWN: /-(?=[ \t]*(0(?![0-9])|[1-9]))/
+STEP_DOWNS: /-{2,}|-(?![ \t]*(0(?![0-9])|[1-9]))/
+DEGREE_UP: />(?=[ \t]*(0(?![0-9])|[1-9]))/
+DEGREE_UPS: />{2,}|>(?![ \t]*(0(?![0-9])|[1-9]))/
+DEGREE_DOWN: /<(?=[ \t]*(0(?![0-9])|[1-9]))/
+DEGREE_DOWNS: /<{2,}|<(?![ \t]*(0(?![0-9])|[1-9]))/
 DOT: "."
 
 INT: /(0|[1-9][0-9]*)/
 POSITIVE_INT: /[1-9][0-9]*/
 WORD: /[\p{L}_#][\p{L}_#0-9]*/
+FUNCTION: /[\p{L}_#][\p{L}_#0-9]*+(?=[ \t]*+(\([ \t]*+([\p{L}_#][\p{L}_#0-9]*+[ \t]*+)*+\)[ \t]*+)?=)/
 CARDINAL: /[0-9][\p{L}_#0-9]+/
 
 WS: /[ \t]/+
-BLANK: /(\n|\|[^\n]*\n)/
-BLANK_END: /(\n|\|[^\n]*\n|\|[^\n]*)/
+BLANK: /(?<=(^|\n)[ \t]*)(\n|\|[^\n]*\n)/
+NEWLINE: /(?<!(^|\n)[ \t]*)(\n|\|[^\n]*\n)(?![ \t]*(\n|\||\Z))/
+BREAK: /(?<!(^|\n)[ \t]*)(\n|\|[^\n]*\n)(?=[ \t]*(\n|\||\Z))/
+BLANK_END: /\|[^\n]*\Z/
 
 %ignore WS
 """
 
 
-def parsingtree(source: str) -> lark.tree.Tree:
-    return parsingtree.parser.parse(source)
-
-
-parsingtree.parser = lark.Lark(grammar, regex=True)
+def parsingtree(source: str, parser: str = "lalr") -> lark.tree.Tree:
+    return get_parser(parser).parse(source)
+
+
+def get_parser(parser: str = "lalr") -> lark.Lark:
+    out = get_parser.cache.get(parser)
+    if out is None:
+        # The grammar is LALR(1) with a contextual lexer: tokens that would
+        # otherwise collide (OCTAVE_UP/OCTAVE_UPS, BLANK/NEWLINE/BREAK,
+        # FUNCTION/WORD) are made disjoint with regex lookarounds, so that no
+        # parser state has to guess. The Earley parser accepts the same grammar
+        # and is kept as a reference.
+        if parser == "lalr":
+            # lark serializes the analyzed parser to a temporary file whose name
+            # includes a hash of the grammar and options, so only the first
+            # process after a grammar change pays for building the tables
+            out = lark.Lark(
+                grammar, regex=True, parser="lalr", lexer="contextual", cache=True
+            )
+        elif parser == "earley":
+            out = lark.Lark(grammar, regex=True, parser="earley")
+        else:
+            raise ValueError(
+                f"unrecognized parser: {parser!r} (must be 'lalr' or 'earley')"
+            )
+        get_parser.cache[parser] = out
+    return out
+
+
+get_parser.cache = {}
 
 __all__ = "parser"
@@ -0,0 +1,94 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+# stand-ins for doremi.fluidsynth.Fluidsynth, shared by the tests
+
+import numpy as np
+
+import doremi.fluidsynth
+
+
+class CountingSynth(doremi.fluidsynth.Fluidsynth):
+    # writes the index of each sample instead of audio and records when each
+    # change was sent, so that rendering can be checked without the library
+    def __init__(
+        self,
+        soundfont=None,
+        sample_rate=None,
+        dtype="f4",
+        quality="standard",
+        cpu_cores=1,
+        stems=1,
+    ):
+        self.soundfont_path = soundfont
+        self.cpu_cores = cpu_cores
+        self.stems = stems
+        self.quality = doremi.fluidsynth.get_quality(quality)
+        self.sample_rate = sample_rate or self.quality.sample_rate
+        self.dtype = np.dtype(dtype)
+        self.position = 0
+        self.sent = []
+
+    def write(self, section):
+        section[:] = np.arange(self.position, self.position + len(section))[:, None]
+        self.position += len(section)
+
+    def send(self, changes):
+        self.sent.append((self.position, changes))
+
+    def active_voices(self):
+        return 1
+
+    def reset(self):
+        self.position = 0
+        self.sent = []
+
+    def delete(self):
+        pass
+
+
+class FakeSynth:
+    # stands in for Fluidsynth, so that the pool can be tested without the library
+    made = []
+
+    def __init__(self, soundfont, sample_rate, dtype, quality, cpu_cores, stems):
+        self.soundfont_path = soundfont
+        self.quality = quality
+        self.cpu_cores = cpu_cores
+        self.stems = stems
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.resets = 0
+        self.deleted = False
+        FakeSynth.made.append(self)
+
+    def reset(self):
+        self.resets += 1
+
+    def delete(self):
+        self.deleted = True
+
+
+class StateSynth(CountingSynth):
+    # every sample is the sum of the pitches that are on, so two renders agree
+    # wherever the same notes are on, even if one of them was turned on later
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on = set()
+        self.written = 0
+
+    def write(self, section):
+        section[:] = sum(self.on)
+        self.written += len(section)
+
+    def active_voices(self):
+        return len(self.on)
+
+    def send(self, changes):
+        for pitch, velocity in changes:
+            if velocity == 0:
+                self.on.discard(pitch)
+            else:
+                self.on.add(pitch)
+
+    def reset(self):
+        self.on = set()
@@ -22,11 +22,15 @@ from doremi.abstract import (
     NamedPassage,
     UnnamedPassage,
     evaluate,
+    TiledNotes,
+    NoteTable,
+    time_ordered,
     Collection,
     abstracttree,
     SymbolAllUnderscores,
     MismatchingArguments,
     RecursiveFunction,
+    CallCache,
 )
 
 
@@ -1184,3 +1188,176 @@ do f({mi mi} {re re}) fa
             }
         ),
     )
+
+
+def test_evaluate_call_cache():
+    source = """
+chord(x) = x
+x>>
+
+f = y
+
+g(y) = f chord(y)
+
+chord(do) chord(re) chord(do)' chord(do) g(mi) g(fa) g(mi)
+"""
+    expected = abstracttree(source).evaluate(None)
+
+    call_cache = CallCache()
+    assert abstracttree(source).evaluate(None, call_cache)[:2] == expected[:2]
+    assert (call_cache.hits, call_cache.misses) == (2, 9)
+
+    # f refers to the caller's y, so it must not be shared between g(mi) and g(fa)
+    notes = expected[1]
+    assert [x.word.val for x in notes if x.start in (4.0, 6.0, 8.0)] == [
+        "mi",
+        "fa",
+        "mi",
+    ]
+
+
+def test_evaluate_parameter_once():
+    source = """
+f(x) = x x>1 x'+ @x+ {x}>2:3
+
+g(y) = f(y) f({y}-)
+
+g({do re}')
+"""
+    x1 = "{{do re}'}"
+    x2 = "{{{do re}'}-}"
+    inlined = " ".join(f"{x} {x}>1 {x}'+ @{x}+ {{{x}}}>2:3" for x in (x1, x2))
+    assert abstracttree(source).evaluate(None)[:2] == (
+        abstracttree(inlined).evaluate(None)[:2]
+    )
+
+    # g(do) as an argument of g is evaluated where it's referenced, inside g
+    definition1 = abstracttree("f(x) = g(x)").passages[0]
+    definition2 = abstracttree("g(y) = y y").passages[0]
+    with pytest.raises(RecursiveFunction):
+        evaluate(
+            abstracttree("f(g(do))").passages[0],
+            Scope({"f": definition1, "g": definition2}),
+            0,
+            0,
+            (),
+            (),
+        )
+
+    # an argument is resolved where it's referenced: g's y, not a global y
+    source = "f(x) = g(do)\n\ng(y) = x\n\nf(y)"
+    assert [x.word.val for x in abstracttree(source).evaluate(None)[1]] == ["do"]
+    source = "y = la\n\n" + source
+    assert [x.word.val for x in abstracttree(source).evaluate(None)[1]] == ["do"]
+    source2 = "f(x) = g(do) g(re) h(mi)\n\ng(y) = x\n\nh(z) = x\n\nf(y)"
+    notes = abstracttree(source2).evaluate(None)[1]
+    assert [x.word.val for x in notes] == ["do", "re", "y"]
+    call_cache = CallCache()
+    notes = abstracttree(source + " f(mi) f(y)").evaluate(None, call_cache)[1]
+    assert [x.word.val for x in notes] == ["do", "mi", "do"]
+    assert call_cache.hits == 1
+
+    # arguments that refer to each other through the caller's scope
+    definition1 = abstracttree("f = x").passages[0]
+    definition2 = abstracttree("g(x y) = y").passages[0]
+    with pytest.raises(RecursiveFunction):
+        evaluate(
+            abstracttree("g(y f)").passages[0],
+            Scope({"f": definition1, "g": definition2}),
+            0,
+            0,
+            (),
+            (),
+        )
+
+
+def test_evaluate_nested_durations():
+    source = "{do {re mi}:3 {fa {sol la}:1}:*2}:2 * 2"
+    duration, notes = evaluate(
+        abstracttree(source).passages[0], Scope({}), 0, 0, (), ()
+    )
+    assert duration == 4.0
+    assert [(x.word.val, x.start, x.stop) for x in notes] == [
+        ("do", 0.0, 0.25),
+        ("re", 0.25, 0.625),
+        ("mi", 0.625, 1.0),
+        ("fa", 1.0, 1.5),
+        ("sol", 1.5, 1.75),
+        ("la", 1.75, 2.0),
+        ("do", 2.0, 2.25),
+        ("re", 2.25, 2.625),
+        ("mi", 2.625, 3.0),
+        ("fa", 3.0, 3.5),
+        ("sol", 3.5, 3.75),
+        ("la", 3.75, 4.0),
+    ]
+
+    source = "f(x) = x x:3\n\n{f({{do re}:*2 _}) mi}:2 ___ f(fa)"
+    collection = abstracttree(source)
+    scope = Scope({"f": collection.passages[0]})
+    passage = collection.passages[1]
+    assert evaluate(passage, scope, 0, 0, (), ())[0] == 9.0
+
+
+def test_evaluate_adjacent_notes():
+    # each note stops exactly where the next one starts, as in the baseline's
+    # arithmetic, even when the times aren't round numbers
+    for source in [
+        "{do re mi re do re mi}:3 fa",
+        "{do {re mi}:3 fa}:5 so",
+        "f(x) = {x x x}:2\n\nf(do) f(re):5 mi",
+        "{do re mi re do re mi}:3 * 3 fa",
+        "{{do re mi}:5 {fa so la ti}:7}:3 do",
+    ]:
+        notes = list(abstracttree(source).evaluate(None, CallCache())[1])
+        assert all(x.stop == y.start for x, y in zip(notes[:-1], notes[1:]))
+
+
+def test_evaluate_repetition_is_lazy():
+    source = "{{do re}*1000 mi}*1000\nfa*3 _ {so la}:*1/2 * 2"
+    duration, notes, scope = abstracttree(source).evaluate(None)
+    assert duration == 2001000.0
+    assert len(notes) == 2001000 + 7
+    assert isinstance(notes.parts[0], TiledNotes)
+    assert notes[0] == AbstractNote(0.0, 1.0, Word("do"))
+    assert notes[2002] == AbstractNote(2002.0, 2003.0, Word("re"))
+    assert notes[-1] == AbstractNote(5.5, 6.0, Word("la"))
+    assert notes[-5:-2] == [
+        AbstractNote(2.0, 3.0, Word("fa")),
+        AbstractNote(4.0, 4.5, Word("so")),
+        AbstractNote(4.5, 5.0, Word("la")),
+    ]
+
+    source = "{{do re}*3 mi}*2\nfa*3 _ {so la}:*1/2 * 2"
+    duration, notes, scope = abstracttree(source).evaluate(None)
+    assert len(notes) == 21
+    assert list(notes) == [notes[i] for i in range(21)]
+    assert list(time_ordered(notes)) == sorted(notes, key=lambda x: x.start)
+
+
+def test_evaluate_note_table():
+    source = "f(x) = x x'+\n\n{do f(re)}*3 !mi\n{{fa so+}*2 fa}:*1/2"
+    duration, notes, scope = abstracttree(source).evaluate(None)
+    assert isinstance(notes.parts[0].parts[0].block, NoteTable)
+    assert isinstance(notes.parts[0].parts[1], NoteTable)
+
+    table = NoteTable.from_notes(notes)
+    assert table == notes
+    assert list(table) == list(notes)
+    assert len(table) == 15
+    assert [x.val for x in table.interned.words] == ["do", "re", "mi", "fa", "so"]
+    assert table.interned.chains == [(), (AugmentStep(1),)]
+    assert table.chain.tolist() == [0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0, 1, 0]
+    assert table.emphasis.tolist() == [0] * 9 + [1] + [0] * 5
+    assert table.start.tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9] + [
+        0.0,
+        0.5,
+        1.0,
+        1.5,
+        2.0,
+    ]
+
+    source = "f(x) = x x\n\ndo f(re) mi"
+    duration, notes, scope = abstracttree(source).evaluate(None)
+    assert isinstance(notes, NoteTable)
+    assert [x.word.val for x in notes] == ["do", "re", "re", "mi"]
@@ -0,0 +1,77 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import os
+
+import numpy as np
+
+import doremi
+import doremi.cache
+import doremi.fluidsynth
+
+from synths import CountingSynth
+
+
+def test_render_cache(tmp_path):
+    soundfont = tmp_path / "font.sf2"
+    soundfont.write_bytes(b"not really a soundfont")
+    cache = doremi.cache.RenderCache(str(tmp_path / "cache"), max_bytes=7000)
+
+    events = doremi.compose("do re mi").midi_event_array()
+    key = cache.key(events, str(soundfont), {"sample_rate": 44100})
+    assert key == cache.key(events, str(soundfont), {"sample_rate": 44100})
+    assert key != cache.key(events, str(soundfont), {"sample_rate": 22050})
+    assert key != cache.key(events[:-1], str(soundfont), {"sample_rate": 44100})
+
+    assert cache.get(key) is None
+    array = np.arange(1000, dtype=np.int16).reshape(-1, 2)
+    cache.put(key, array)
+    cached = cache.get(key)
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, array)
+    assert cache.keys() == [key]
+
+    # a different SoundFont is a different key
+    soundfont.write_bytes(b"a different soundfont")
+    assert key != cache.key(events, str(soundfont), {"sample_rate": 44100})
+
+    # room for three entries; the least recently used one goes first
+    cache.clear()
+    for i, name in enumerate(["a", "b", "c"]):
+        cache.put(name, array)
+        os.utime(cache.path(name), ns=(i, i))
+    cache.get("a")
+    cache.put("d", array)
+    assert cache.keys() == ["a", "c", "d"]
+
+    with open(cache.path("c"), "r+b") as file:
+        file.seek(-1, 2)
+        file.write(b"!")
+    assert cache.verify(remove=False) == ["c"]
+    assert cache.verify() == ["c"]
+    assert cache.keys() == ["a", "d"]
+
+    cache.clear()
+    assert cache.keys() == []
+    assert os.listdir(cache.directory) == []
+
+
+def test_fluidsynth_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", CountingSynth)
+    monkeypatch.setattr(doremi.fluidsynth, "pool", doremi.fluidsynth.SynthPool())
+    monkeypatch.setattr(doremi.fluidsynth, "library_version", lambda: "2.2.5")
+    monkeypatch.setattr(doremi.fluidsynth, "has_library", lambda: True)
+    soundfont = tmp_path / "font.sf2"
+    soundfont.write_bytes(b"not really a soundfont")
+    cache = str(tmp_path / "cache")
+
+    composition = doremi.compose("do re mi")
+    rendered = composition.fluidsynth(soundfont=str(soundfont), cache=cache)
+    assert not isinstance(rendered, np.memmap)
+    assert rendered[:10, 0].tolist() == list(range(10))
+    cached = composition.fluidsynth(soundfont=str(soundfont), cache=cache)
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, rendered)
+
+    other = composition.fluidsynth(soundfont=str(soundfont), cache=cache, dtype="f4")
+    assert not isinstance(other, np.memmap)
+    assert len(doremi.cache.RenderCache(cache).keys()) == 2
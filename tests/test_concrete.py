@@ -2,6 +2,9 @@
 
 from fractions import Fraction
 
+import numpy as np
+import pytest
+
 import doremi
 
 
@@ -184,3 +187,160 @@ def test_emphasis():
         (0.50, [(48, 0), (48, 64)]),
         (0.75, [(48, 0)]),
     ]
+
+
+def test_midi_events():
+    # the first "do" would stop at 1.0, but the retriggered one lasts longer
+    composition = doremi.compose("do:4 re\n_ do do:3 _")
+    assert composition.midi_events() == [
+        (0.00, [(48, 127)]),
+        (0.25, [(48, 0), (48, 127)]),
+        (0.50, [(48, 0), (48, 127)]),
+        (1.00, [(50, 127)]),
+        (1.25, [(48, 0), (50, 0)]),
+    ]
+
+    events = composition.iter_midi_events()
+    assert next(events) == (0.00, [(48, 127)])
+    assert len(list(events)) == 4
+
+    with pytest.raises(ValueError):
+        doremi.compose("do re % 3/2").midi_events()
+
+    # a tuplet's last note stops exactly when the next note starts
+    composition = doremi.compose("{do re mi re do re mi}:3 fa")
+    assert composition.midi_events()[-2:] == [
+        (0.75, [(52, 0), (53, 127)]),
+        (1.0, [(53, 0)]),
+    ]
+
+
+def test_midi_event_array():
+    for source in [
+        "do !do do",
+        "do:4 re\n_ do do:3 _",
+        "{do re}:*2 do:1/3 * 3 !mi:3/2\ndo re:*2/7 * 7 do'\n_ {do. do}*4",
+    ]:
+        composition = doremi.compose(source)
+        array = composition.midi_event_array()
+        assert array.dtype == doremi.concrete.midi_event_dtype
+        assert list(
+            zip(
+                array["time"].tolist(),
+                array["pitch"].tolist(),
+                array["velocity"].tolist(),
+            )
+        ) == [(t, p, v) for t, changes in composition.midi_events() for p, v in changes]
+        assert (
+            list(doremi.fluidsynth.grouped_events(array)) == composition.midi_events()
+        )
+
+    assert len(doremi.compose("f = do").midi_event_array()) == 0
+    assert (
+        list(
+            doremi.fluidsynth.grouped_events(
+                doremi.compose("f = do").midi_event_array()
+            )
+        )
+        == []
+    )
+    with pytest.raises(ValueError):
+        doremi.compose("do re % 3/2").midi_event_array()
+
+
+def test_note_lines(monkeypatch):
+    # functions' notes belong to the line that calls them, and the first line of
+    # every passage is line 0
+    composition = doremi.compose("f = do\n_ re\n\nf mi\n{so}*3\n\nla\n_ ti")
+    assert composition.num_lines() == 2
+    assert composition.note_table().start.tolist() == [0, 1, 2, 0, 1, 2, 3, 4]
+    assert composition.note_lines().tolist() == [0, 0, 0, 1, 1, 1, 0, 1]
+
+    # the line numbers come from compose, without evaluating the lines again
+    composition = doremi.compose("f = do\nre\n\n{mi fa}*2\nf\nf f")
+    monkeypatch.setattr(doremi.abstract, "evaluate", None)
+    assert composition.note_lines().tolist() == [0, 0, 0, 0, 1, 1, 2, 2, 2, 2]
+    monkeypatch.undo()
+
+    # with channels, the same pitch in two lines doesn't retrigger
+    composition = doremi.compose("do:2\n_ do")
+    array = composition.midi_event_array(channels=True)
+    assert array.dtype == doremi.concrete.midi_channel_event_dtype
+    assert array.tolist() == [
+        (0.0, 48, 127, 0),
+        (0.25, 48, 127, 1),
+        (0.5, 48, 0, 0),
+        (0.5, 48, 0, 1),
+    ]
+    assert list(doremi.fluidsynth.grouped_events(array)) == [
+        (0.0, [(48, 127, 0)]),
+        (0.25, [(48, 127, 1)]),
+        (0.5, [(48, 0, 0), (48, 0, 1)]),
+    ]
+    assert len(composition.midi_event_array()) == 4
+
+    # with one line, it's the same as without channels
+    composition = doremi.compose("{do re}:*2 do:1/3 * 3 do:4\n\n_ do")
+    array = composition.midi_event_array(channels=True)
+    assert array["channel"].tolist() == [0] * len(array)
+    assert array[["time", "pitch", "velocity"]].tolist() == (
+        composition.midi_event_array().tolist()
+    )
+
+
+def test_all_rests():
+    for source in ["_", "_ * 2", "_ * 2\n_ * 3", "f = do\n\n{_ __}:3 * 2"]:
+        composition = doremi.compose(source)
+        assert composition.notes() == []
+        assert len(composition.note_table()) == 0
+        assert composition.note_table().start.dtype == np.dtype(np.float64)
+        assert composition.midi_events() == []
+        assert len(composition.midi_event_array()) == 0
+        assert len(composition.note_array()) == 0
+
+
+def test_call_cache_stats():
+    # only the counters outlive compose, not the memoized notes
+    composition = doremi.compose("f(x) = x x'\n\nf(do) f(re) f(do)\nf(do)")
+    assert composition.call_cache.results == {}
+    assert (composition.call_cache.hits, composition.call_cache.misses) == (2, 2)
+    assert composition.note_lines().tolist() == [0] * 6 + [1] * 2
+    assert composition.call_cache.results == {}
+
+
+def test_note_array():
+    composition = doremi.compose("{do re % 3/2 mi>}*3 !fa'\n{so,, _ !!la+}:*1/2 * 2")
+    notes = composition.notes()
+    array = composition.note_array()
+    assert len(array) == len(notes) == 14
+    assert array["pitch"].tolist() == [
+        x.note.pitch if isinstance(x.note, doremi.concrete.MIDINote) else -1
+        for x in notes
+    ]
+    assert array["frequency"].tolist() == [x.note.frequency for x in notes]
+    assert array["start"].tolist() == [x.start for x in notes]
+    assert array["stop"].tolist() == [x.stop for x in notes]
+    assert array["emphasis"].tolist() == [x.emphasis for x in notes]
+    assert array["pitch"][1] == -1
+    assert array["velocity"].tolist()[-3:] == [127, 43, 127]
+
+    assert list(composition.timed_notes(composition.abstract_notes)) == notes
+    assert len(doremi.compose("f = do").note_array()) == 0
+
+
+def test_scale_index():
+    scale = doremi.concrete.named_scale("D dorian")
+    assert scale.degrees == list(scale.notes.values())
+    assert scale["3rd"] is scale["me"] is scale.degrees[2]
+    assert scale["7th"] is scale["te"]
+    assert scale["mi"] is scale.accidentals["mi"]
+    assert scale.degree(doremi.concrete.MIDINote(53 + 24)) == 2
+    assert scale.degree(doremi.concrete.MIDINote(54)) is None
+
+    with pytest.raises(KeyError):
+        scale["8th"]
+    with pytest.raises(doremi.abstract.UndefinedSymbol):
+        doremi.compose("8th", "D dorian").notes()
+
+    notes = doremi.compose("me>> {so la}<", "D dorian").notes()
+    assert [x.note.pitch for x in notes] == [57, 55, 57]
@@ -0,0 +1,612 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import io
+import multiprocessing
+import os
+import subprocess
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+import doremi.fluidsynth
+
+from synths import CountingSynth, FakeSynth, StateSynth
+
+
+def has_fluidsynth():
+    try:
+        doremi.fluidsynth.get_library()
+    except ImportError:
+        return False
+    return os.path.exists(doremi.fluidsynth.default_soundfont())
+
+
+class LimitedLibrary:
+    # only as much of libfluidsynth as Fluidsynth needs before making a synth,
+    # with its limit on audio channels and groups
+    def __init__(self):
+        self.deleted = []
+
+    def new_fluid_settings(self):
+        return "settings"
+
+    def fluid_settings_setnum(self, settings, name, value):
+        return 0
+
+    def fluid_settings_setint(self, settings, name, value):
+        if name.startswith(b"synth.audio-") or name == b"synth.effects-groups":
+            return 0 if 1 <= value <= 128 else -1
+        return 0
+
+    def delete_fluid_settings(self, settings):
+        self.deleted.append(settings)
+
+
+def test_too_many_stems(monkeypatch):
+    library = LimitedLibrary()
+    monkeypatch.setattr(doremi.fluidsynth, "get_library", lambda: library)
+    with pytest.raises(ValueError, match="200 stems"):
+        doremi.fluidsynth.Fluidsynth("a.sf2", stems=200)
+    assert library.deleted == ["settings"]
+
+
+def test_pool(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", FakeSynth)
+    FakeSynth.made = []
+    pool = doremi.fluidsynth.SynthPool(max_idle=2)
+
+    with pool.synth("a.sf2") as first:
+        with pool.synth("a.sf2") as second:
+            assert first is not second
+    assert len(pool.idle) == 2
+    assert first.resets == second.resets == 1
+
+    with pool.synth("a.sf2") as again:
+        assert again is first
+    with pool.synth("a.sf2", 22050) as other:
+        assert other not in (first, second)
+    with pool.synth("a.sf2", dtype="f4") as other_dtype:
+        pass
+
+    # the least recently used synths were evicted
+    assert [x.deleted for x in FakeSynth.made] == [True, True, False, False]
+    assert [x for _, x in pool.idle] == [other, other_dtype]
+
+    pool.clear()
+    assert pool.idle == []
+    assert all(x.deleted for x in FakeSynth.made)
+
+
+def test_quality(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", FakeSynth)
+    FakeSynth.made = []
+    pool = doremi.fluidsynth.SynthPool()
+
+    with pool.synth("a.sf2", quality="draft") as draft:
+        assert draft.sample_rate == 22050
+        assert not draft.quality.reverb and not draft.quality.chorus
+    with pool.synth("a.sf2") as standard:
+        assert standard is not draft
+        assert standard.sample_rate == 44100
+    with pool.synth("a.sf2", 44100, quality="draft") as other:
+        assert other not in (draft, standard)
+    with pool.synth("a.sf2", quality="draft") as again:
+        assert again is draft
+
+    with pool.synth("a.sf2", quality="draft", cpu_cores=1) as one_core:
+        assert one_core.cpu_cores == 1
+    with pool.synth("a.sf2", quality="draft") as all_cores:
+        assert all_cores.cpu_cores == doremi.fluidsynth.available_cores()
+        if all_cores.cpu_cores != 1:
+            assert all_cores is not one_core
+
+    custom = doremi.fluidsynth.Quality(16000, False, True, 1, 64)
+    assert doremi.fluidsynth.get_quality(custom) is custom
+    with pytest.raises(ValueError):
+        doremi.fluidsynth.get_quality("best")
+
+
+def test_grouped_events():
+    array = doremi.compose("do:2 do\n_ re").midi_event_array()
+    assert list(doremi.fluidsynth.grouped_events(array)) == [
+        (0.0, [(48, 127)]),
+        (0.25, [(50, 127)]),
+        (0.5, [(48, 0), (50, 0), (48, 127)]),
+        (0.75, [(48, 0)]),
+    ]
+
+
+def test_render_blocks():
+    events = doremi.compose("{do re:1/3 mi:*2/7}*5 _\n!so,:3").midi_event_array()
+    expected = CountingSynth()
+    array = expected.midi_synthesize(events)
+    assert array[:, 0].tolist() == list(range(len(array)))
+    grouped = doremi.fluidsynth.grouped_events(events)
+    assert np.array_equal(CountingSynth().midi_synthesize(grouped), array)
+
+    for block_size in [1, 7, 64, 4096, 100000]:
+        synth = CountingSynth()
+        blocks = [x.copy() for x in synth.render_blocks(events, block_size)]
+        assert all(len(x) == block_size for x in blocks[:-1])
+        assert 0 < len(blocks[-1]) <= block_size
+        assert np.array_equal(np.concatenate(blocks), array)
+        assert synth.sent == expected.sent
+
+    blocks = list(CountingSynth().render_blocks(events, 64))
+    assert all(np.shares_memory(x, blocks[0]) for x in blocks)
+    assert list(CountingSynth().render_blocks(events[:0])) == []
+
+
+def test_grid():
+    events = doremi.compose("{do re:1/3 mi:*2/7}*5 _\n!so,:3").midi_event_array()
+    exact = CountingSynth()
+    exact.midi_synthesize(events)
+    assert any(position % 64 != 0 for position, _ in exact.sent)
+
+    synth = CountingSynth()
+    array = synth.midi_synthesize(events, grid=64)
+    assert array[:, 0].tolist() == list(range(len(array)))
+    assert len(array) % 64 == 0
+    assert [x for _, x in synth.sent] == [x for _, x in exact.sent]
+    assert all(position % 64 == 0 for position, _ in synth.sent)
+
+    # the same as when the events come one at a time, with no length known
+    grouped = doremi.fluidsynth.grouped_events(events)
+    assert np.array_equal(CountingSynth().midi_synthesize(grouped, grid=64), array)
+
+    moved = [abs(x - y) for (x, _), (y, _) in zip(synth.sent, exact.sent)]
+    assert max(moved) <= 32
+    error = doremi.fluidsynth.timing_error(events, 44100, 64)
+    assert (max(moved) - 1) / 44100 <= error <= 33 / 44100
+    assert doremi.fluidsynth.timing_error(events, 44100, None) < 1 / 44100
+    assert doremi.fluidsynth.timing_error(events[:0], 44100, 64) == 0.0
+
+    into = np.zeros((len(array) + 100, 2), np.float32)
+    CountingSynth().synthesize_into(events, into, grid=64)
+    assert np.array_equal(into[:, 0], np.arange(len(into)))
+
+
+@pytest.mark.skipif(not has_fluidsynth(), reason="needs libfluidsynth and a soundfont")
+def test_render_blocks_memory():
+    # 15 minutes of audio would be 160 MB as one array
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            """
+import resource
+import doremi
+composition = doremi.compose("{do re mi fa so la ti do'}*450")
+blocks = composition.render_blocks()
+next(blocks)
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+num_samples = sum(len(x) for x in blocks)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(num_samples, (after - before) * 1024)
+""",
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    num_samples, growth = map(int, result.stdout.split())
+    assert num_samples > 44100 * 60 * 14
+    assert growth < 16 * 1024**2
+
+
+def test_composition_render_blocks(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", CountingSynth)
+    monkeypatch.setattr(doremi.fluidsynth, "pool", doremi.fluidsynth.SynthPool())
+    composition = doremi.compose("{do re:1/3 mi:*2/7}*5 _\n!so,:3")
+    time = composition.midi_events()[-1][0]
+
+    blocks = [x.copy() for x in composition.render_blocks(block_size=1000)]
+    assert sum(len(x) for x in blocks) == int(44100 * time)
+
+    blocks = list(composition.render_blocks(quality="draft", cpu_cores=2))
+    assert sum(len(x) for x in blocks) == int(22050 * time)
+    _, synth = doremi.fluidsynth.pool.idle[-1]
+    assert synth.sample_rate == 22050 and synth.cpu_cores == 2
+
+
+def test_render_to_wav(monkeypatch, tmp_path):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", CountingSynth)
+    monkeypatch.setattr(doremi.fluidsynth, "pool", doremi.fluidsynth.SynthPool())
+    composition = doremi.compose("{do re:1/3 mi:*2/7}*5 _\n!so,:3")
+    expected = CountingSynth(dtype="i2").midi_synthesize(composition.midi_event_array())
+
+    composition.render_to_wav(tmp_path / "out.wav", sample_rate=8000)
+    composition.render_to_wav(str(tmp_path / "out2.wav"))
+    stream = io.BytesIO()
+    composition.render_to_wav(stream, block_size=1000)
+
+    with wave.open(str(tmp_path / "out2.wav"), "rb") as file:
+        assert file.getnchannels() == 2
+        assert file.getsampwidth() == 2
+        assert file.getframerate() == 44100
+        assert file.getnframes() == len(expected)
+        frames = np.frombuffer(file.readframes(len(expected)), "<i2")
+    assert np.array_equal(frames.reshape(-1, 2), expected)
+    assert (tmp_path / "out2.wav").read_bytes() == stream.getvalue()
+
+    with wave.open(str(tmp_path / "out.wav"), "rb") as file:
+        assert file.getframerate() == 8000
+        assert file.getnframes() == int(8000 * composition.midi_events()[-1][0])
+
+    composition.render_to_wav(tmp_path / "draft.wav", quality="draft", cpu_cores=2)
+    with wave.open(str(tmp_path / "draft.wav"), "rb") as file:
+        assert file.getframerate() == 22050
+        assert file.getnframes() == int(22050 * composition.midi_events()[-1][0])
+    _, synth = doremi.fluidsynth.pool.idle[-1]
+    assert synth.cpu_cores == 2
+
+    composition.render_to_wav(tmp_path / "float.wav", dtype="f4")
+    data = (tmp_path / "float.wav").read_bytes()
+    assert data[20:22] == b"\x03\x00"  # WAVE_FORMAT_IEEE_FLOAT
+    assert len(data) == 58 + expected.size * 4
+
+    doremi.compose("f = do").render_to_wav(tmp_path / "empty.wav")
+    with wave.open(str(tmp_path / "empty.wav"), "rb") as file:
+        assert file.getnframes() == 0
+
+
+def test_segments():
+    # the rests are the quiet places to split
+    composition = doremi.compose("{do re mi fa _}*4 so:4\n{do,:3 __}*4 _:4")
+    events = composition.midi_event_array()
+    num_samples = int(44100 * events["time"][-1])
+    parts = doremi.fluidsynth.segments(events, 44100, 4, 1000)
+
+    assert len(parts) == 4
+    assert parts[0].start == 0 and parts[-1].stop == num_samples
+    assert all(x.stop == y.start for x, y in zip(parts[:-1], parts[1:]))
+    assert [x.tail for x in parts] == [1000, 1000, 1000, 0]
+    assert all(x.sounding == [] for x in parts)
+    assert parts[-1].last == len(events)
+
+    # with no rests, notes have to be turned back on
+    composition = doremi.compose("{do re mi fa}*8\nso,:32")
+    events = composition.midi_event_array()
+    parts = doremi.fluidsynth.segments(events, 44100, 3, 1000)
+    assert len(parts) == 3
+    for part in parts:
+        state = {}
+        for pitch, velocity in events[["pitch", "velocity"]][: part.first].tolist():
+            state[pitch] = velocity
+        assert part.sounding == sorted((p, v) for p, v in state.items() if v != 0)
+        assert (43, 127) in part.sounding or part.start == 0
+        index = (44100 * events["time"][part.first : part.last]).astype(int)
+        assert np.all(part.start <= index)
+        assert np.all(index < part.stop + part.tail) or part is parts[-1]
+
+    assert doremi.fluidsynth.segments(events[:0], 44100, 4, 1000) == []
+
+
+class LevelSynth(CountingSynth):
+    def write(self, section):
+        section[:] = 1000
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="the fake synth only reaches worker processes through fork",
+)
+def test_parallel_synthesize(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", LevelSynth)
+    events = doremi.compose("{do re mi fa}*4\nso,:32").midi_event_array()
+    array = doremi.fluidsynth.parallel_synthesize(events, 3)
+    assert array.shape == (int(44100 * events["time"][-1]), 2)
+    assert np.all(array == 1000)
+
+
+def test_parallel_needs_python38(monkeypatch):
+    events = doremi.compose("do re mi").midi_event_array()
+    monkeypatch.setattr(sys, "version_info", (3, 7, 16, "final", 0))
+    with pytest.raises(NotImplementedError, match="3.8"):
+        doremi.fluidsynth.parallel_synthesize(events, 2)
+
+
+class CoresSynth(CountingSynth):
+    def write(self, section):
+        section[:] = self.cpu_cores
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork",
+    reason="the fake synth only reaches worker processes through fork",
+)
+def test_parallel_cpu_cores(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", CoresSynth)
+    events = doremi.compose("{do re mi fa}*4\nso,:32").midi_event_array()
+    array = doremi.fluidsynth.parallel_synthesize(events, 3, cpu_cores=2)
+    assert np.all(array == 2)
+
+    # by default, the processes divide the cores among themselves
+    parts = doremi.fluidsynth.segments(events, 44100, 3, 4410)
+    array = doremi.fluidsynth.parallel_synthesize(events, 3)
+    cores = max(doremi.fluidsynth.available_cores() // len(parts), 1)
+    assert np.all(array == cores)
+
+
+def test_worker_cpu_cores():
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        future = executor.submit(doremi.fluidsynth.default_cpu_cores)
+        assert future.result() == 1
+    cores = doremi.fluidsynth.default_cpu_cores()
+    assert cores == doremi.fluidsynth.available_cores()
+
+
+@pytest.mark.skipif(not has_fluidsynth(), reason="needs libfluidsynth and a soundfont")
+def test_parallel_synthesize_audio():
+    composition = doremi.compose("{do re mi fa so la ti do'}*8 _\n{do,. so,,.}*32 _")
+    serial = composition.fluidsynth(dtype="f4")
+    parallel = composition.fluidsynth(dtype="f4", processes=4)
+    assert serial.shape == parallel.shape
+    difference = np.sqrt(np.mean((serial - parallel) ** 2))
+    assert difference < 0.05 * np.sqrt(np.mean(serial**2))
+
+
+@pytest.mark.skipif(not has_fluidsynth(), reason="needs libfluidsynth and a soundfont")
+def test_sequence_synthesize():
+    composition = doremi.compose("{do re:1/3 mi:*2/7}*5 _\n!so,:3 {do re}:1/4 * 8")
+    looped = composition.fluidsynth(dtype="f4")
+    sequenced = composition.fluidsynth(dtype="f4", sequencer=True)
+    assert looped.shape == sequenced.shape
+    difference = np.sqrt(np.mean((looped - sequenced) ** 2))
+    assert difference < 0.1 * np.sqrt(np.mean(looped**2))
+
+
+def test_render_session(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", StateSynth)
+    monkeypatch.setattr(doremi.fluidsynth, "pool", doremi.fluidsynth.SynthPool())
+    session = doremi.fluidsynth.RenderSession(
+        release_in_seconds=0.1, overlap_in_seconds=0.01
+    )
+
+    def full(events):
+        return StateSynth(dtype="i2").midi_synthesize(events)
+
+    # windows start 0.01 s before the first change and end 0.01 s after the
+    # release of the last one; if the ending changes, they go to the end
+    for source, window in [
+        ("do re mi fa so la ti do'\nso,:16", (0, 176400)),
+        ("do re mi fa fa la ti do'\nso,:16", (43659, 59976)),
+        ("do re mi fa fa la ti do'\nso,:16", None),
+        ("do re mi fa fa:2 ti do'\nso,:16", (54684, 71001)),
+        ("do re mi fa fa:2 ti do'\nso,:16 _ re", (175959, 198450)),
+        ("do re mi fa fa\nso,:16 _ re", (54684, 93051)),
+        ("do,:4 re mi fa fa\nso,:16", (0, 176400)),
+        ("f = do", (0, 0)),
+    ]:
+        events = doremi.compose(source).midi_event_array()
+        audio = session.update(events)
+        assert session.window == window, source
+        assert np.array_equal(audio, full(events)), source
+
+
+def test_skip_silence():
+    # four seconds of rest between the notes, with reverb and chorus off
+    events = doremi.compose("do _:16 re").midi_event_array()
+    dry = doremi.fluidsynth.Quality(44100, False, False, 4, 256)
+
+    unskipped = StateSynth(dtype="i2", quality=dry)
+    unskipped.check_size = 10**9
+    expected = unskipped.midi_synthesize(events)
+    assert unskipped.written == len(expected) == 198450
+
+    # only the first check_size samples of the rest are synthesized
+    synth = StateSynth(dtype="i2", quality=dry)
+    synth.check_size = 1000
+    assert np.array_equal(synth.midi_synthesize(events), expected)
+    assert synth.written == 11025 + 1000 + 11025
+
+    # and of the two seconds after the last note
+    synth = StateSynth(dtype="i2", quality=dry)
+    synth.check_size = 1000
+    array = np.full((len(expected) + 88200, 2), 99, np.int16)
+    synth.synthesize_into(events, array)
+    assert np.array_equal(array[: len(expected)], expected)
+    assert np.all(array[len(expected) :] == 0)
+    assert synth.written == 11025 + 1000 + 11025 + 1000
+
+    # an array that's already zeros isn't written after the silence is found
+    synth = StateSynth(dtype="i2", quality=dry)
+    synth.check_size = 1000
+    array = np.full((len(expected) + 88200, 2), 99, np.int16)
+    synth.synthesize_into(events, array, zeroed=True)
+    assert np.all(array[11025 + 1000 : 11025 * 2] == 99)
+    assert np.all(array[len(expected) + 1000 :] == 99)
+    array[array == 99] = 0
+    assert np.array_equal(array[: len(expected)], expected)
+
+    synth = StateSynth(dtype="i2", quality=dry)
+    blocks = [x.copy() for x in synth.render_blocks(events, 1000)]
+    assert np.array_equal(np.concatenate(blocks), expected)
+    assert synth.written == 11025 + 975 + 11025
+
+
+class ReverbSynth(StateSynth):
+    # a reverb tail that decays while samples are written, too quiet to show in
+    # the int16 output on its own, but added to the notes that come after it
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tail = 0.0
+
+    def write(self, section):
+        tail = self.tail * 0.9999 ** np.arange(1, len(section) + 1)
+        loudness = 100 if len(self.on) != 0 else 1
+        section[:] = (sum(self.on) + loudness * tail)[:, None]
+        self.tail = float(tail[-1]) if len(section) != 0 else self.tail
+        self.written += len(section)
+
+    def send(self, changes):
+        super().send(changes)
+        if self.quality.reverb:
+            self.tail += 0.9
+
+
+def test_skip_silence_with_effects():
+    events = doremi.compose("do _:16 re").midi_event_array()
+    unskipped = ReverbSynth(dtype="i2")
+    unskipped.check_size = 10**9
+    expected = unskipped.midi_synthesize(events)
+
+    # with reverb on, nothing is skipped and the output is the same
+    synth = ReverbSynth(dtype="i2")
+    synth.check_size = 1000
+    assert np.array_equal(synth.midi_synthesize(events), expected)
+    assert synth.written == len(expected)
+    synth = ReverbSynth(dtype="i2")
+    blocks = [x.copy() for x in synth.render_blocks(events, 1000)]
+    assert np.array_equal(np.concatenate(blocks), expected)
+
+    # skipping the silence anyway would have changed the notes after it
+    class SkippingSynth(ReverbSynth):
+        def silent_after(self, part):
+            return not np.any(part) and self.active_voices() == 0
+
+    synth = SkippingSynth(dtype="i2")
+    synth.check_size = 1000
+    assert not np.array_equal(synth.midi_synthesize(events), expected)
+
+
+class StemSynth(CountingSynth):
+    # every sample of a stem is the sum of the pitches that are on in its channel
+    # (in units of the smallest int16 step)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on = [set() for _ in range(self.stems)]
+
+    def send_channels(self, changes):
+        for pitch, velocity, channel in changes:
+            if velocity == 0:
+                self.on[channel].discard(pitch)
+            else:
+                self.on[channel].add(pitch)
+
+    def process(self, section):
+        for k in range(self.stems):
+            section[k] += sum(self.on[k]) / 32768
+
+
+def test_stems(monkeypatch):
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", StemSynth)
+    monkeypatch.setattr(doremi.fluidsynth, "pool", doremi.fluidsynth.SynthPool())
+
+    # the same pitch in two lines is two notes, not a retrigger
+    composition = doremi.compose("f = do mi\n\nf so:2\ndo:4\n\nla\n_ ti\n_ _ re")
+    stems, mix = composition.stems()
+    assert stems.shape == (3, 77175, 2)
+    assert stems.dtype == mix.dtype == np.dtype(np.int16)
+    assert np.array_equal(stems.sum(axis=0), mix)
+
+    def line(values):
+        return np.repeat(np.array(values, np.int16), 11025)[:, None] * [1, 1]
+
+    assert np.array_equal(stems[0], line([48, 52, 55, 55, 57, 0, 0]))
+    assert np.array_equal(stems[1], line([48, 48, 48, 48, 0, 59, 0]))
+    assert np.array_equal(stems[2], line([0, 0, 0, 0, 0, 0, 50]))
+
+    stems, mix = doremi.compose("la\n_ ti\n_ _ re").stems(dtype="f4")
+    assert stems.dtype == mix.dtype == np.dtype(np.float32)
+    assert np.array_equal(stems[1] * 32768, line([0, 59, 0]))
+    assert np.array_equal(mix * 32768, line([57, 59, 50]))
+
+
+@pytest.mark.skipif(not has_fluidsynth(), reason="needs libfluidsynth and a soundfont")
+def test_stems_audio():
+    composition = doremi.compose("{do re mi fa}*4 _\n{so, la,}*8 _\n_:8 ti:8 _")
+    stems, mix = composition.stems(dtype="f4")
+    assert stems.shape == (3,) + mix.shape
+    assert all(np.any(x != 0) for x in stems)
+    assert np.allclose(stems.sum(axis=0), mix, atol=1e-6)
+
+    # the lines don't play the same pitches, so the mix is the usual render
+    serial = composition.fluidsynth(dtype="f4")
+    assert serial.shape == mix.shape
+    difference = np.sqrt(np.mean((serial - mix) ** 2))
+    assert difference < 0.05 * np.sqrt(np.mean(serial**2))
+
+
+class ReleaseSynth(CountingSynth):
+    # each note is twice its pitch while it's held and its pitch for 3000 samples
+    # after, so that voices add up and the audio doesn't depend on when it starts
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset()
+        self.written = 0
+
+    def write(self, section):
+        values = np.full(len(section), 2 * sum(self.held))
+        for voice in self.releasing:
+            length = min(voice[1], len(section))
+            values[:length] += voice[0]
+            voice[1] -= length
+        self.releasing = [x for x in self.releasing if x[1] != 0]
+        section[:] = values[:, None]
+        self.written += len(section)
+
+    def send(self, changes):
+        for pitch, velocity in changes:
+            if velocity == 0:
+                self.held.remove(pitch)
+                self.releasing.append([pitch, 3000])
+            else:
+                self.held.append(pitch)
+
+    def active_voices(self):
+        return len(self.held) + len(self.releasing)
+
+    def reset(self):
+        self.held = []
+        self.releasing = []
+
+
+def test_phrase_synthesize(monkeypatch):
+    source = "{do re mi !fa}*20 _ {do re mi fa}*2\n{so,:4}*20 _ {do:4}*2"
+    events = doremi.compose(source).midi_event_array()
+    phrases = doremi.fluidsynth.phrases(events, 44100)
+    assert len(phrases) == 24
+    assert len({key for _, _, key in phrases}) == 3
+
+    straight = ReleaseSynth(dtype="i2")
+    expected = straight.midi_synthesize(events)
+    synth = ReleaseSynth(dtype="i2")
+    assert np.array_equal(synth.phrase_synthesize(events), expected)
+    assert synth.written < straight.written / 5
+
+    # a note held across the ends of repetitions keeps them in one phrase
+    events = doremi.compose("{do re mi fa}*8\n_ so,:31").midi_event_array()
+    assert [x[:2] for x in doremi.fluidsynth.phrases(events, 44100)] == [
+        (0, 2),
+        (2, 66),
+    ]
+    assert np.array_equal(
+        ReleaseSynth(dtype="i2").phrase_synthesize(events),
+        ReleaseSynth(dtype="i2").midi_synthesize(events),
+    )
+
+    monkeypatch.setattr(doremi.fluidsynth, "Fluidsynth", ReleaseSynth)
+    monkeypatch.setattr(doremi.fluidsynth, "pool", doremi.fluidsynth.SynthPool())
+    monkeypatch.setattr(doremi.fluidsynth, "has_library", lambda: True)
+    composition = doremi.compose(source)
+    assert np.array_equal(
+        composition.fluidsynth(dtype="f4", memoize=True),
+        composition.fluidsynth(dtype="f4"),
+    )
+    with pytest.raises(ValueError):
+        composition.fluidsynth(memoize=True, grid=64)
+
+
+@pytest.mark.skipif(not has_fluidsynth(), reason="needs libfluidsynth and a soundfont")
+def test_phrase_synthesize_audio():
+    composition = doremi.compose("{do re mi fa so:4}*8\n{do,:8}*8")
+    straight = composition.fluidsynth(dtype="f4", quality="draft")
+    memoized = composition.fluidsynth(dtype="f4", quality="draft", memoize=True)
+    assert straight.shape == memoized.shape
+    difference = np.sqrt(np.mean((straight - memoized) ** 2))
+    assert difference < 0.01 * np.sqrt(np.mean(straight**2))
@@ -0,0 +1,58 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import subprocess
+import sys
+
+
+# "import doremi" takes about 20 ms; before submodules were deferred it was
+# over 500 ms, so this budget catches a regression without being flaky
+import_budget_in_seconds = 0.1
+
+
+def run(code):
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+
+def cumulative_import_time(stderr, module):
+    for line in stderr.splitlines():
+        if line.startswith("import time:"):
+            _, cumulative, name = line[len("import time:") :].split("|")
+            if name.strip() == module:
+                return int(cumulative) * 1e-6
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+def test_import_time():
+    result = run("import doremi")
+    assert cumulative_import_time(result.stderr, "doremi") < import_budget_in_seconds
+
+
+def test_import_is_lazy():
+    result = run(
+        """
+import sys
+import doremi
+print(" ".join(x for x in ("lark", "numpy", "pkg_resources", "doremi.parsing")
+               if x in sys.modules))
+"""
+    )
+    assert result.stdout.strip() == ""
+
+    result = run(
+        """
+import sys
+import doremi.concrete
+import doremi.fluidsynth
+print(doremi.concrete.scale_data.cache is None)
+print(len(doremi.parsing.get_parser.cache))
+print(doremi.fluidsynth.get_library.library is None)
+print("pkg_resources" in sys.modules)
+"""
+    )
+    assert result.stdout.split() == ["True", "0", "True", "False"]
@@ -0,0 +1,105 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import numpy as np
+import pytest
+
+import doremi
+import doremi.fluidsynth
+import doremi.numpysynth
+
+
+def peak_frequency(audio, sample_rate):
+    spectrum = np.abs(np.fft.rfft(audio[:, 0] * np.hanning(len(audio))))
+    return np.argmax(spectrum) * sample_rate / len(audio)
+
+
+def test_numpy_synth():
+    synth = doremi.numpysynth.NumpySynth(dtype="f4", voice="sine")
+    notes = np.zeros(1, doremi.concrete.note_array_dtype)
+    notes[0] = (69, 440.0, 0.5, 1.5, 1.0, 127)
+    audio = synth.synthesize(notes)
+    assert audio.shape == (66150, 2)
+    assert np.array_equal(audio[:, 0], audio[:, 1])
+    assert np.all(audio[:22050] == 0)
+    assert peak_frequency(audio[22050:], 44100) == pytest.approx(440.0, abs=1.0)
+    assert np.max(np.abs(audio)) == pytest.approx(0.2, rel=0.01)
+
+    # the same notes from any of the representations of a composition
+    composition = doremi.compose("do re mi fa so la ti do'\nso,:16")
+    synth = doremi.numpysynth.NumpySynth(dtype="f4")
+    audio = synth.synthesize(composition.note_array())
+    assert np.array_equal(synth.midi_synthesize(composition.midi_event_array()), audio)
+    assert np.array_equal(synth.midi_synthesize(composition.midi_events()), audio)
+    assert audio.shape == (176400, 2)
+
+    # blocks only bound the memory used at a time
+    for block_size in [100, 1000, 1000000]:
+        other = doremi.numpysynth.NumpySynth(dtype="f4", block_size=block_size)
+        assert np.array_equal(other.synthesize(composition.note_array()), audio)
+
+    wavetable = doremi.numpysynth.NumpySynth(dtype="f4", method="wavetable")
+    assert np.allclose(wavetable.synthesize(composition.note_array()), audio, atol=1e-5)
+
+    int16 = doremi.numpysynth.NumpySynth().synthesize(composition.note_array())
+    assert int16.dtype == np.dtype(np.int16)
+    assert np.allclose(int16, audio * 32767, atol=1)
+
+    assert synth.synthesize(doremi.compose("f = do").note_array()).shape == (0, 2)
+    with pytest.raises(ValueError):
+        doremi.numpysynth.NumpySynth(voice="kazoo")
+
+
+def test_real_notes():
+    # a fifth by ratio and a just-intonation scale, neither of which is MIDI
+    composition = doremi.compose("do:4 do%3/2:4")
+    with pytest.raises(ValueError):
+        composition.midi_event_array()
+    audio = composition.fluidsynth(dtype="f4")
+    assert audio.shape == (88200, 2)
+    first = peak_frequency(audio[:44100], 44100)
+    second = peak_frequency(audio[44100:], 44100)
+    assert second / first == pytest.approx(1.5, rel=0.01)
+    with pytest.raises(ValueError, match="soundfont"):
+        composition.fluidsynth(soundfont="font.sf2")
+
+    composition = doremi.compose("do:4 so:4", scale={"do": 264.0, "so": 396.0})
+    audio = composition.numpy_synthesize(dtype="f4", voice="sine")
+    assert peak_frequency(audio[:44100], 44100) == pytest.approx(264.0, abs=1.0)
+    assert peak_frequency(audio[44100:], 44100) == pytest.approx(396.0, abs=1.0)
+
+
+def test_backend(monkeypatch, tmp_path):
+    composition = doremi.compose("do re mi")
+    expected = composition.numpy_synthesize()
+    assert np.array_equal(composition.fluidsynth(backend="numpy"), expected)
+    with pytest.raises(ValueError):
+        composition.fluidsynth(backend="csound")
+
+    # without libfluidsynth, the default backend is NumPy
+    def missing():
+        raise ImportError("could not find the fluidsynth library")
+
+    monkeypatch.setattr(doremi.fluidsynth, "get_library", missing)
+    assert not doremi.fluidsynth.has_library()
+    assert np.array_equal(composition.fluidsynth(), expected)
+    # quality sets the NumPy synth's sample_rate, so it isn't FluidSynth-only
+    assert len(composition.fluidsynth(quality="draft")) == 16537
+    assert len(composition.fluidsynth(backend="numpy", quality="draft")) == 16537
+
+    # but not if that would ignore arguments that only FluidSynth uses
+    for kwargs in [
+        {"soundfont": "font.sf2"},
+        {"processes": 2},
+        {"sequencer": True},
+        {"cpu_cores": 2},
+        {"grid": 64},
+        {"memoize": True},
+    ]:
+        with pytest.raises(ValueError, match=list(kwargs)[0]):
+            composition.fluidsynth(**kwargs)
+
+    cache = str(tmp_path / "cache")
+    assert not isinstance(composition.fluidsynth(cache=cache), np.memmap)
+    cached = composition.fluidsynth(cache=cache)
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, expected)
@@ -0,0 +1,200 @@
+# BSD 3-Clause License; see https://github.com/jpivarski/doremi/blob/main/LICENSE
+
+import random
+import re
+
+import lark
+import pytest
+
+from doremi.parsing import parsingtree
+from doremi.abstract import (
+    abstracttree,
+    get_comments,
+    to_ast,
+    DoremiError,
+    ParsingError,
+)
+
+
+sources = [
+    "do",
+    "do re mi",
+    "do\n",
+    "do | one",
+    "do | one\nla",
+    "\n\ndo\n\n",
+    "do\n| one\n| two",
+    "do\n  \nla",
+    "do\n\n\nla\n\n",
+    "la' la'' la'3 la, la,, la,3 la'0",
+    "la+ la++ la+3 la- la-- la-3",
+    "la> la>> la>3 la< la<< la<3",
+    "la%3/2 la % 2",
+    "la. la.. la:3 la:3/2 la:*3/2 la * 4",
+    "!la !!@la @@la",
+    "1st 2nd 3rd 4th 12th",
+    "do'3rd do''3rd mi,05:3/2",
+    "{la la la}'+:*3/2 * 4",
+    "f(x y) = y x\n\ndo f({mi mi} {re re}) fa",
+    "f = do do\nmi mi\n\ng(x) = f x\n\ng(la)",
+    "f =\n do re\n\nf f",
+    "f() = do\n\nf() f",
+    "f(x)=x\nf(la)",
+]
+
+
+def random_source(rng):
+    pieces = (
+        ["do", "re", "mi", "f", "x", "3rd", "12th", "_", "__", "0", "5"]
+        + ["'", "''", "'2", ",", ",,", ",3", "+", "++", "+2", "-", "--", "-1"]
+        + [">", ">>", ">3", "<", "<2", ".", "..", ":3", ":3/2", ":*2", "*2"]
+        + ["%3/2", "!", "@", "{", "}", "(", ")", "=", "f(", "f(x y) =", "g ="]
+        + ["\n", "\n\n", "|c\n", "| c", " "]
+    )
+    return "".join(
+        rng.choice(pieces) + rng.choice(["", " "]) for _ in range(rng.randint(1, 12))
+    )
+
+
+def outcome(source, parser):
+    try:
+        collection = abstracttree(source, parser)
+    except DoremiError as err:
+        return type(err)
+    return collection.passages, [str(x) for x in collection.comments]
+
+
+@pytest.mark.parametrize("source", sources)
+def test_lalr_matches_earley(source):
+    assert parsingtree(source, "lalr") == parsingtree(source, "earley")
+    assert abstracttree(source, "lalr") == abstracttree(source, "earley")
+    assert outcome(source, "lalr") == outcome(source, "earley")
+
+
+def test_lalr_matches_earley_random():
+    rng = random.Random(12345)
+    for _ in range(500):
+        source = random_source(rng)
+        assert outcome(source, "lalr") == outcome(source, "earley"), source
+
+
+def test_unknown_parser():
+    with pytest.raises(ValueError):
+        parsingtree("do", "cyk")
+
+
+def test_function_name_is_str():
+    for parser in ["lalr", "earley"]:
+        passage = abstracttree("f(x) = x\n\nf(la)", parser).passages[0]
+        assert type(passage.assignment.function.val.value) is str
+
+
+# the Earley grammar before the LALR rewrite, to check that the language didn't
+# change along with the grammar
+original_grammar = r"""
+start: BLANK* assign_passage (BLANK BLANK+ assign_passage)* BLANK_END*
+
+assign_passage: assign "=" BLANK? passage | passage
+assign: WORD | WORD "(" defargs? ")"
+defargs: WORD+
+passage: line (BLANK line)*
+
+line: modified+
+modified: emphasis? absolute? expression octave? augmentation? duration? repetition?
+
+emphasis: EMPHASIS+
+absolute: ABSOLUTE+
+octave: upward_octave | downward_octave
+upward_octave: OCTAVE_UP INT | OCTAVE_UPS
+downward_octave: OCTAVE_DOWN INT | OCTAVE_DOWNS
+
+augmentation: upward_step | downward_step | upward_degree | downward_degree | ratio_tune
+upward_step: STEP_UPS | STEP_UP INT
+downward_step: STEP_DOWNS | STEP_DOWN INT
+upward_degree: DEGREE_UPS | DEGREE_UP INT
+downward_degree: DEGREE_DOWNS | DEGREE_DOWN INT
+ratio_tune: "%" ratio
+
+duration: dot_duration | ratio_duration | scale_duration
+dot_duration: DOT+
+ratio_duration: ":" ratio
+scale_duration: ":*" ratio
+
+repetition: "*" POSITIVE_INT
+
+ratio: POSITIVE_INT ("/" POSITIVE_INT)?
+expression: CARDINAL | WORD | WORD "(" args? ")" | "{" modified+ "}"
+args: modified+
+
+EMPHASIS: "!"
+ABSOLUTE: "@"
+OCTAVE_UP: "'"
+OCTAVE_UPS: /\'+/
+OCTAVE_DOWN: ","
+OCTAVE_DOWNS: /,+/
+STEP_UP: "+"
+STEP_UPS: /\++/
+STEP_DOWN: "-"
+STEP_DOWNS: /-+/
+DEGREE_UP: ">"
+DEGREE_UPS: />+/
+DEGREE_DOWN: "<"
+DEGREE_DOWNS: /<+/
+DOT: "."
+
+INT: /(0|[1-9][0-9]*)/
+POSITIVE_INT: /[1-9][0-9]*/
+WORD: /[\p{L}_#][\p{L}_#0-9]*/
+CARDINAL: /[0-9][\p{L}_#0-9]+/
+
+WS: /[ \t]/+
+BLANK: /(\n|\|[^\n]*\n)/
+BLANK_END: /(\n|\|[^\n]*\n|\|[^\n]*)/
+
+%ignore WS
+"""
+
+original_parser = lark.Lark(original_grammar, regex=True)
+
+# The one intended change: a single sign directly followed by digits that run
+# into more digits or a word (">3do", "<20", "-3rd") is read greedily as a
+# count, where the original grammar resolved it either way.
+changed_reading = re.compile(r"(?<![-+',<>])[-+',<>][ \t]*[0-9][0-9\w#]")
+
+
+def original_outcome(source):
+    try:
+        tree = original_parser.parse(source)
+    except lark.exceptions.LarkError:
+        return ParsingError
+    for assign in tree.find_data("assign"):
+        word = assign.children[0]
+        assign.children[0] = lark.lexer.Token.new_borrow_pos("FUNCTION", word, word)
+    try:
+        comments = [str(x) for x in get_comments(tree)]
+        passages = [
+            to_ast(x) for x in tree.children if not isinstance(x, lark.lexer.Token)
+        ]
+    except DoremiError as err:
+        return type(err)
+    return passages, comments
+
+
+@pytest.mark.parametrize("source", sources)
+def test_lalr_matches_original_grammar(source):
+    assert outcome(source, "lalr") == original_outcome(source)
+
+
+def test_lalr_matches_original_grammar_random():
+    rng = random.Random(12345)
+    checked = 0
+    for _ in range(1000):
+        source = random_source(rng)
+        if not changed_reading.search(source):
+            assert outcome(source, "lalr") == original_outcome(source), source
+            checked += 1
+    assert checked > 500
+
+    for source in ["re>3rd>>", "_<20-3rd", "do>32-", "3rd>32x+12th--\n\n"]:
+        assert changed_reading.search(source)
+        assert outcome(source, "lalr") != original_outcome(source), source